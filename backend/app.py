@@ -1,66 +1,102 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, HTMLResponse, StreamingResponse, JSONResponse
+from contextlib import asynccontextmanager
+from datetime import date
 from pydantic import BaseModel
-from passlib.context import CryptContext
 from typing import Optional
 from test1 import EmotionalSupportService
-import asyncio
-from dotenv import load_dotenv
-import os
-from auth import router as auth_router, get_current_user
-from pathlib import Path
+from models.context import number_messages
+from auth import router as auth_router, get_current_user, require_admin
+from config import Settings, get_settings, set_settings
 from db.database import Database
 from models.user_preferences import UserPreferences
-from models.user_activity import UserActivity
 from db.operations import UserOperations
-from utils.encryption import encrypt_data, decrypt_data
+from db.transfer import UserDataTransfer
+from utils.encryption import FieldEncryptor
+from utils.usage import UsageTracker
+from utils.checkins import CheckInScheduler
+from utils.analytics import MoodAnalytics
+from utils.metrics import MetricsMiddleware, render_metrics
+from utils.responses import FastJSONResponse, GZipMiddleware
+from utils.tracing import Tracer, TracingMiddleware, render_waterfall
+import asyncio
 import logging
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Get the absolute path to the backend directory
-BASE_DIR = Path(__file__).resolve().parent
+router = APIRouter()
 
-# Load environment variables from .env file
-load_dotenv(BASE_DIR / '.env')
+def get_service() -> EmotionalSupportService:
+    return EmotionalSupportService.get_instance()
 
-app = FastAPI()
-
-@app.on_event("startup")
-async def startup_db_client():
+@asynccontextmanager
+async def lifespan(app: FastAPI):
     try:
         logger.info("Starting up database connection...")
         await Database.connect_db()
+        await Database.init_indexes()
         logger.info("Database connection established successfully")
     except Exception as e:
         logger.error(f"Failed to connect to database: {str(e)}")
         raise
+    encryptor = FieldEncryptor.get_instance()
+    if not encryptor.enabled:
+        if await encryptor.has_data_keys():
+            # Without the key every turn for those users would fail to decrypt
+            raise RuntimeError("ENCRYPTION_KEY not set but encrypted data exists, refusing to start")
+        logger.warning("ENCRYPTION_KEY not set, conversations and contexts are stored unencrypted")
+    UsageTracker.get_instance().start()
+    MoodAnalytics.get_instance().start()
+    if CheckInScheduler.should_run(get_settings()):
+        await CheckInScheduler.get_instance().start()
+
+    yield
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
+    if CheckInScheduler._instance is not None:
+        await CheckInScheduler.get_instance().stop()
+    await MoodAnalytics.get_instance().stop()
+    await UsageTracker.get_instance().stop()
     await Database.close_db()
 
-# Configure CORS with more specific settings
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:5173", "http://localhost:3000"],  # Add your frontend URL
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+def create_app(settings: Optional[Settings] = None) -> FastAPI:
+    """Build the API. Clients (OpenAI, Motor, encryption keys) are created lazily or in the lifespan"""
+    if settings is not None:
+        set_settings(settings)
+    settings = get_settings()
 
-# Load API key from environment variable
-API_KEY = os.getenv("OPENAI_API_KEY")
-if not API_KEY:
-    raise ValueError("OPENAI_API_KEY environment variable not set")
+    app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
 
-# Initialize the service
-service = EmotionalSupportService.get_instance(API_KEY)
+    # Configure CORS with more specific settings
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=settings.cors_origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        # Read by the frontend to sync conversation history incrementally
+        expose_headers=["ETag"],
+    )
 
-# Mount the auth router with a prefix
-app.include_router(auth_router, prefix="/api/auth", tags=["auth"])
+    # Gzip large JSON bodies (conversation history, activity logs) for clients that accept it
+    app.add_middleware(
+        GZipMiddleware,
+        minimum_size=settings.gzip_minimum_size,
+        compresslevel=settings.gzip_level
+    )
+
+    # Sampled request tracing, send `X-Trace: <TRACE_FORCE_TOKEN>` to force a trace for one request
+    app.add_middleware(TracingMiddleware)
+
+    # Record request latency per route, added last so it wraps every other middleware
+    app.add_middleware(MetricsMiddleware)
+
+    # Mount the auth router with a prefix
+    app.include_router(auth_router, prefix="/api/auth", tags=["auth"])
+    app.include_router(router)
+    return app
 
 class DiaryEntry(BaseModel):
     user_id: str
@@ -69,41 +105,85 @@ class DiaryEntry(BaseModel):
 class ChatResponse(BaseModel):
     response: str
     context: dict
+    seq: Optional[int] = None
 
-@app.post("/api/diary-entry", response_model=ChatResponse)
-async def process_diary_entry(entry: DiaryEntry):
+@router.post("/api/diary-entry", response_model=ChatResponse)
+async def process_diary_entry(
+    entry: DiaryEntry,
+    service: EmotionalSupportService = Depends(get_service),
+    current_user: dict = Depends(get_current_user)
+):
+    user_id = current_user["_id"]
+    if entry.user_id != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to write entries for this user")
+    # Keyed on the authenticated user, a client-sent id would let anyone spend another user's quota
+    if not await UsageTracker.get_instance().check_quota(user_id):
+        raise HTTPException(status_code=429, detail="Daily token quota exceeded")
     try:
         response = await service.get_support_response(
-            user_id=entry.user_id,
+            user_id=user_id,
             user_message=entry.content
         )
         if "error" in response:
             raise HTTPException(status_code=500, detail=response["error"])
-        return response
+        # Returned as a response so FastAPI skips validating and re-encoding it
+        return FastJSONResponse(response)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/user-context/{user_id}")
-async def get_user_context(user_id: str):
+@router.get("/api/user-context/{user_id}")
+async def get_user_context(user_id: str, service: EmotionalSupportService = Depends(get_service)):
     try:
-        context = service._load_context(user_id)
-        return context.model_dump(exclude_none=True)
+        context = await service._load_context(user_id)
+        return context.to_dict()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/conversation-history/{user_id}")
-async def get_conversation_history(user_id: str):
+def etag_matches(request: Request, etag: str) -> bool:
+    """Weak If-None-Match comparison, the body may be sent gzipped or not"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+@router.get("/api/conversation-history/{user_id}")
+async def get_conversation_history(
+    user_id: str,
+    request: Request,
+    since: Optional[int] = None,
+    service: EmotionalSupportService = Depends(get_service)
+):
+    """Messages newer than since, or the whole history without it
+
+    The ETag is the newest sequence id, so an unchanged history costs one
+    projected lookup and a 304 with no decryption. A since ahead of the server
+    (the history was deleted) returns the whole history for the client to replace.
+    """
     try:
-        history = service._load_conversation(user_id)
-        return history
+        history = None
+        head = await service._conversation_head(user_id)
+        if head is None:
+            history, head = await service._load_conversation(user_id)
+        headers = {"ETag": f'W/"{head}"', "Cache-Control": "no-cache"}
+        if etag_matches(request, headers["ETag"]) or since == head:
+            return Response(status_code=304, headers=headers)
+
+        if history is None:
+            history, head = await service._load_conversation(user_id)
+            # A turn may have been saved since the head lookup
+            headers["ETag"] = f'W/"{head}"'
+        return FastJSONResponse(number_messages(history, head, since), headers=headers)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/")
+@router.get("/")
 async def root():
     return {"message": "Welcome to MoodScribe API"}
 
-@app.post("/api/preferences")
+@router.post("/api/preferences")
 async def save_preferences(
     preferences: UserPreferences,
     current_user: dict = Depends(get_current_user)
@@ -114,12 +194,12 @@ async def save_preferences(
         raise HTTPException(status_code=500, detail="Failed to save preferences")
     return {"message": "Preferences saved successfully"}
 
-@app.get("/api/suggestions")
+@router.get("/api/suggestions")
 async def get_suggestions(current_user: dict = Depends(get_current_user)):
     suggestions = await UserOperations.get_well_being_suggestions(str(current_user["_id"]))
     return suggestions
 
-@app.get("/api/activity-log")
+@router.get("/api/activity-log")
 async def get_activity_log(
     current_user: dict = Depends(get_current_user),
     limit: int = 10
@@ -128,15 +208,16 @@ async def get_activity_log(
     activities = await db.user_activities.find(
         {"user_id": str(current_user["_id"])}
     ).sort("timestamp", -1).limit(limit).to_list(length=limit)
-    return activities
+    # ObjectId and datetime are encoded directly, jsonable_encoder fails on ObjectId
+    return FastJSONResponse(activities)
 
-@app.get("/api/preferences/{user_id}")
+@router.get("/api/preferences/{user_id}")
 async def get_preferences(user_id: str, current_user: dict = Depends(get_current_user)):
     if current_user["_id"] != user_id:
         raise HTTPException(status_code=403, detail="Not authorized to access these preferences")
     return await UserOperations.get_preferences(user_id)
 
-@app.put("/api/preferences/{user_id}")
+@router.put("/api/preferences/{user_id}")
 async def update_preferences(
     user_id: str, 
     preferences: UserPreferences,
@@ -149,6 +230,76 @@ async def update_preferences(
         raise HTTPException(status_code=500, detail="Failed to update preferences")
     return {"message": "Preferences updated successfully"}
 
-@app.get("/api/health")
+@router.get("/api/export")
+async def export_user_data(
+    compress: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    user_id = str(current_user["_id"])
+    extension = "ndjson.gz" if compress else "ndjson"
+    return StreamingResponse(
+        UserDataTransfer.iter_ndjson(user_id, compress=compress, include_credentials=False, decrypt=True),
+        media_type="application/gzip" if compress else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="moodscribe-export-{user_id}.{extension}"'}
+    )
+
+@router.get("/api/health")
 async def health_check():
-    return {"status": "healthy"} 
\ No newline at end of file
+    settings = get_settings()
+    mongo = {"pool": Database.pool_stats()}
+    try:
+        mongo["ping_ms"] = round(await Database.ping(settings.health_ping_timeout), 2)
+    except Exception as e:
+        mongo["error"] = str(e) or type(e).__name__
+        return JSONResponse(status_code=503, content={"status": "unhealthy", "mongo": mongo})
+
+    saturation = mongo["pool"]["saturation"] or 0
+    status = "degraded" if saturation >= settings.health_pool_saturation_threshold else "healthy"
+    return {"status": status, "mongo": mongo}
+
+@router.get("/api/admin/usage")
+async def get_usage_report(
+    user_id: Optional[str] = None,
+    limit: int = 20,
+    admin: dict = Depends(require_admin)
+):
+    try:
+        return await UsageTracker.get_instance().get_report(user_id=user_id, limit=limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/api/admin/analytics/mood")
+async def get_mood_analytics(
+    dimension: str = "all",
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    value: Optional[str] = None,
+    admin: dict = Depends(require_admin)
+):
+    """Mood distribution by day ("all"), activity_level or genre, read from the summaries"""
+    try:
+        return await MoodAnalytics.get_instance().query(dimension, start, end, value)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/api/admin/checkins")
+async def get_checkin_stats(admin: dict = Depends(require_admin)):
+    if CheckInScheduler._instance is None:
+        return {"enabled": False}
+    return {"enabled": True, **CheckInScheduler.get_instance().get_stats()}
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@router.get("/debug/traces/{trace_id}", include_in_schema=False)
+async def get_trace(trace_id: str, format: str = "html", admin: dict = Depends(require_admin)):
+    # May scan the trace files, kept off the event loop
+    trace = await asyncio.to_thread(Tracer.get_instance().get_trace, trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    if format == "json":
+        return trace
+    return HTMLResponse(render_waterfall(trace))
+
+app = create_app()
@@ -1,46 +1,27 @@
-from fastapi import APIRouter, HTTPException, Depends, Security
+from fastapi import APIRouter, HTTPException, Depends, Security, Request
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel
-from passlib.context import CryptContext
-from datetime import datetime, timedelta
+from datetime import datetime
 from jose import jwt, JWTError
 from typing import Optional
 import json
-import os
-from pathlib import Path
-from dotenv import load_dotenv
 from db.database import Database
 from db.operations import UserOperations
 from models.user_preferences import UserPreferences
 import logging
 from fastapi.middleware.cors import CORSMiddleware
-from utils.security import pwd_context, create_access_token
+from utils.security import pwd_context, create_access_token, verify_token, get_secret_key
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from utils.tracing import span
+from utils.ratelimit import AuthRateLimiter
+from config import get_settings
 
 logger = logging.getLogger(__name__)
 
-# Get the absolute path to the backend directory
-BASE_DIR = Path(__file__).resolve().parent
-
-# Load environment variables from .env file
-load_dotenv(BASE_DIR / '.env')
-
-SECRET_KEY = os.getenv("JWT_SECRET_KEY")
-print(f"Current working directory: {os.getcwd()}")
-print(f"Looking for .env file in: {BASE_DIR}")
-print(f"JWT_SECRET_KEY loaded: {'Yes' if SECRET_KEY else 'No'}")
-
-if not SECRET_KEY:
-    raise ValueError("JWT_SECRET_KEY environment variable not set")
-
 router = APIRouter()
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-# Configuration
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
-
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -55,7 +36,8 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        with span("auth.jwt_decode"):
+            payload = jwt.decode(token, get_secret_key(), algorithms=[get_settings().jwt_algorithm])
         user_id: str = payload.get("sub")
         if user_id is None:
             raise credentials_exception
@@ -63,7 +45,8 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         raise credentials_exception
 
     db = Database.get_db()
-    user = await db.users.find_one({"_id": user_id})
+    with span("db.users_lookup"):
+        user = await db.users.find_one({"_id": ObjectId(user_id) if ObjectId.is_valid(user_id) else user_id})
     if user is None:
         raise credentials_exception
         
@@ -71,6 +54,12 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     user["_id"] = str(user["_id"])
     return user
 
+async def require_admin(current_user: dict = Depends(get_current_user)):
+    """Only let through users flagged as admin or listed in ADMIN_USERNAMES"""
+    if not current_user.get("is_admin") and current_user.get("username") not in get_settings().admin_usernames:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
 class UserCreate(BaseModel):
     email: str
     username: str
@@ -96,69 +85,67 @@ async def get_user_from_db(username: str) -> Optional[dict]:
         print(f"Error fetching user: {e}")
         return None
 
+def duplicate_detail(error: DuplicateKeyError) -> str:
+    """Turn a unique index violation on users into the message the client sees"""
+    key_pattern = (error.details or {}).get("keyPattern") or {}
+    if "email" in key_pattern or "email_1" in str(error):
+        return "Email already registered"
+    return "Username already registered"
+
+def build_user_doc(user: dict) -> dict:
+    """The users document for a registration payload, hashing the password"""
+    return {
+        "username": user["username"],
+        "email": user["email"],
+        "hashed_password": pwd_context.hash(user["password"]),
+        "name": user["name"],
+        "created_at": datetime.now()
+    }
+
 async def save_user_to_db(user_data: dict):
     try:
-        users_collection = Database.get_db().users
-        # Check if username already exists
-        existing_user = await users_collection.find_one({"username": user_data["username"]})
-        if existing_user:
-            raise HTTPException(status_code=400, detail="Username already exists")
-            
-        result = await users_collection.insert_one(user_data)
-        return str(result.inserted_id)
+        # The unique index on username rejects duplicates, no need to read first
+        return await UserOperations.create_user(user_data)
+    except DuplicateKeyError as e:
+        raise HTTPException(status_code=400, detail=duplicate_detail(e))
     except Exception as e:
         print(f"Error saving user: {e}")
         raise e
 
-def create_access_token(data: dict, expires_delta: timedelta | None = None):
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
-
 class UserRegistration(BaseModel):
     user: dict
     preferences: dict = {}
 
+def too_many_attempts(retry_after: int) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail="Too many attempts, please try again later",
+        headers={"Retry-After": str(retry_after)}
+    )
+
 @router.post("/register")
-async def register_user(registration_data: UserRegistration):
+async def register_user(registration_data: UserRegistration, request: Request):
+    # Rejected before the password is hashed, so abusive traffic costs no bcrypt time
+    limiter = AuthRateLimiter.get_instance()
+    ip = limiter.client_ip(request)
+    _, retry_after = await limiter.register_ip.attempt(ip)
+    if retry_after:
+        await limiter.record_suspicious(limiter.register_ip, ip, f"ip:{ip}", "register_rate_limited", request)
+        raise too_many_attempts(retry_after)
+
     try:
-        # Ensure database is connected
-        if Database.client is None:
-            await Database.connect_db()
-        
         # Extract user and preferences data
         user = registration_data.user
         preferences = registration_data.preferences
         
-        # Check if username already exists
-        db = Database.get_db()
-        existing_user = await db.users.find_one({"username": user["username"]})
-        if existing_user:
-            raise HTTPException(status_code=400, detail="Username already registered")
-        
-        # Create user
-        hashed_password = pwd_context.hash(user["password"])
-        user_doc = {
-            "username": user["username"],
-            "email": user["email"],
-            "hashed_password": hashed_password,
-            "name": user["name"],
-            "created_at": datetime.now()
-        }
-        
-        result = await db.users.insert_one(user_doc)
-        user_id = str(result.inserted_id)
-        
-        # Save preferences with user_id if provided
+        # Validate preferences before anything is written, user_id is filled in on insert
+        user_preferences = None
         if preferences:
-            preferences["user_id"] = user_id
-            preferences["name"] = user["name"]
-            await UserOperations.save_preferences(UserPreferences(**preferences))
+            user_preferences = UserPreferences(**{**preferences, "user_id": "", "name": user["name"]})
+        
+        # Duplicate usernames and emails are rejected by the unique indexes
+        user_doc = await limiter.hash_password(build_user_doc, user)
+        user_id = await UserOperations.create_user(user_doc, user_preferences)
         
         # Create initial token
         access_token = create_access_token(data={"sub": user_id})
@@ -168,6 +155,10 @@ async def register_user(registration_data: UserRegistration):
             "token_type": "bearer",
             "user_id": user_id
         }
+    except DuplicateKeyError as e:
+        raise HTTPException(status_code=400, detail=duplicate_detail(e))
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Registration error: {str(e)}")
         raise HTTPException(status_code=400, detail=str(e))
@@ -177,25 +168,38 @@ class LoginCredentials(BaseModel):
     password: str
 
 @router.post("/login")
-async def login_user(credentials: LoginCredentials):
+async def login_user(credentials: LoginCredentials, request: Request):
     logger.info(f"Login attempt for user: {credentials.username}")
+    # Cheap rejection path, runs before the user lookup and any bcrypt work
+    limiter = AuthRateLimiter.get_instance()
+    ip = limiter.client_ip(request)
+    username = credentials.username
+    _, retry_after = await limiter.login_ip.attempt(ip)
+    if retry_after:
+        await limiter.record_suspicious(limiter.login_ip, ip, f"ip:{ip}", "login_rate_limited", request)
+        raise too_many_attempts(retry_after)
+    # Counted before the password is checked, refunded below when it is correct
+    username_counter, retry_after = await limiter.login_username.attempt(username)
+    if retry_after:
+        await limiter.record_suspicious(
+            limiter.login_username, username, f"username:{username}", "login_rate_limited", request
+        )
+        raise too_many_attempts(retry_after)
+
     try:
-        # Ensure database is connected
-        if Database.client is None:
-            await Database.connect_db()
-        
         # Get user from database
         db = Database.get_db()
-        user = await db.users.find_one({"username": credentials.username})
+        user = await db.users.find_one({"username": username})
         
         if not user:
-            logger.warning(f"User not found: {credentials.username}")
+            logger.warning(f"User not found: {username}")
             raise HTTPException(status_code=401, detail="Invalid username or password")
         
-        # Verify password
-        if not pwd_context.verify(credentials.password, user["hashed_password"]):
-            logger.warning(f"Invalid password for user: {credentials.username}")
+        # Verify password in a thread so the event loop keeps serving other requests
+        if not await limiter.hash_password(pwd_context.verify, credentials.password, user["hashed_password"]):
+            logger.warning(f"Invalid password for user: {username}")
             raise HTTPException(status_code=401, detail="Invalid username or password")
+        await limiter.login_username.refund(username_counter)
         
         # Create access token
         user_id = str(user["_id"])
@@ -208,12 +212,14 @@ async def login_user(credentials: LoginCredentials):
             "user_id": user_id
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Login error: {str(e)}")
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/me")
-async def get_current_user(token: str = Depends(oauth2_scheme)):
+async def read_current_user(token: str = Depends(oauth2_scheme)):
     try:
         payload = verify_token(token)
         if not payload:
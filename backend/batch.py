@@ -0,0 +1,181 @@
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, Iterator, Optional, Set
+import asyncio
+import csv
+import json
+import os
+import time
+from test1 import EmotionalSupportService
+from db.database import Database
+
+MODE_REPLY = "reply"
+MODE_MOOD = "mood"
+
+
+class BatchEntry:
+    __slots__ = ("key", "user_id", "content", "when")
+
+    def __init__(self, key: str, user_id: str, content: str, when: Optional[datetime] = None):
+        self.key = key
+        self.user_id = user_id
+        self.content = content
+        self.when = when
+
+
+def read_entries(path: str) -> Iterator[BatchEntry]:
+    """Stream entries from a JSONL or CSV file, each needs user_id and content
+
+    id is optional, as is an ISO date or created_at the entry was written at,
+    used to count its mood on that day in the analytics.
+    """
+    is_csv = path.lower().endswith(".csv")
+    with open(path, newline="" if is_csv else None) as f:
+        rows = csv.DictReader(f) if is_csv else (json.loads(line) for line in f if line.strip())
+        for line_number, row in enumerate(rows, start=1):
+            user_id = row.get("user_id")
+            content = row.get("content")
+            if not user_id or not content:
+                print(f"Skipping entry {line_number}: missing user_id or content")
+                continue
+            written = row.get("date") or row.get("created_at")
+            try:
+                when = datetime.fromisoformat(written) if written else None
+            except (TypeError, ValueError):
+                print(f"Skipping entry {line_number}: invalid date {written!r}")
+                continue
+            # Fall back to the position in the file so checkpoints still work without ids
+            key = str(row.get("id") or row.get("entry_id") or line_number)
+            yield BatchEntry(key, str(user_id), content, when)
+
+
+class BatchProcessor:
+    """Runs diary entries through the service, concurrently across users but in order per user"""
+
+    def __init__(self, service: EmotionalSupportService, output_path: str,
+                 checkpoint_path: Optional[str] = None, concurrency: int = 8,
+                 mode: str = MODE_REPLY, max_buffered: Optional[int] = None,
+                 report_interval: float = 10.0):
+        self.service = service
+        self.output_path = output_path
+        self.checkpoint_path = checkpoint_path or f"{output_path}.checkpoint"
+        self.concurrency = concurrency
+        self.mode = mode
+        self.max_buffered = max_buffered or concurrency * 20
+        self.report_interval = report_interval
+
+        self._queues: Dict[str, Deque[BatchEntry]] = {}
+        self._workers: Set[asyncio.Task] = set()
+        self.processed = 0
+        self.failed = 0
+        self.skipped = 0
+
+    def _load_checkpoint(self) -> Set[str]:
+        if not os.path.exists(self.checkpoint_path):
+            return set()
+        with open(self.checkpoint_path) as f:
+            return {line.strip() for line in f if line.strip()}
+
+    async def _process(self, entry: BatchEntry) -> Dict:
+        started = time.perf_counter()
+        result = {"id": entry.key, "user_id": entry.user_id}
+        # Remembered on the user's context, an entry retried after its context was
+        # saved is not applied twice. Scoped to the mode and checkpoint like the key is
+        entry_key = f"{self.mode}:{os.path.basename(self.checkpoint_path)}:{entry.key}"
+        try:
+            # Strict so a failed detection is reported as an error and retried on resume
+            if self.mode == MODE_MOOD:
+                context = await self.service._update_context(
+                    entry.user_id, entry.content, strict=True, when=entry.when, entry_key=entry_key
+                )
+                result["mood"] = context.mood
+                result["recommended_genres"] = context.recommended_genres
+            else:
+                response = await self.service.get_support_response(
+                    entry.user_id, entry.content, entry.when, strict=True, entry_key=entry_key
+                )
+                if "error" in response:
+                    raise RuntimeError(response.get("details") or response["error"])
+                result["response"] = response["response"]
+                result["context"] = response["context"]
+            result["status"] = "ok"
+        except Exception as e:
+            result["status"] = "error"
+            result["error"] = str(e)
+        result["latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return result
+
+    async def _user_worker(self, user_id: str):
+        queue = self._queues[user_id]
+        async with self._worker_slots:
+            while queue:
+                entry = queue.popleft()
+                result = await self._process(entry)
+                self._output.write(json.dumps(result, default=str) + "\n")
+                if result["status"] == "ok":
+                    self.processed += 1
+                    # Only successful entries are checkpointed so failures are retried on resume
+                    self._checkpoint.write(entry.key + "\n")
+                else:
+                    self.failed += 1
+                self._buffered.release()
+        # Nothing awaits between the empty check and here, so no entry can be lost
+        del self._queues[user_id]
+
+    async def _report_progress(self, started: float):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            self._print_progress(started)
+
+    def _print_progress(self, started: float):
+        elapsed = time.perf_counter() - started
+        rate = self.processed / elapsed if elapsed else 0
+        print(f"[{elapsed:7.1f}s] processed={self.processed} failed={self.failed} "
+              f"skipped={self.skipped} active_users={len(self._queues)} rate={rate:.2f}/s", flush=True)
+
+    async def run(self, input_path: str) -> Dict:
+        done = self._load_checkpoint()
+        self._worker_slots = asyncio.Semaphore(self.concurrency)
+        # Bounds how many entries are read ahead of processing so memory stays flat
+        self._buffered = asyncio.Semaphore(self.max_buffered)
+
+        started = time.perf_counter()
+        reporter = asyncio.create_task(self._report_progress(started))
+        with open(self.output_path, "a", buffering=1) as self._output, \
+                open(self.checkpoint_path, "a", buffering=1) as self._checkpoint:
+            for entry in read_entries(input_path):
+                if entry.key in done:
+                    self.skipped += 1
+                    continue
+                await self._buffered.acquire()
+                queue = self._queues.get(entry.user_id)
+                if queue is None:
+                    queue = self._queues[entry.user_id] = deque()
+                    task = asyncio.create_task(self._user_worker(entry.user_id))
+                    self._workers.add(task)
+                    task.add_done_callback(self._workers.discard)
+                queue.append(entry)
+            while self._workers:
+                await asyncio.gather(*list(self._workers))
+        reporter.cancel()
+        self._print_progress(started)
+
+        elapsed = time.perf_counter() - started
+        return {
+            "processed": self.processed,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "elapsed_s": round(elapsed, 2),
+            "throughput_per_s": round(self.processed / elapsed, 2) if elapsed else None
+        }
+
+
+async def run_batch(input_path: str, output_path: str, checkpoint_path: Optional[str] = None,
+                    concurrency: int = 8, mode: str = MODE_REPLY) -> Dict:
+    await Database.connect_db()
+    service = EmotionalSupportService.get_instance()
+    try:
+        processor = BatchProcessor(service, output_path, checkpoint_path, concurrency, mode)
+        return await processor.run(input_path)
+    finally:
+        await service.flush()
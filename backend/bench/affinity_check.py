@@ -0,0 +1,87 @@
+from typing import Dict
+import argparse
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+
+# Run from the backend directory: python -m bench.affinity_check
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+from jose import jwt
+from supervisor import Supervisor
+
+
+async def echo_app(scope, receive, send):
+    """Worker app for the check, reports which process answered"""
+    if scope["type"] != "http":
+        return
+    while (await receive()).get("more_body", False):
+        pass
+    body = json.dumps({"worker": os.environ.get("WORKER_NAME"), "pid": os.getpid()}).encode()
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", b"application/json")]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def assign(client, users: int) -> Dict[str, str]:
+    """Send each user's requests in every shape the proxy routes on, return user -> worker"""
+    assignment, violations = {}, 0
+    for i in range(users):
+        user_id = f"user-{i}"
+        token = jwt.encode({"sub": user_id}, "affinity-check")
+        responses = await asyncio.gather(
+            client.get(f"/api/conversation-history/{user_id}"),
+            client.post("/api/diary-entry", json={"user_id": user_id, "content": "hello"}),
+            client.get("/api/activity-log", headers={"Authorization": f"Bearer {token}"}),
+        )
+        workers = {r.json()["worker"] for r in responses} | {r.headers["x-worker"] for r in responses}
+        if len(workers) != 1:
+            violations += 1
+        assignment[user_id] = workers.pop()
+    if violations:
+        raise AssertionError(f"{violations} users were served by more than one worker")
+    return assignment
+
+
+async def run(args) -> Dict:
+    import httpx
+    supervisor = Supervisor(args.workers, args.base_port, "bench.affinity_check:echo_app",
+                            drain_seconds=0)
+    await supervisor.start()
+    try:
+        transport = httpx.ASGITransport(app=supervisor)
+        async with httpx.AsyncClient(transport=transport, base_url="http://proxy") as client:
+            before = await assign(client, args.users)
+            scaled = await supervisor.scale(args.workers + 1)
+            after = await assign(client, args.users)
+    finally:
+        await supervisor.stop()
+
+    moved = sum(before[u] != after[u] for u in before)
+    per_worker = {}
+    for worker in after.values():
+        per_worker[worker] = per_worker.get(worker, 0) + 1
+    return {
+        "config": vars(args),
+        "affinity": "ok",
+        "moved_share": round(moved / args.users, 4),
+        "expected_moved_share": round(1 / (args.workers + 1), 4),
+        "ring_moved_share": scaled["moved"],
+        "users_per_worker": per_worker,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check per-user worker affinity and rebalancing on scale-out")
+    parser.add_argument("--workers", type=int, default=3, help="Workers before scaling out by one")
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--base-port", type=int, default=8600)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
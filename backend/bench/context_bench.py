@@ -0,0 +1,128 @@
+from typing import Callable, Dict, List
+import argparse
+import gc
+import json
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+# Run from the backend directory: python -m bench.context_bench
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+from bench.loadtest import summarize
+from models.context import ContextState
+from test1 import UserContext, MOOD_TO_GENRES
+
+ACTIVITIES = ["walking", "reading", "gaming", "cooking", "running", "painting", "yoga"]
+GOALS = ["sleep better", "exercise more", "journal daily", "call family"]
+
+
+def build_documents(users: int, window: int, message_length: int, seed: int = 7):
+    """Context and message documents as they come back from MongoDB, fresh strings per user"""
+    rng = random.Random(seed)
+    text = ("I had a long day and I want to write about it. " * 20)[:message_length]
+    contexts, windows = [], []
+    for _ in range(users):
+        mood = rng.choice(list(MOOD_TO_GENRES))
+        # "".join builds new string objects, like decoding BSON or JSON does
+        contexts.append({
+            "mood": "".join(mood),
+            "recent_activities": ["".join(a) for a in rng.sample(ACTIVITIES, 3)],
+            "favorite_genres": ["".join(g) for g in rng.sample(MOOD_TO_GENRES["happy"], 2)],
+            "stress_level": rng.randint(1, 10),
+            "goals": ["".join(g) for g in rng.sample(GOALS, 2)],
+            "recommended_genres": ["".join(g) for g in MOOD_TO_GENRES[mood]],
+        })
+        windows.append([
+            {"role": "".join("user" if i % 2 == 0 else "assistant"), "content": text}
+            for i in range(window)
+        ])
+    return contexts, windows
+
+
+def measure_memory(build: Callable[[], List]) -> int:
+    """Bytes still allocated by the objects build() returns"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = build()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del kept
+    return size
+
+
+def time_per_call(fn: Callable[[], object], iterations: int) -> Dict:
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return summarize(timings)
+
+
+def legacy_turn(context: UserContext, window: List[Dict]):
+    # What a turn used to do: two exclude_none dumps for the prompt, one for the response,
+    # a full dump to save, and the window copied into the prompt
+    if context.model_dump(exclude_none=True):
+        json.dumps(context.model_dump(exclude_none=True))
+    context.model_dump(exclude_none=True)
+    context.model_dump()
+    list(window[-20:])
+
+
+def compact_turn(context: ContextState, window: List[Dict]):
+    # Stored message dicts go into the prompt and back into the document unconverted
+    context_dict = context.to_dict()
+    if context_dict:
+        json.dumps(context_dict)
+    list(window[-20:])
+    context.to_document()
+
+
+def run(args) -> Dict:
+    contexts, windows = build_documents(args.users, args.window, args.message_length)
+
+    # Message windows are the stored dicts in both, only the context representation differs.
+    # ContextState keeps the lists of the document it was loaded from instead of copying them
+    legacy_bytes = measure_memory(lambda: [UserContext(**c) for c in contexts])
+    compact_bytes = measure_memory(lambda: [ContextState.from_dict(c) for c in contexts])
+
+    legacy_context, compact_context, window = UserContext(**contexts[0]), ContextState.from_dict(contexts[0]), windows[0]
+
+    return {
+        "config": vars(args),
+        "memory": {
+            "legacy_bytes": legacy_bytes,
+            "compact_bytes": compact_bytes,
+            "legacy_bytes_per_user": legacy_bytes // args.users,
+            "compact_bytes_per_user": compact_bytes // args.users,
+            "ratio": round(legacy_bytes / compact_bytes, 3) if compact_bytes else None,
+        },
+        "load": {
+            "legacy": time_per_call(lambda: UserContext(**contexts[0]), args.iterations),
+            "compact": time_per_call(lambda: ContextState.from_dict(contexts[0]), args.iterations),
+        },
+        "serialize_per_turn": {
+            "legacy": time_per_call(lambda: legacy_turn(legacy_context, window), args.iterations),
+            "compact": time_per_call(lambda: compact_turn(compact_context, window), args.iterations),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare pydantic and compact context and message representations")
+    parser.add_argument("--users", type=int, default=10000, help="Users held in memory for the allocation test")
+    parser.add_argument("--window", type=int, default=50, help="Messages per user")
+    parser.add_argument("--message-length", type=int, default=400, help="Characters per message")
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+    print(json.dumps(run(args), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+from typing import List
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+# Run from the backend directory: python -m bench.encryption_bench
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+from cryptography.fernet import Fernet
+from bench.fakes import FakeMongoClient
+from bench.loadtest import summarize
+from db.database import Database
+from utils.encryption import FieldEncryptor
+
+
+def build_window(size: int, message_length: int) -> List[dict]:
+    text = ("I had a long day and I want to write about it. " * 20)[:message_length]
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": text}
+        for i in range(size)
+    ]
+
+
+async def run(args) -> dict:
+    client = FakeMongoClient(latency=0)
+    Database.client = client
+    Database.db = client["bench"]
+
+    encryptor = FieldEncryptor([Fernet.generate_key().decode()])
+    window = build_window(args.window, args.message_length)
+    context = {"mood": "stressed", "recommended_genres": ["animation", "fantasy"], "stress_level": 7}
+
+    # Warm the data key cache, the steady state of an active user
+    await encryptor.encrypt("bench_user", window)
+
+    results = {}
+    for name, value in (("message_window", window), ("context", context)):
+        encrypt_times, decrypt_times = [], []
+        token = None
+        for _ in range(args.iterations):
+            started = time.perf_counter()
+            token = await encryptor.encrypt("bench_user", value)
+            encrypt_times.append((time.perf_counter() - started) * 1000)
+
+            started = time.perf_counter()
+            await encryptor.decrypt("bench_user", token)
+            decrypt_times.append((time.perf_counter() - started) * 1000)
+        results[name] = {
+            "plaintext_bytes": len(json.dumps(value)),
+            "token_bytes": len(token),
+            "encrypt": summarize(encrypt_times),
+            "decrypt": summarize(decrypt_times),
+        }
+
+    # One full turn loads and saves both the context and the message window
+    per_turn = sum(results[n][op]["mean_ms"] for n in results for op in ("encrypt", "decrypt"))
+    return {
+        "config": vars(args),
+        "results": results,
+        "per_turn_overhead_ms": round(per_turn, 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure per-turn field encryption overhead")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--window", type=int, default=50, help="Messages in the stored window")
+    parser.add_argument("--message-length", type=int, default=400, help="Characters per message")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,458 @@
+from typing import Any, Dict, List, Optional
+import asyncio
+import copy
+import random
+import time
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from fastapi import FastAPI
+
+
+def _get_path(doc: Dict, path: str):
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, dict):
+            value = value.get(part)
+        else:
+            return None
+    return value
+
+
+def _set_path(doc: Dict, path: str, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def _matches_condition(value, condition) -> bool:
+    if isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+        for op, expected in condition.items():
+            if op == "$eq" and value != expected:
+                return False
+            if op == "$ne" and value == expected:
+                return False
+            if op == "$gt" and not (value is not None and value > expected):
+                return False
+            if op == "$gte" and not (value is not None and value >= expected):
+                return False
+            if op == "$lt" and not (value is not None and value < expected):
+                return False
+            if op == "$lte" and not (value is not None and value <= expected):
+                return False
+            if op == "$in" and value not in expected:
+                return False
+            if op == "$nin" and value in expected:
+                return False
+            if op == "$exists" and (value is not None) != expected:
+                return False
+        return True
+    if isinstance(value, list) and not isinstance(condition, list):
+        return condition in value
+    return value == condition
+
+
+def matches(doc: Dict, query: Optional[Dict]) -> bool:
+    """Evaluate the subset of the MongoDB query language this app uses"""
+    for key, condition in (query or {}).items():
+        if key == "$and":
+            if not all(matches(doc, q) for q in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(doc, q) for q in condition):
+                return False
+        elif not _matches_condition(_get_path(doc, key), condition):
+            return False
+    return True
+
+
+def _project(doc: Dict, projection: Optional[Dict]) -> Dict:
+    if not projection:
+        return copy.deepcopy(doc)
+    include = {k for k, v in projection.items() if v and k != "_id"}
+    if include:
+        result = {k: copy.deepcopy(doc[k]) for k in include if k in doc}
+        if projection.get("_id", 1) and "_id" in doc:
+            result["_id"] = doc["_id"]
+        return result
+    result = copy.deepcopy(doc)
+    for key, value in projection.items():
+        if not value:
+            result.pop(key, None)
+    return result
+
+
+def _apply_update(doc: Dict, update: Dict, inserting: bool = False):
+    for op, fields in update.items():
+        if op == "$set":
+            for path, value in fields.items():
+                _set_path(doc, path, copy.deepcopy(value))
+        elif op == "$setOnInsert":
+            if inserting:
+                for path, value in fields.items():
+                    _set_path(doc, path, copy.deepcopy(value))
+        elif op == "$unset":
+            for path in fields:
+                doc.pop(path, None)
+        elif op == "$inc":
+            for path, amount in fields.items():
+                _set_path(doc, path, (_get_path(doc, path) or 0) + amount)
+        elif op == "$push":
+            for path, value in fields.items():
+                current = _get_path(doc, path) or []
+                if isinstance(value, dict) and "$each" in value:
+                    current = current + copy.deepcopy(value["$each"])
+                    if "$slice" in value:
+                        n = value["$slice"]
+                        current = current[n:] if n < 0 else current[:n]
+                else:
+                    current = current + [copy.deepcopy(value)]
+                _set_path(doc, path, current)
+        else:
+            raise NotImplementedError(f"Update operator {op} not supported by FakeCollection")
+
+
+class _Result:
+    def __init__(self, **kwargs):
+        self.acknowledged = True
+        self.__dict__.update(kwargs)
+
+
+class FakeCursor:
+    def __init__(self, docs: List[Dict], latency: float):
+        self._docs = docs
+        self._latency = latency
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key, direction=None):
+        keys = [(key, direction or 1)] if isinstance(key, str) else list(key)
+        for field, order in reversed(keys):
+            self._docs.sort(key=lambda d: (_get_path(d, field) is None, _get_path(d, field)),
+                            reverse=order < 0)
+        return self
+
+    def skip(self, n: int):
+        self._skip = n
+        return self
+
+    def limit(self, n: int):
+        self._limit = n
+        return self
+
+    def batch_size(self, n: int):
+        return self
+
+    def max_time_ms(self, ms: int):
+        return self
+
+    def _window(self) -> List[Dict]:
+        docs = self._docs[self._skip:]
+        return docs[:self._limit] if self._limit else docs
+
+    async def to_list(self, length: Optional[int] = None):
+        await asyncio.sleep(self._latency)
+        docs = self._window()
+        return docs[:length] if length else docs
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        await asyncio.sleep(self._latency)
+        for doc in self._window():
+            yield doc
+
+
+class FakeCollection:
+    """Async, Motor-shaped collection backed by a list of dicts"""
+
+    def __init__(self, name: str, latency: float = 0.001):
+        self.name = name
+        self.latency = latency
+        self._docs: List[Dict] = []
+        # _id is always unique, like the implicit index in MongoDB
+        self._unique: List[tuple] = [("_id",)]
+
+    async def _io(self):
+        await asyncio.sleep(self.latency)
+
+    def _check_unique(self, doc: Dict, ignore: Optional[Dict] = None):
+        for fields in self._unique:
+            values = tuple(_get_path(doc, f) for f in fields)
+            if all(v is None for v in values):
+                continue
+            for other in self._docs:
+                if other is not ignore and tuple(_get_path(other, f) for f in fields) == values:
+                    raise DuplicateKeyError(
+                        f"E11000 duplicate key error collection: {self.name} index: {fields}",
+                        11000, {"code": 11000, "keyPattern": {f: 1 for f in fields}}
+                    )
+
+    def _insert(self, doc: Dict) -> Any:
+        doc.setdefault("_id", ObjectId())
+        self._check_unique(doc)
+        self._docs.append(copy.deepcopy(doc))
+        return doc["_id"]
+
+    async def insert_one(self, doc: Dict, **kwargs):
+        await self._io()
+        return _Result(inserted_id=self._insert(doc))
+
+    async def insert_many(self, docs: List[Dict], ordered: bool = True, **kwargs):
+        await self._io()
+        inserted_ids, errors = [], []
+        for index, doc in enumerate(docs):
+            try:
+                inserted_ids.append(self._insert(doc))
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e), "keyPattern": e.details["keyPattern"]})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(inserted_ids)})
+        return _Result(inserted_ids=inserted_ids)
+
+    async def find_one(self, query: Optional[Dict] = None, projection: Optional[Dict] = None, **kwargs):
+        await self._io()
+        for doc in self._docs:
+            if matches(doc, query):
+                return _project(doc, projection)
+        return None
+
+    def find(self, query: Optional[Dict] = None, projection: Optional[Dict] = None, **kwargs):
+        docs = [_project(d, projection) for d in self._docs if matches(d, query)]
+        return FakeCursor(docs, self.latency)
+
+    def _update(self, query: Dict, update: Dict, upsert: bool, many: bool):
+        matched = [d for d in self._docs if matches(d, query)]
+        if not many:
+            matched = matched[:1]
+        for doc in matched:
+            updated = copy.deepcopy(doc)
+            _apply_update(updated, update)
+            self._check_unique(updated, ignore=doc)
+            doc.clear()
+            doc.update(updated)
+        if matched or not upsert:
+            return _Result(matched_count=len(matched), modified_count=len(matched), upserted_id=None)
+        doc = {k: v for k, v in query.items() if not k.startswith("$") and not isinstance(v, dict)}
+        _apply_update(doc, update, inserting=True)
+        return _Result(matched_count=0, modified_count=0, upserted_id=self._insert(doc))
+
+    async def update_one(self, query: Dict, update: Dict, upsert: bool = False, **kwargs):
+        await self._io()
+        return self._update(query, update, upsert, many=False)
+
+    async def update_many(self, query: Dict, update: Dict, upsert: bool = False, **kwargs):
+        await self._io()
+        return self._update(query, update, upsert, many=True)
+
+    async def replace_one(self, query: Dict, replacement: Dict, upsert: bool = False, **kwargs):
+        await self._io()
+        for doc in self._docs:
+            if matches(doc, query):
+                updated = {"_id": doc["_id"], **copy.deepcopy(replacement)}
+                self._check_unique(updated, ignore=doc)
+                doc.clear()
+                doc.update(updated)
+                return _Result(matched_count=1, modified_count=1, upserted_id=None)
+        if not upsert:
+            return _Result(matched_count=0, modified_count=0, upserted_id=None)
+        return _Result(matched_count=0, modified_count=0, upserted_id=self._insert(copy.deepcopy(replacement)))
+
+    async def find_one_and_update(self, query: Dict, update: Dict, upsert: bool = False,
+                                  projection: Optional[Dict] = None, return_document: bool = False,
+                                  **kwargs):
+        await self._io()
+        before = next((copy.deepcopy(d) for d in self._docs if matches(d, query)), None)
+        result = self._update(query, update, upsert, many=False)
+        if not return_document:
+            return _project(before, projection) if before else None
+        target = {"_id": before["_id"]} if before else {"_id": result.upserted_id}
+        after = next((d for d in self._docs if matches(d, target)), None)
+        return _project(after, projection) if after else None
+
+    async def delete_one(self, query: Dict, **kwargs):
+        await self._io()
+        for i, doc in enumerate(self._docs):
+            if matches(doc, query):
+                del self._docs[i]
+                return _Result(deleted_count=1)
+        return _Result(deleted_count=0)
+
+    async def delete_many(self, query: Dict, **kwargs):
+        await self._io()
+        before = len(self._docs)
+        self._docs = [d for d in self._docs if not matches(d, query)]
+        return _Result(deleted_count=before - len(self._docs))
+
+    async def bulk_write(self, operations: List, ordered: bool = True, **kwargs):
+        await self._io()
+        for op in operations:
+            # pymongo keeps the operation's arguments in private attributes
+            kind = type(op).__name__
+            if kind == "InsertOne":
+                self._insert(copy.deepcopy(op._doc))
+            elif kind == "ReplaceOne":
+                await self.replace_one(op._filter, op._doc, upsert=op._upsert)
+            elif kind in ("UpdateOne", "UpdateMany"):
+                self._update(op._filter, op._doc, op._upsert, many=kind == "UpdateMany")
+            else:
+                raise NotImplementedError(f"{kind} not supported by FakeCollection.bulk_write")
+        return _Result(acknowledged=True)
+
+    async def count_documents(self, query: Dict, **kwargs):
+        await self._io()
+        return sum(1 for d in self._docs if matches(d, query))
+
+    async def create_index(self, keys, unique: bool = False, **kwargs):
+        fields = tuple(k for k, _ in keys) if not isinstance(keys, str) else (keys,)
+        if unique and fields not in self._unique:
+            self._unique.append(fields)
+        return "_".join(fields)
+
+    async def drop_indexes(self):
+        self._unique = [("_id",)]
+
+    def aggregate(self, pipeline: List[Dict], **kwargs):
+        docs = [copy.deepcopy(d) for d in self._docs]
+        for stage in pipeline:
+            (op, spec), = stage.items()
+            if op == "$match":
+                docs = [d for d in docs if matches(d, spec)]
+            elif op == "$sort":
+                docs = FakeCursor(docs, 0).sort(list(spec.items()))._docs
+            elif op == "$limit":
+                docs = docs[:spec]
+            elif op == "$group":
+                docs = _group(docs, spec)
+            else:
+                raise NotImplementedError(f"Pipeline stage {op} not supported by FakeCollection")
+        return FakeCursor(docs, self.latency)
+
+    def with_options(self, **kwargs):
+        return self
+
+
+def _resolve(doc: Dict, expr):
+    if isinstance(expr, str) and expr.startswith("$"):
+        return _get_path(doc, expr[1:])
+    if isinstance(expr, dict):
+        return {k: _resolve(doc, v) for k, v in expr.items()}
+    return expr
+
+
+def _group(docs: List[Dict], spec: Dict) -> List[Dict]:
+    groups: Dict[Any, Dict] = {}
+    for doc in docs:
+        key = _resolve(doc, spec["_id"])
+        hashable = repr(key)
+        group = groups.setdefault(hashable, {"_id": key, "__values": {}})
+        for field, accumulator in spec.items():
+            if field == "_id":
+                continue
+            (op, expr), = accumulator.items()
+            group["__values"].setdefault(field, (op, []))[1].append(_resolve(doc, expr))
+    results = []
+    for group in groups.values():
+        result = {"_id": group["_id"]}
+        for field, (op, values) in group.pop("__values").items():
+            present = [v for v in values if v is not None]
+            if op == "$sum":
+                result[field] = sum(present)
+            elif op == "$avg":
+                result[field] = sum(present) / len(present) if present else None
+            elif op == "$min":
+                result[field] = min(present) if present else None
+            elif op == "$max":
+                result[field] = max(present) if present else None
+            elif op == "$first":
+                result[field] = values[0] if values else None
+            elif op == "$push":
+                result[field] = values
+            else:
+                raise NotImplementedError(f"Accumulator {op} not supported by FakeCollection")
+        results.append(result)
+    return results
+
+
+class FakeDatabase:
+    def __init__(self, latency: float = 0.001):
+        self.latency = latency
+        self._collections: Dict[str, FakeCollection] = {}
+
+    def __getattr__(self, name: str) -> FakeCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(name, self.latency)
+        return self._collections[name]
+
+    async def command(self, name: str, *args, **kwargs):
+        return {"ok": 1}
+
+    def get_collection(self, name: str, **kwargs) -> FakeCollection:
+        return self[name]
+
+
+class FakeMongoClient:
+    """Local Mongo stand-in, assign to Database.client and its database to Database.db"""
+
+    def __init__(self, latency: float = 0.001):
+        self.latency = latency
+        self._databases: Dict[str, FakeDatabase] = {}
+        self.admin = FakeDatabase(latency)
+
+    def __getitem__(self, name: str) -> FakeDatabase:
+        if name not in self._databases:
+            self._databases[name] = FakeDatabase(self.latency)
+        return self._databases[name]
+
+    def close(self):
+        pass
+
+
+MOODS = ["happy", "sad", "anxious", "angry", "bored", "stressed", "lonely", "overwhelmed"]
+
+
+def create_fake_openai_app(latency: float = 0.2, tokens_per_second: float = 80.0,
+                           reply_tokens: int = 120) -> FastAPI:
+    """OpenAI-compatible chat completions server with configurable latency and token rate"""
+    app = FastAPI()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(body: Dict):
+        max_tokens = body.get("max_tokens") or reply_tokens
+        completion_tokens = min(reply_tokens, max_tokens)
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in body.get("messages", []))
+
+        await asyncio.sleep(latency + completion_tokens / tokens_per_second)
+
+        if max_tokens <= 10:
+            # Mood detection asks for a single word
+            content, completion_tokens = random.choice(MOODS), 1
+        else:
+            content = " ".join(["Thanks for sharing that with me."] * max(1, completion_tokens // 6))
+
+        return {
+            "id": f"chatcmpl-{ObjectId()}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        }
+
+    return app
@@ -0,0 +1,235 @@
+from typing import Dict, List, Optional
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+# Run from the backend directory: python -m bench.loadtest
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+DIARY_ENTRIES = [
+    "Work was exhausting today and I barely had time to eat.",
+    "Had a great walk in the park with my dog this morning!",
+    "I can't stop worrying about the exam next week.",
+    "Nothing much happened, just watched some TV and scrolled my phone.",
+    "My friend cancelled on me again and I feel pretty alone.",
+    "So much to do and so little time, I don't know where to start.",
+]
+
+# Relative weight of each operation in the traffic mix
+DEFAULT_MIX = {
+    "diary_entry": 50,
+    "conversation_history": 15,
+    "activity_log": 15,
+    "preferences": 10,
+    "login": 10,
+}
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return round(ordered[index], 3)
+
+
+def summarize(latencies: List[float]) -> Dict:
+    return {
+        "count": len(latencies),
+        "mean_ms": round(sum(latencies) / len(latencies), 3) if latencies else None,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": round(max(latencies), 3) if latencies else None,
+    }
+
+
+class EventLoopLagMonitor:
+    """Measures how late the event loop wakes up a task that sleeps for a fixed interval"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = time.perf_counter() - started - self.interval
+            self.samples.append(max(lag, 0) * 1000)
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.mix = DEFAULT_MIX if not args.mix else json.loads(args.mix)
+
+    def _setup_app(self):
+        """Import app.app wired to the in-process fake Mongo and fake OpenAI server"""
+        import httpx
+        from openai import AsyncOpenAI
+        from bench.fakes import FakeMongoClient, create_fake_openai_app
+
+        from config import Settings, set_settings
+        settings = Settings.from_env(env_file=None)
+        settings.openai_api_key = settings.openai_api_key or "bench"
+        settings.jwt_secret_key = settings.jwt_secret_key or "bench-secret"
+        # Every virtual user comes from the same address, auth rate limits would reject most of them
+        settings.rate_limit_store = "memory"
+        settings.login_ip_limit = settings.login_username_limit = settings.register_ip_limit = 10 ** 9
+        # Installed before app is imported so app.app is built with these settings
+        set_settings(settings)
+
+        from db.database import Database
+        client = FakeMongoClient(latency=self.args.mongo_latency_ms / 1000)
+        Database.client = client
+        Database.db = client[settings.mongodb_db_name]
+
+        import app as app_module
+        from test1 import EmotionalSupportService
+        fake_openai = create_fake_openai_app(
+            latency=self.args.llm_latency_ms / 1000,
+            tokens_per_second=self.args.llm_tokens_per_second,
+            reply_tokens=self.args.llm_reply_tokens
+        )
+        EmotionalSupportService.get_instance().client = AsyncOpenAI(
+            api_key="bench",
+            base_url="http://fake-openai/v1",
+            http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=fake_openai)),
+            max_retries=0
+        )
+        return app_module.app
+
+    async def _timed(self, name: str, request):
+        started = time.perf_counter()
+        try:
+            response = await request
+            ok = response.status_code < 400
+        except Exception:
+            response, ok = None, False
+        self.latencies.setdefault(name, []).append((time.perf_counter() - started) * 1000)
+        if not ok:
+            self.errors[name] = self.errors.get(name, 0) + 1
+        return response
+
+    async def _virtual_user(self, client, index: int, deadline: float):
+        username = f"bench_user_{index}_{random.randint(0, 1_000_000)}"
+        password = "bench-password"
+        response = await self._timed("register", client.post("/api/auth/register", json={
+            "user": {"username": username, "email": f"{username}@example.com",
+                     "name": username, "password": password},
+            "preferences": {"location": None, "favorite_genres": ["comedy", "drama"]}
+        }))
+        if response is None or response.status_code >= 400:
+            return
+        user_id = response.json()["user_id"]
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        operations = list(self.mix.keys())
+        weights = list(self.mix.values())
+        while time.perf_counter() < deadline:
+            operation = random.choices(operations, weights)[0]
+            if operation == "diary_entry":
+                await self._timed(operation, client.post("/api/diary-entry", headers=headers, json={
+                    "user_id": user_id, "content": random.choice(DIARY_ENTRIES)
+                }))
+            elif operation == "conversation_history":
+                await self._timed(operation, client.get(f"/api/conversation-history/{user_id}"))
+            elif operation == "activity_log":
+                await self._timed(operation, client.get("/api/activity-log", headers=headers))
+            elif operation == "preferences":
+                await self._timed(operation, client.post("/api/preferences", headers=headers, json={
+                    "user_id": user_id, "name": username, "location": None,
+                    "favorite_genres": random.sample(["comedy", "drama", "action", "animation"], 2)
+                }))
+            elif operation == "login":
+                await self._timed(operation, client.post("/api/auth/login", json={
+                    "username": username, "password": password
+                }))
+            if self.args.think_time_ms:
+                await asyncio.sleep(random.expovariate(1000 / self.args.think_time_ms))
+
+    async def run(self) -> Dict:
+        import httpx
+        app = self._setup_app()
+        # The app's lifespan does not run under ASGITransport, registration relies on the unique indexes
+        from db.database import Database
+        await Database.init_indexes()
+        monitor = EventLoopLagMonitor()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            monitor.start()
+            started = time.perf_counter()
+            deadline = started + self.args.duration
+            await asyncio.gather(*(
+                self._virtual_user(client, i, deadline) for i in range(self.args.concurrency)
+            ))
+            elapsed = time.perf_counter() - started
+            monitor.stop()
+
+        total = sum(len(v) for v in self.latencies.values())
+        all_latencies = [l for v in self.latencies.values() for l in v]
+        return {
+            "config": {
+                "concurrency": self.args.concurrency,
+                "duration_s": self.args.duration,
+                "mix": self.mix,
+                "llm_latency_ms": self.args.llm_latency_ms,
+                "llm_tokens_per_second": self.args.llm_tokens_per_second,
+                "mongo_latency_ms": self.args.mongo_latency_ms,
+            },
+            "elapsed_s": round(elapsed, 3),
+            "requests": total,
+            "errors": sum(self.errors.values()),
+            "throughput_rps": round(total / elapsed, 3) if elapsed else None,
+            "overall": summarize(all_latencies),
+            "endpoints": {
+                name: {**summarize(values), "errors": self.errors.get(name, 0)}
+                for name, values in sorted(self.latencies.items())
+            },
+            "event_loop_lag": summarize(monitor.samples),
+        }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test for the MoodScribe API")
+    parser.add_argument("--concurrency", type=int, default=20, help="Number of virtual users")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run")
+    parser.add_argument("--think-time-ms", type=float, default=0.0, help="Mean pause between requests")
+    parser.add_argument("--mix", help='JSON weights, e.g. {"diary_entry": 80, "login": 20}')
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0, help="Fake OpenAI base latency")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=80.0, help="Fake OpenAI token rate")
+    parser.add_argument("--llm-reply-tokens", type=int, default=120, help="Fake OpenAI reply length")
+    parser.add_argument("--mongo-latency-ms", type=float, default=1.0, help="Fake Mongo per-operation latency")
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = asyncio.run(LoadTest(args).run())
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
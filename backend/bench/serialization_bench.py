@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta
+from typing import Callable, Dict
+import argparse
+import gzip
+import json
+import sys
+import time
+from pathlib import Path
+
+# Run from the backend directory: python -m bench.serialization_bench
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from bench.loadtest import summarize
+from models.user_activity import UserActivity
+from utils import responses
+from utils.responses import FastJSONResponse
+
+
+def build_payloads(args) -> Dict[str, object]:
+    """Response bodies shaped like what each endpoint returns"""
+    text = ("I had a long day and I want to write about it. " * 20)[:args.message_length]
+    now = datetime.now()
+    history = [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": text}
+        for i in range(args.history)
+    ]
+    activities = [
+        {"_id": ObjectId(), **UserActivity(
+            user_id=str(ObjectId()), activity_type="preference_update",
+            timestamp=now - timedelta(minutes=i), ip_address="203.0.113.7"
+        ).model_dump()}
+        for i in range(args.activities)
+    ]
+    diary_entry = {
+        "response": text * 2,
+        "context": {
+            "mood": "stressed",
+            "recent_activities": ["walking", "reading"],
+            "stress_level": 7,
+            "recommended_genres": ["nature-documentary", "animation", "fantasy"],
+        },
+    }
+    return {"conversation_history": history, "activity_log": activities, "diary_entry": diary_entry}
+
+
+def time_per_call(fn: Callable[[], bytes], iterations: int) -> Dict:
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return summarize(timings)
+
+
+def default_path(payload) -> bytes:
+    # What FastAPI does for a returned dict: jsonable_encoder, then JSONResponse.render.
+    # ObjectId needs a custom encoder or the activity log fails outright
+    return JSONResponse(jsonable_encoder(payload, custom_encoder={ObjectId: str})).body
+
+
+def fast_path(payload) -> bytes:
+    return FastJSONResponse(payload).body
+
+
+def run(args) -> Dict:
+    results = {}
+    for endpoint, payload in build_payloads(args).items():
+        body = fast_path(payload)
+        compressed = gzip.compress(body, compresslevel=args.gzip_level)
+        results[endpoint] = {
+            "body_bytes": len(body),
+            "gzip_bytes": len(compressed),
+            "default": time_per_call(lambda: default_path(payload), args.iterations),
+            "fast": time_per_call(lambda: fast_path(payload), args.iterations),
+            "gzip": time_per_call(lambda: gzip.compress(body, compresslevel=args.gzip_level), args.iterations),
+        }
+        results[endpoint]["speedup"] = round(
+            results[endpoint]["default"]["mean_ms"] / results[endpoint]["fast"]["mean_ms"], 3
+        )
+    return {
+        "config": vars(args),
+        "encoder": "orjson" if responses.orjson is not None else "json",
+        "endpoints": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure response serialization cost per endpoint")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--history", type=int, default=50, help="Messages in the conversation history")
+    parser.add_argument("--message-length", type=int, default=400, help="Characters per message")
+    parser.add_argument("--activities", type=int, default=100, help="Entries in the activity log")
+    parser.add_argument("--gzip-level", type=int, default=6)
+    args = parser.parse_args()
+    print(json.dumps(run(args), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+from typing import Dict, List, Optional
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Run from the backend directory: python -m bench.startup_bench [--compare <git-rev>]
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+from bench.loadtest import summarize
+
+# Runs in a fresh interpreter inside the backend directory of the tree being measured
+PROBE = r"""
+import asyncio, json, os, sys, time
+sys.path.insert(0, os.getcwd())
+sys.path.append(os.environ["BENCH_DIR"])
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+os.environ.setdefault("JWT_SECRET_KEY", "bench-secret")
+os.environ.setdefault("MONGODB_URI", "mongodb://fake")
+
+started = time.perf_counter()
+import app as app_module
+imported = time.perf_counter()
+
+import httpx
+from bench.fakes import FakeMongoClient
+from db.database import Database
+client = FakeMongoClient(latency=0)
+Database.client = client
+Database.db = client["moodscribe"]
+
+async def first_request():
+    transport = httpx.ASGITransport(app=app_module.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        request_started = time.perf_counter()
+        response = await http.get("/")
+        return response.status_code, time.perf_counter() - request_started
+
+status, first_request_s = asyncio.run(first_request())
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "first_request_ms": first_request_s * 1000,
+    "status": status,
+}))
+"""
+
+
+def measure(backend_dir: Path, runs: int) -> Dict:
+    env = {**os.environ, "BENCH_DIR": str(BASE_DIR), "PYTHONDONTWRITEBYTECODE": "1"}
+    imports: List[float] = []
+    first_requests: List[float] = []
+    processes: List[float] = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE], cwd=backend_dir, env=env,
+            capture_output=True, text=True, check=True
+        ).stdout
+        processes.append((time.perf_counter() - started) * 1000)
+        result = json.loads(output.strip().splitlines()[-1])
+        imports.append(result["import_ms"])
+        first_requests.append(result["first_request_ms"])
+    return {
+        "import": summarize(imports),
+        "first_request": summarize(first_requests),
+        "import_plus_first_request_ms": round(
+            sum(imports) / runs + sum(first_requests) / runs, 3
+        ),
+        "process": summarize(processes),
+    }
+
+
+def measure_revision(revision: str, runs: int) -> Dict:
+    """Measure another git revision from a temporary worktree"""
+    repo_root = Path(subprocess.run(
+        ["git", "rev-parse", "--show-toplevel"], cwd=BASE_DIR,
+        capture_output=True, text=True, check=True
+    ).stdout.strip())
+    worktree = Path(tempfile.mkdtemp(prefix="startup-bench-"))
+    try:
+        subprocess.run(["git", "worktree", "add", "--detach", str(worktree), revision],
+                       cwd=repo_root, capture_output=True, check=True)
+        return measure(worktree / BASE_DIR.relative_to(repo_root), runs)
+    finally:
+        subprocess.run(["git", "worktree", "remove", "--force", str(worktree)],
+                       cwd=repo_root, capture_output=True)
+        shutil.rmtree(worktree, ignore_errors=True)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Measure cold import and first-request latency")
+    parser.add_argument("--runs", type=int, default=10, help="Fresh interpreters per tree")
+    parser.add_argument("--compare", help="Git revision to compare against, e.g. HEAD~1")
+    args = parser.parse_args(argv)
+
+    results = {"current": measure(BASE_DIR, args.runs)}
+    if args.compare:
+        results[args.compare] = measure_revision(args.compare, args.runs)
+        before = results[args.compare]["import_plus_first_request_ms"]
+        after = results["current"]["import_plus_first_request_ms"]
+        results["speedup"] = round(before / after, 3) if after else None
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
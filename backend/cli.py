@@ -1,5 +1,7 @@
 from test1 import EmotionalSupportService
+import argparse
 import asyncio
+import json
 import os
 from dotenv import load_dotenv
 
@@ -15,16 +17,98 @@ async def interactive_session():
     user_id = "test_user"
     
     print("Chat with Joy 🌟 (type 'exit' to quit)")
-    while True:
-        user_message = input("\nYou: ")
-        if user_message.lower() in ['quit', 'exit', 'bye']:
-            break
-            
-        response = await service.get_support_response(user_id, user_message)
-        if "error" in response:
-            print(f"Error: {response['error']}")
-        else:
-            print(f"\nJoy 🌟: {response['response']}")
+    try:
+        while True:
+            user_message = input("\nYou: ")
+            if user_message.lower() in ['quit', 'exit', 'bye']:
+                break
+
+            response = await service.get_support_response(user_id, user_message)
+            if "error" in response:
+                print(f"Error: {response['error']}")
+            else:
+                print(f"\nJoy 🌟: {response['response']}")
+    finally:
+        # No app lifespan here to flush usage and mood analytics on shutdown
+        await service.flush()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Chat with Joy or process diary entries in bulk")
+    subparsers = parser.add_subparsers(dest="command")
+
+    batch = subparsers.add_parser("batch", help="Process a JSONL or CSV file of diary entries")
+    batch.add_argument("input", help="JSONL or CSV file with user_id, content and optional id and date columns")
+    batch.add_argument("--output", required=True, help="JSONL file results are appended to")
+    batch.add_argument("--checkpoint", help="Checkpoint file, defaults to <output>.checkpoint")
+    batch.add_argument("--concurrency", type=int, default=8, help="Users processed at the same time")
+    batch.add_argument("--mode", choices=["reply", "mood"], default="reply",
+                       help="reply runs the full turn, mood only re-runs mood analysis")
+
+    export = subparsers.add_parser("export", help="Export user data as NDJSON")
+    export.add_argument("--output", required=True,
+                        help="File to write (.gz compresses), or a directory with --per-user")
+    export.add_argument("--user-id", action="append", dest="user_ids", help="Only export this user, repeatable")
+    export.add_argument("--per-user", action="store_true", help="Write one compressed file per user in parallel")
+    export.add_argument("--concurrency", type=int, default=4, help="Users exported at the same time")
+
+    import_ = subparsers.add_parser("import", help="Import NDJSON exports with upserts")
+    import_.add_argument("inputs", nargs="+", help="Export files, .gz files are decompressed")
+    import_.add_argument("--batch-size", type=int, default=500, help="Documents per bulk_write")
+    import_.add_argument("--concurrency", type=int, default=4, help="Files imported at the same time")
+
+    provision = subparsers.add_parser("provision", help="Create user accounts in bulk for onboarding")
+    provision.add_argument("input", help="JSONL or CSV file with username, email, name and password")
+    provision.add_argument("--batch-size", type=int, default=500, help="Users inserted per batch")
+
+    rotate = subparsers.add_parser("rotate-key", help="Give users a new data encryption key")
+    rotate.add_argument("user_ids", nargs="+", help="Users whose data key is rotated")
+    return parser.parse_args()
+
+async def run_export(args):
+    from db.database import Database
+    from db.transfer import UserDataTransfer
+    await Database.connect_db()
+    if args.per_user:
+        user_ids = args.user_ids or [u async for u in UserDataTransfer.all_user_ids()]
+        return await UserDataTransfer.export_users(user_ids, args.output, concurrency=args.concurrency)
+    if args.user_ids and len(args.user_ids) > 1:
+        raise ValueError("Use --per-user to export several users")
+    user_id = args.user_ids[0] if args.user_ids else None
+    return {"bytes_written": await UserDataTransfer.export_to_file(args.output, user_id)}
+
+async def run_import(args):
+    from db.database import Database
+    from db.transfer import UserDataTransfer
+    await Database.connect_db()
+    await Database.init_indexes()
+    return await UserDataTransfer.import_files(args.inputs, args.batch_size, args.concurrency)
+
+async def run_rotate_key(args):
+    from db.database import Database
+    from utils.encryption import FieldEncryptor
+    await Database.connect_db()
+    encryptor = FieldEncryptor.get_instance()
+    if not encryptor.enabled:
+        raise ValueError("ENCRYPTION_KEY environment variable not set")
+    # Data sealed with the old key is re-encrypted the next time it is read
+    return {user_id: await encryptor.rotate_user_key(user_id) for user_id in args.user_ids}
 
 if __name__ == "__main__":
-    asyncio.run(interactive_session()) 
\ No newline at end of file
+    args = parse_args()
+    if args.command == "batch":
+        from batch import run_batch
+        summary = asyncio.run(run_batch(
+            args.input, args.output, args.checkpoint, args.concurrency, args.mode
+        ))
+        print(json.dumps(summary, indent=2))
+    elif args.command == "export":
+        print(json.dumps(asyncio.run(run_export(args)), indent=2))
+    elif args.command == "import":
+        print(json.dumps(asyncio.run(run_import(args)), indent=2))
+    elif args.command == "provision":
+        from provision import provision_users
+        print(json.dumps(asyncio.run(provision_users(args.input, args.batch_size)), indent=2))
+    elif args.command == "rotate-key":
+        print(json.dumps(asyncio.run(run_rotate_key(args)), indent=2))
+    else:
+        asyncio.run(interactive_session())
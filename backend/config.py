@@ -0,0 +1,174 @@
+from typing import List, Optional
+from pathlib import Path
+import os
+from pydantic import BaseModel
+
+# Get the absolute path to the backend directory
+BASE_DIR = Path(__file__).resolve().parent
+
+
+def _split(value: Optional[str]) -> List[str]:
+    return [item.strip() for item in (value or "").split(",") if item.strip()]
+
+
+class Settings(BaseModel):
+    """Typed application settings, read once from the environment and backend/.env"""
+    openai_api_key: Optional[str] = None
+    openai_model: str = "gpt-4o-mini"
+
+    jwt_secret_key: Optional[str] = None
+    jwt_algorithm: str = "HS256"
+    access_token_expire_minutes: int = 30
+
+    mongodb_uri: Optional[str] = None
+    mongodb_db_name: str = "moodscribe"
+    mongodb_min_pool_size: int = 0
+    mongodb_max_pool_size: int = 100
+    mongodb_max_idle_time_ms: Optional[int] = None
+    mongodb_wait_queue_timeout_ms: int = 2000
+    mongodb_server_selection_timeout_ms: int = 5000
+    mongodb_connect_timeout_ms: int = 5000
+    health_ping_timeout: float = 2.0
+    # Pool usage above this reports the database as degraded
+    health_pool_saturation_threshold: float = 0.9
+
+    cors_origins: List[str] = ["http://localhost:5173", "http://localhost:3000"]
+    # JSON bodies smaller than this are sent uncompressed
+    gzip_minimum_size: int = 1024
+    gzip_level: int = 6
+    admin_usernames: List[str] = []
+
+    daily_token_quota: Optional[int] = None
+    usage_flush_batch_size: int = 100
+    usage_flush_interval: float = 30.0
+
+    trace_sample_rate: float = 0.0
+    trace_exporter: str = "jsonl"
+    trace_file: str = "data/traces.jsonl"
+    # The file is rotated to <trace_file>.1 past this size, one old file is kept
+    trace_file_max_bytes: int = 20_000_000
+    trace_collector_url: str = "http://localhost:4318/v1/traces"
+    # Requests sent with `X-Trace: <token>` are always traced, unset disables forcing
+    trace_force_token: Optional[str] = None
+
+    # Only one process runs the scheduler, under the supervisor the worker named checkin_worker
+    checkin_enabled: bool = False
+    checkin_worker: str = "worker-0"
+    # Seconds between re-reads of preferences changed by other processes
+    checkin_resync_interval: float = 60.0
+    checkin_lead_minutes: int = 5
+    checkin_batch_size: int = 200
+    checkin_concurrency: int = 8
+    checkin_channel: str = "log"
+    checkin_file: str = "data/checkins.jsonl"
+    checkin_webhook_url: Optional[str] = None
+    checkin_prompt_mode: str = "template"
+    # Set by the supervisor for each worker process, None when not supervised
+    worker_name: Optional[str] = None
+
+    analytics_flush_interval: float = 60.0
+    analytics_cohort_cache_size: int = 50000
+    # Cost bounds every cohort query is held to
+    analytics_max_days: int = 366
+    analytics_max_documents: int = 5000
+    analytics_query_timeout_ms: int = 2000
+    # Cohorts with fewer detections than this are left out of results
+    analytics_min_cohort_size: int = 5
+
+    # memory keeps counters per process, mongo shares them across workers and hosts
+    rate_limit_store: str = "memory"
+    login_ip_limit: int = 20
+    login_ip_window: float = 60.0
+    # Failed logins per username
+    login_username_limit: int = 5
+    login_username_window: float = 900.0
+    register_ip_limit: int = 5
+    register_ip_window: float = 3600.0
+    auth_hash_concurrency: int = 4
+    # Proxies whose X-Forwarded-For is trusted for the client IP
+    trusted_proxies: List[str] = []
+
+    encryption_keys: List[str] = []
+    data_key_cache_size: int = 10000
+
+    @classmethod
+    def from_env(cls, env_file: Optional[Path] = BASE_DIR / ".env") -> "Settings":
+        if env_file is not None:
+            from dotenv import load_dotenv
+            load_dotenv(env_file)
+        env = os.environ
+        values = {
+            "openai_api_key": env.get("OPENAI_API_KEY"),
+            "openai_model": env.get("OPENAI_MODEL"),
+            "jwt_secret_key": env.get("JWT_SECRET_KEY"),
+            "access_token_expire_minutes": env.get("ACCESS_TOKEN_EXPIRE_MINUTES"),
+            # Check both names
+            "mongodb_uri": env.get("MONGODB_URI") or env.get("MONGODB_URL"),
+            "mongodb_db_name": env.get("MONGODB_DB_NAME"),
+            "mongodb_min_pool_size": env.get("MONGODB_MIN_POOL_SIZE"),
+            "mongodb_max_pool_size": env.get("MONGODB_MAX_POOL_SIZE"),
+            "mongodb_max_idle_time_ms": env.get("MONGODB_MAX_IDLE_TIME_MS"),
+            "mongodb_wait_queue_timeout_ms": env.get("MONGODB_WAIT_QUEUE_TIMEOUT_MS"),
+            "mongodb_server_selection_timeout_ms": env.get("MONGODB_SERVER_SELECTION_TIMEOUT_MS"),
+            "mongodb_connect_timeout_ms": env.get("MONGODB_CONNECT_TIMEOUT_MS"),
+            "health_ping_timeout": env.get("HEALTH_PING_TIMEOUT"),
+            "health_pool_saturation_threshold": env.get("HEALTH_POOL_SATURATION_THRESHOLD"),
+            "cors_origins": _split(env.get("CORS_ORIGINS")) or None,
+            "gzip_minimum_size": env.get("GZIP_MINIMUM_SIZE"),
+            "gzip_level": env.get("GZIP_LEVEL"),
+            "admin_usernames": _split(env.get("ADMIN_USERNAMES")),
+            # 0 disables the quota
+            "daily_token_quota": int(env.get("DAILY_TOKEN_QUOTA") or 0) or None,
+            "usage_flush_batch_size": env.get("USAGE_FLUSH_BATCH_SIZE"),
+            "usage_flush_interval": env.get("USAGE_FLUSH_INTERVAL"),
+            "trace_sample_rate": env.get("TRACE_SAMPLE_RATE"),
+            "trace_exporter": env.get("TRACE_EXPORTER"),
+            "trace_file": env.get("TRACE_FILE"),
+            "trace_file_max_bytes": env.get("TRACE_FILE_MAX_BYTES"),
+            "trace_collector_url": env.get("TRACE_COLLECTOR_URL"),
+            "trace_force_token": env.get("TRACE_FORCE_TOKEN"),
+            "checkin_enabled": env.get("CHECKIN_ENABLED"),
+            "checkin_lead_minutes": env.get("CHECKIN_LEAD_MINUTES"),
+            "checkin_batch_size": env.get("CHECKIN_BATCH_SIZE"),
+            "checkin_concurrency": env.get("CHECKIN_CONCURRENCY"),
+            "checkin_channel": env.get("CHECKIN_CHANNEL"),
+            "checkin_file": env.get("CHECKIN_FILE"),
+            "checkin_webhook_url": env.get("CHECKIN_WEBHOOK_URL"),
+            "checkin_prompt_mode": env.get("CHECKIN_PROMPT_MODE"),
+            "checkin_worker": env.get("CHECKIN_WORKER"),
+            "checkin_resync_interval": env.get("CHECKIN_RESYNC_INTERVAL"),
+            "worker_name": env.get("WORKER_NAME"),
+            "analytics_flush_interval": env.get("ANALYTICS_FLUSH_INTERVAL"),
+            "analytics_cohort_cache_size": env.get("ANALYTICS_COHORT_CACHE_SIZE"),
+            "analytics_max_days": env.get("ANALYTICS_MAX_DAYS"),
+            "analytics_max_documents": env.get("ANALYTICS_MAX_DOCUMENTS"),
+            "analytics_query_timeout_ms": env.get("ANALYTICS_QUERY_TIMEOUT_MS"),
+            "analytics_min_cohort_size": env.get("ANALYTICS_MIN_COHORT_SIZE"),
+            "rate_limit_store": env.get("RATE_LIMIT_STORE"),
+            "login_ip_limit": env.get("LOGIN_IP_LIMIT"),
+            "login_ip_window": env.get("LOGIN_IP_WINDOW"),
+            "login_username_limit": env.get("LOGIN_USERNAME_LIMIT"),
+            "login_username_window": env.get("LOGIN_USERNAME_WINDOW"),
+            "register_ip_limit": env.get("REGISTER_IP_LIMIT"),
+            "register_ip_window": env.get("REGISTER_IP_WINDOW"),
+            "auth_hash_concurrency": env.get("AUTH_HASH_CONCURRENCY"),
+            "trusted_proxies": _split(env.get("TRUSTED_PROXIES")),
+            "encryption_keys": _split(env.get("ENCRYPTION_KEYS") or env.get("ENCRYPTION_KEY")),
+            "data_key_cache_size": env.get("DATA_KEY_CACHE_SIZE"),
+        }
+        # Unset variables fall back to the defaults above
+        return cls(**{k: v for k, v in values.items() if v is not None and v != ""})
+
+
+_settings: Optional[Settings] = None
+
+def get_settings() -> Settings:
+    global _settings
+    if _settings is None:
+        _settings = Settings.from_env()
+    return _settings
+
+def set_settings(settings: Settings):
+    """Install the settings create_app was given, before any lazy client reads them"""
+    global _settings
+    _settings = settings
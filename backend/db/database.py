@@ -1,17 +1,56 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 from pymongo.server_api import ServerApi
-import os
+from pymongo.read_preferences import ReadPreference
+from pymongo.write_concern import WriteConcern
+from typing import Dict
+import asyncio
 import logging
-from dotenv import load_dotenv
+import time
 import certifi
-from pathlib import Path
-
-# Load environment variables
-BASE_DIR = Path(__file__).resolve().parent.parent
-load_dotenv(BASE_DIR / '.env')
+from config import get_settings
+from utils import metrics
+from utils.metrics import MongoCommandListener, MongoPoolListener
+from utils.tracing import TracingCommandListener
 
 logger = logging.getLogger(__name__)
 
+# Read preference and write concern per collection, anything not listed uses the client defaults
+COLLECTION_OPTIONS = {
+    # Accounts must survive a failover
+    "users": {"write_concern": WriteConcern("majority")},
+    "user_preferences": {"write_concern": WriteConcern("majority")},
+    "data_keys": {"write_concern": WriteConcern("majority")},
+    # Losing a log line or usage record on failover is acceptable, waiting for majority is not
+    "user_activities": {"write_concern": WriteConcern(w=1, j=False)},
+    "usage": {"write_concern": WriteConcern(w=1, j=False)},
+    "rate_limits": {"write_concern": WriteConcern(w=1, j=False)},
+    # Reporting reads can be served by secondaries, a lost counter increment only skews a summary
+    "analytics": {"read_preference": ReadPreference.SECONDARY_PREFERRED, "write_concern": WriteConcern(w=1, j=False)},
+}
+
+
+class ConfiguredDatabase:
+    """Wraps the Motor database so db.<collection> comes back with its read and write options"""
+
+    def __init__(self, db):
+        self._db = db
+        self._collections: Dict[str, object] = {}
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name: str):
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._db.get_collection(name, **COLLECTION_OPTIONS.get(name, {}))
+            self._collections[name] = collection
+        return collection
+
+    async def command(self, *args, **kwargs):
+        return await self._db.command(*args, **kwargs)
+
 class Database:
     client = None
     db = None
@@ -22,25 +61,30 @@ class Database:
             return  # Already connected
             
         try:
-            # Get MongoDB URI from environment variable (check both names)
-            mongodb_uri = os.getenv('MONGODB_URI') or os.getenv('MONGODB_URL')
+            settings = get_settings()
+            mongodb_uri = settings.mongodb_uri
             if not mongodb_uri:
                 raise ValueError("MongoDB connection URI not set in environment variables")
             
             logger.info("Attempting to connect to MongoDB...")
             
-            # Create client with server API version
+            # Create client with server API version and explicit pool limits
             cls.client = AsyncIOMotorClient(
                 mongodb_uri,
                 server_api=ServerApi('1'),
-                tlsCAFile=certifi.where()
+                tlsCAFile=certifi.where(),
+                minPoolSize=settings.mongodb_min_pool_size,
+                maxPoolSize=settings.mongodb_max_pool_size,
+                maxIdleTimeMS=settings.mongodb_max_idle_time_ms,
+                waitQueueTimeoutMS=settings.mongodb_wait_queue_timeout_ms,
+                serverSelectionTimeoutMS=settings.mongodb_server_selection_timeout_ms,
+                connectTimeoutMS=settings.mongodb_connect_timeout_ms,
+                event_listeners=[MongoCommandListener(), MongoPoolListener(), TracingCommandListener()]
             )
             
-            # Get database name from URI or use default
-            db_name = os.getenv('MONGODB_DB_NAME', 'moodscribe')
-            cls.db = cls.client[db_name]
+            cls.db = ConfiguredDatabase(cls.client[settings.mongodb_db_name])
             
-            # Verify connection
+            # Verify connection, fails after serverSelectionTimeoutMS instead of hanging
             await cls.client.admin.command('ping')
             logger.info("Successfully connected to MongoDB")
             
@@ -56,10 +100,34 @@ class Database:
             raise ConnectionError("Database not initialized. Call connect_db() first.")
         return cls.db
 
+    @classmethod
+    async def ping(cls, timeout: float) -> float:
+        """Round-trip a ping to the server, returns the latency in milliseconds"""
+        if cls.client is None:
+            raise ConnectionError("Database not initialized. Call connect_db() first.")
+        started = time.perf_counter()
+        await asyncio.wait_for(cls.client.admin.command('ping'), timeout=timeout)
+        return (time.perf_counter() - started) * 1000
+
+    @classmethod
+    def pool_stats(cls) -> Dict:
+        """Connection pool usage as seen by the pool listener"""
+        max_size = get_settings().mongodb_max_pool_size
+        pools = max(int(metrics.mongo_pools.labels().value), 1)
+        checked_out = int(metrics.mongo_pool_checked_out.labels().value)
+        return {
+            "checked_out": checked_out,
+            "waiting": int(metrics.mongo_pool_waiting.labels().value),
+            "max_size": max_size,
+            "pools": pools,
+            "saturation": round(checked_out / (max_size * pools), 3) if max_size else None
+        }
+
     @classmethod
     async def close_db(cls):
         if cls.client:
-            await cls.client.close()
+            # Motor's close() is synchronous
+            cls.client.close()
             cls.client = None
             cls.db = None
             logger.info("MongoDB connection closed")
@@ -69,10 +137,8 @@ class Database:
         try:
             db = cls.get_db()
             
-            # Drop existing indexes first
-            await db.users.drop_indexes()
-            await db.user_preferences.drop_indexes()
-            
+            # create_index is a no-op when the index already exists, registration
+            # relies on these to reject duplicates so they are never dropped
             # Create new indexes with background=True for better performance
             await db.users.create_index(
                 [("username", 1)], 
@@ -94,8 +160,42 @@ class Database:
                 background=True
             )
             
+            # Check-in scheduler re-syncs preferences changed since its last read
+            await db.user_preferences.create_index(
+                [("last_updated", 1)],
+                background=True
+            )
+            
+            # One key document per user, concurrent first turns must not create two
+            await db.data_keys.create_index(
+                [("user_id", 1)],
+                unique=True,
+                background=True
+            )
+            
+            # Conversation saves are conditional on the stored seq, a first save racing
+            # another must fail on insert rather than create a second document
+            await db.conversations.create_index(
+                [("user_id", 1)],
+                unique=True,
+                background=True
+            )
+            
+            # Rate limit windows remove themselves once expired
+            await db.rate_limits.create_index(
+                [("expires_at", 1)],
+                expireAfterSeconds=0,
+                background=True
+            )
+            
+            # Cohort queries filter on dimension and a day range
+            await db.analytics.create_index(
+                [("dimension", 1), ("day", 1), ("value", 1)],
+                background=True
+            )
+            
             logger.info("Database indexes initialized successfully")
         except Exception as e:
+            # Fatal: without the unique indexes duplicate users would be accepted
             logger.error(f"Error initializing indexes: {str(e)}")
-            # Log the error but don't raise it - allow the application to continue
-            pass 
\ No newline at end of file
+            raise
\ No newline at end of file
@@ -2,32 +2,45 @@ from db.database import Database
 from models.user_preferences import UserPreferences
 from models.user_activity import UserActivity
 from datetime import datetime
+from typing import Dict, List, Optional, Tuple
 from bson import ObjectId
+from pymongo.errors import BulkWriteError
+from utils.checkins import CheckInScheduler
+from utils.analytics import MoodAnalytics
+import asyncio
+
+# Error code MongoDB returns when a unique index rejects a write
+DUPLICATE_KEY = 11000
+
+def _preferences_doc(preferences: UserPreferences) -> dict:
+    preferences_dict = preferences.dict()
+    preferences_dict["user_id"] = str(preferences_dict["user_id"])
+    preferences_dict["last_updated"] = datetime.now()
+    return preferences_dict
+
+def _activity_doc(user_id: str, activity_type: str) -> dict:
+    return UserActivity(user_id=user_id, activity_type=activity_type, timestamp=datetime.now()).dict()
 
 class UserOperations:
     @staticmethod
     async def save_preferences(preferences: UserPreferences) -> bool:
         try:
             db = Database.get_db()
-            # Convert to dict and handle ObjectId
-            preferences_dict = preferences.dict()
-            preferences_dict["user_id"] = str(preferences_dict["user_id"])
-            preferences_dict["last_updated"] = datetime.now()
-            
-            # Upsert the preferences (update if exists, insert if not)
-            result = await db.user_preferences.update_one(
-                {"user_id": preferences_dict["user_id"]},
-                {"$set": preferences_dict},
-                upsert=True
-            )
+            preferences_dict = _preferences_doc(preferences)
             
-            # Log the activity
-            activity = UserActivity(
-                user_id=preferences_dict["user_id"],
-                activity_type="preference_update",
-                timestamp=datetime.now()
+            # Upsert the preferences and log the activity, neither depends on the other
+            await asyncio.gather(
+                db.user_preferences.update_one(
+                    {"user_id": preferences_dict["user_id"]},
+                    {"$set": preferences_dict},
+                    upsert=True
+                ),
+                db.user_activities.insert_one(
+                    _activity_doc(preferences_dict["user_id"], "preference_update")
+                )
             )
-            await db.user_activities.insert_one(activity.dict())
+            CheckInScheduler.preferences_changed(preferences_dict["user_id"], preferences_dict)
+            MoodAnalytics.preferences_changed(preferences_dict["user_id"], preferences_dict)
             
             return True
         except Exception as e:
@@ -44,4 +57,85 @@ class UserOperations:
             return preferences
         except Exception as e:
             print(f"Error getting preferences: {e}")
-            return None 
\ No newline at end of file
+            return None
+
+    @staticmethod
+    async def create_user(user_doc: dict, preferences: Optional[UserPreferences] = None) -> str:
+        """Insert a new user, its preferences and a registration activity
+
+        Duplicate usernames and emails are rejected by the unique indexes, so this
+        raises DuplicateKeyError instead of reading first. If the preferences cannot
+        be saved the user is deleted again and the error raised, a failed activity
+        insert is only logged.
+        """
+        db = Database.get_db()
+        user_doc = {"_id": ObjectId(), **user_doc}
+        await db.users.insert_one(user_doc)
+        user_id = str(user_doc["_id"])
+
+        # The id is known up front, so the dependent writes go out together
+        writes = [db.user_activities.insert_one(_activity_doc(user_id, "register"))]
+        if preferences is not None:
+            preferences.user_id = user_id
+            preferences_dict = _preferences_doc(preferences)
+            writes.append(db.user_preferences.insert_one(preferences_dict))
+        activity_result, *preferences_result = await asyncio.gather(*writes, return_exceptions=True)
+        if isinstance(activity_result, Exception):
+            print(f"Error logging registration for {user_id}: {activity_result}")
+        if preferences_result and isinstance(preferences_result[0], Exception):
+            # Undo the registration so the username can be registered again
+            await asyncio.gather(
+                db.users.delete_one({"_id": user_doc["_id"]}),
+                db.user_activities.delete_many({"user_id": user_id})
+            )
+            raise preferences_result[0]
+        if preferences is not None:
+            CheckInScheduler.preferences_changed(user_id, preferences_dict)
+            MoodAnalytics.preferences_changed(user_id, preferences_dict)
+        return user_id
+
+    @staticmethod
+    async def create_users(entries: List[Tuple[dict, Optional[UserPreferences]]]) -> Dict:
+        """Bulk version of create_user, one insert_many per collection
+
+        Users whose username or email is taken are reported as duplicates,
+        the rest of the batch is still inserted.
+        """
+        db = Database.get_db()
+        user_docs = [{"_id": ObjectId(), **user_doc} for user_doc, _ in entries]
+        rejected: Dict[int, str] = {}
+        if user_docs:
+            try:
+                await db.users.insert_many(user_docs, ordered=False)
+            except BulkWriteError as e:
+                for error in e.details.get("writeErrors", []):
+                    rejected[error["index"]] = "duplicate" if error.get("code") == DUPLICATE_KEY else error.get("errmsg", "error")
+
+        created, activities, preference_docs = [], [], []
+        for index, (user_doc, (_, preferences)) in enumerate(zip(user_docs, entries)):
+            if index in rejected:
+                continue
+            user_id = str(user_doc["_id"])
+            created.append({"username": user_doc.get("username"), "user_id": user_id})
+            activities.append(_activity_doc(user_id, "register"))
+            if preferences is not None:
+                preferences.user_id = user_id
+                preference_docs.append(_preferences_doc(preferences))
+
+        writes = []
+        if activities:
+            writes.append(db.user_activities.insert_many(activities, ordered=False))
+        if preference_docs:
+            writes.append(db.user_preferences.insert_many(preference_docs, ordered=False))
+        await asyncio.gather(*writes)
+        for preferences_dict in preference_docs:
+            CheckInScheduler.preferences_changed(preferences_dict["user_id"], preferences_dict)
+            MoodAnalytics.preferences_changed(preferences_dict["user_id"], preferences_dict)
+
+        return {
+            "created": created,
+            "rejected": [
+                {"username": user_docs[index].get("username"), "reason": reason}
+                for index, reason in sorted(rejected.items())
+            ]
+        }
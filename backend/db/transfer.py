@@ -0,0 +1,182 @@
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+import asyncio
+import gzip
+import logging
+import os
+import zlib
+from bson import ObjectId, json_util
+from pymongo import ReplaceOne
+from db.database import Database
+from utils.encryption import FieldEncryptor
+
+logger = logging.getLogger(__name__)
+
+# Collections holding per-user data, keyed by a user_id string
+USER_COLLECTIONS = ["user_preferences", "contexts", "conversations", "user_activities", "data_keys"]
+# Collections with a single document per user, imported by user_id instead of _id
+SINGLETON_COLLECTIONS = {"user_preferences", "contexts", "conversations", "data_keys"}
+# Encrypted field of each collection and the field its plaintext goes to, None merges it in
+ENCRYPTED_FIELDS = {"contexts": ("enc", None), "conversations": ("messages_enc", "messages")}
+CURSOR_BATCH_SIZE = 500
+
+
+def _user_query(collection: str, user_id: str) -> Dict:
+    if collection == "users":
+        return {"_id": ObjectId(user_id) if ObjectId.is_valid(user_id) else user_id}
+    return {"user_id": user_id}
+
+
+def _encode(collection: str, doc: Dict) -> bytes:
+    return (json_util.dumps({"collection": collection, "doc": doc}) + "\n").encode()
+
+
+def _open_text(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class UserDataTransfer:
+    @staticmethod
+    async def iter_documents(user_id: Optional[str] = None, include_credentials: bool = True,
+                             decrypt: bool = False) -> AsyncIterator[Tuple[str, Dict]]:
+        """Stream (collection, document) pairs for one user, or for everyone when user_id is None
+
+        Backups keep encrypted fields and wrapped data keys as they are, decrypt=True produces
+        plaintext for the user's own download instead.
+        """
+        db = Database.get_db()
+        encryptor = FieldEncryptor.get_instance()
+        projection = None if include_credentials else {"hashed_password": 0}
+        for collection in ["users"] + USER_COLLECTIONS:
+            if decrypt and collection == "data_keys":
+                continue
+            query = _user_query(collection, user_id) if user_id else {}
+            cursor = db[collection].find(
+                query, projection if collection == "users" else None
+            ).batch_size(CURSOR_BATCH_SIZE)
+            async for doc in cursor:
+                if decrypt and collection in ENCRYPTED_FIELDS:
+                    field, target = ENCRYPTED_FIELDS[collection]
+                    if field in doc:
+                        value, _ = await encryptor.decrypt(doc["user_id"], doc.pop(field))
+                        if target:
+                            doc[target] = value
+                        else:
+                            doc.update(value)
+                yield collection, doc
+
+    @staticmethod
+    async def iter_ndjson(user_id: Optional[str] = None, compress: bool = False,
+                          include_credentials: bool = True, decrypt: bool = False) -> AsyncIterator[bytes]:
+        """Stream the export as NDJSON chunks, gzip-compressed on the fly when asked"""
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+        buffer: List[bytes] = []
+        size = 0
+        async for collection, doc in UserDataTransfer.iter_documents(user_id, include_credentials, decrypt):
+            line = _encode(collection, doc)
+            buffer.append(line)
+            size += len(line)
+            # Yield in ~64KB chunks so the number of writes stays low
+            if size >= 65536:
+                chunk = b"".join(buffer)
+                buffer, size = [], 0
+                chunk = compressor.compress(chunk) if compressor else chunk
+                if chunk:
+                    yield chunk
+        chunk = b"".join(buffer)
+        if compressor:
+            chunk = compressor.compress(chunk) + compressor.flush()
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    async def export_to_file(path: str, user_id: Optional[str] = None) -> int:
+        """Write an export to path, gzip-compressed when it ends with .gz, returns bytes written"""
+        written = 0
+        with open(path, "wb") as f:
+            async for chunk in UserDataTransfer.iter_ndjson(user_id, compress=path.endswith(".gz")):
+                await asyncio.to_thread(f.write, chunk)
+                written += len(chunk)
+        return written
+
+    @staticmethod
+    async def export_users(user_ids: Iterable[str], directory: str, compress: bool = True,
+                           concurrency: int = 4) -> Dict[str, str]:
+        """Export several users in parallel, one file per user"""
+        os.makedirs(directory, exist_ok=True)
+        semaphore = asyncio.Semaphore(concurrency)
+        extension = ".ndjson.gz" if compress else ".ndjson"
+
+        async def export_one(user_id: str) -> Tuple[str, str]:
+            path = os.path.join(directory, f"{user_id}{extension}")
+            async with semaphore:
+                await UserDataTransfer.export_to_file(path, user_id)
+            return user_id, path
+
+        return dict(await asyncio.gather(*(export_one(u) for u in user_ids)))
+
+    @staticmethod
+    async def all_user_ids() -> AsyncIterator[str]:
+        cursor = Database.get_db().users.find({}, {"_id": 1}).batch_size(CURSOR_BATCH_SIZE)
+        async for doc in cursor:
+            yield str(doc["_id"])
+
+    @staticmethod
+    def _to_operation(collection: str, doc: Dict) -> ReplaceOne:
+        if collection in SINGLETON_COLLECTIONS:
+            # The target may already hold this user's document under another _id
+            doc.pop("_id", None)
+            return ReplaceOne({"user_id": doc["user_id"]}, doc, upsert=True)
+        return ReplaceOne({"_id": doc["_id"]}, doc, upsert=True)
+
+    @staticmethod
+    async def _flush(collection: str, operations: List[ReplaceOne]) -> int:
+        if not operations:
+            return 0
+        await Database.get_db()[collection].bulk_write(operations, ordered=True)
+        return len(operations)
+
+    @staticmethod
+    async def import_file(path: str, batch_size: int = 500) -> Dict[str, int]:
+        """Upsert an NDJSON export (optionally .gz) in ordered bulk_write batches per collection"""
+        counts: Dict[str, int] = {}
+        pending: Dict[str, List[ReplaceOne]] = {}
+        f = await asyncio.to_thread(_open_text, path, "r")
+        try:
+            while True:
+                lines = await asyncio.to_thread(f.readlines, 1 << 20)
+                if not lines:
+                    break
+                for line in lines:
+                    if not line.strip():
+                        continue
+                    record = json_util.loads(line)
+                    collection = record["collection"]
+                    if collection not in USER_COLLECTIONS and collection != "users":
+                        logger.warning(f"Skipping document for unknown collection {collection}")
+                        continue
+                    operations = pending.setdefault(collection, [])
+                    operations.append(UserDataTransfer._to_operation(collection, record["doc"]))
+                    if len(operations) >= batch_size:
+                        counts[collection] = counts.get(collection, 0) + \
+                            await UserDataTransfer._flush(collection, operations)
+                        pending[collection] = []
+        finally:
+            f.close()
+        for collection, operations in pending.items():
+            counts[collection] = counts.get(collection, 0) + \
+                await UserDataTransfer._flush(collection, operations)
+        return counts
+
+    @staticmethod
+    async def import_files(paths: Iterable[str], batch_size: int = 500,
+                           concurrency: int = 4) -> Dict[str, Dict[str, int]]:
+        """Import several per-user export files in parallel"""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def import_one(path: str) -> Tuple[str, Dict[str, int]]:
+            async with semaphore:
+                return path, await UserDataTransfer.import_file(path, batch_size)
+
+        return dict(await asyncio.gather(*(import_one(p) for p in paths)))
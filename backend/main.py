@@ -1,17 +1,2 @@
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-from auth import router as auth_router
-
-app = FastAPI()
-
-# Add CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:5173"],  # Add your frontend URL
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Include the auth router
-app.include_router(auth_router, prefix="/api/auth") 
\ No newline at end of file
+# Kept so `uvicorn main:app` keeps working, app.py holds the only app definition
+from app import app
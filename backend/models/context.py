@@ -0,0 +1,125 @@
+from typing import Any, Dict, List, Optional, Sequence
+import json
+
+# Fields of UserContext that hold lists of short strings
+LIST_FIELDS = ("recent_activities", "favorite_genres", "watched_movies", "goals", "recommended_genres")
+
+# Batch entry keys remembered per user, a retry older than this many entries is applied again
+MAX_APPLIED_ENTRIES = 100
+
+
+class ContextState:
+    """Internal form of UserContext used on the turn hot path
+
+    A slotted object filled straight from the stored document, without the
+    validation and copying a pydantic model does on every load. Values are
+    trusted, validation happens in the pydantic UserContext at the API boundary.
+    """
+    __slots__ = ("mood", "recent_activities", "favorite_genres", "watched_movies",
+                 "stress_level", "goals", "recommended_genres", "extra", "signals", "applied_entries")
+
+    def __init__(self, mood: Optional[str] = None,
+                 recent_activities: Optional[Sequence[str]] = None,
+                 favorite_genres: Optional[Sequence[str]] = None,
+                 watched_movies: Optional[Sequence[str]] = None,
+                 stress_level: Optional[int] = None,
+                 goals: Optional[Sequence[str]] = None,
+                 recommended_genres: Optional[Sequence[str]] = None,
+                 extra: Optional[Dict[str, Any]] = None,
+                 signals: Optional[Dict[str, Any]] = None,
+                 applied_entries: Optional[List[str]] = None):
+        self.mood = mood
+        self.recent_activities = recent_activities
+        self.favorite_genres = favorite_genres
+        self.watched_movies = watched_movies
+        self.stress_level = stress_level
+        self.goals = goals
+        self.recommended_genres = recommended_genres
+        # Fields UserContext allows as extras, only allocated when present
+        self.extra = extra
+        # Decaying scores behind the extracted fields, stored but never sent to the model
+        self.signals = signals
+        # Keys of batch entries already applied, so a retried entry is not counted twice
+        self.applied_entries = applied_entries
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "ContextState":
+        if not data:
+            return cls()
+        extra = None
+        if not _DOCUMENT_KEYS.issuperset(data):
+            extra = {k: v for k, v in data.items() if k not in _DOCUMENT_KEYS}
+        get = data.get
+        return cls(
+            get("mood"), get("recent_activities"), get("favorite_genres"), get("watched_movies"),
+            get("stress_level"), get("goals"), get("recommended_genres"), extra, get("signals"),
+            get("applied_entries")
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Equivalent of UserContext.model_dump(exclude_none=True)"""
+        data = {}
+        if self.mood is not None:
+            data["mood"] = self.mood
+        for name in LIST_FIELDS:
+            value = getattr(self, name)
+            if value is not None:
+                data[name] = list(value)
+        if self.stress_level is not None:
+            data["stress_level"] = self.stress_level
+        if self.extra:
+            for key, value in self.extra.items():
+                if value is not None:
+                    data[key] = value
+        return data
+
+    def to_document(self) -> Dict[str, Any]:
+        """to_dict plus the extraction signals and applied entries, what gets stored"""
+        data = self.to_dict()
+        if self.signals:
+            data["signals"] = self.signals
+        if self.applied_entries:
+            data["applied_entries"] = self.applied_entries
+        return data
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict())
+
+    def set_mood(self, mood: str, recommended_genres: Sequence[str]):
+        self.mood = mood
+        self.recommended_genres = recommended_genres
+
+    def has_applied(self, entry_key: str) -> bool:
+        return bool(self.applied_entries) and entry_key in self.applied_entries
+
+    def mark_applied(self, entry_key: str):
+        self.applied_entries = [*(self.applied_entries or ()), entry_key][-MAX_APPLIED_ENTRIES:]
+
+    def set_signals(self, signals: Dict[str, Any], stress_level: Optional[int],
+                    recent_activities: Optional[Sequence[str]], goals: Optional[Sequence[str]],
+                    watched_movies: Optional[Sequence[str]]):
+        self.signals = signals
+        self.stress_level = stress_level
+        self.recent_activities = recent_activities
+        self.goals = goals
+        self.watched_movies = watched_movies
+
+
+# Everything from_dict maps to a slot or drops, any other key is an extra
+_DOCUMENT_KEYS = frozenset(ContextState.__slots__) - {"extra"} | {"_id", "user_id"}
+
+
+def number_messages(messages: List[Dict[str, Any]], seq: int,
+                    since: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Messages newer than since with their sequence ids, for the history API
+
+    Only the newest seq is stored. Messages are appended one at a time and
+    trimmed from the front, so the window is contiguous and each id follows from
+    its position. The turn path passes the stored dicts through untouched.
+    """
+    first = seq - len(messages) + 1
+    start = max(0, since - first + 1) if since is not None and since < seq else 0
+    return [
+        {"role": m["role"], "content": m["content"], "seq": first + i}
+        for i, m in enumerate(messages[start:], start)
+    ]
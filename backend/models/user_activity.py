@@ -6,7 +6,7 @@ class UserActivity(BaseModel):
     user_id: str
     activity_type: str  # login, logout, preference_update, etc.
     timestamp: datetime = datetime.now()
-    ip_address: Optional[str]
-    device_info: Optional[str]
-    location: Optional[str]
+    ip_address: Optional[str] = None
+    device_info: Optional[str] = None
+    location: Optional[str] = None
     is_suspicious: bool = False 
\ No newline at end of file
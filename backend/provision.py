@@ -0,0 +1,57 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+import asyncio
+import csv
+import json
+from auth import build_user_doc
+from db.database import Database
+from db.operations import UserOperations
+from models.user_preferences import UserPreferences
+
+USER_FIELDS = ("username", "email", "name", "password")
+
+
+def read_registrations(path: str) -> Iterator[Tuple[dict, Optional[dict]]]:
+    """Stream users from a JSONL or CSV file, JSONL rows may carry a preferences object"""
+    is_csv = path.lower().endswith(".csv")
+    with open(path, newline="" if is_csv else None) as f:
+        rows = csv.DictReader(f) if is_csv else (json.loads(line) for line in f if line.strip())
+        for line_number, row in enumerate(rows, start=1):
+            missing = [field for field in USER_FIELDS if not row.get(field)]
+            if missing:
+                print(f"Skipping user {line_number}: missing {', '.join(missing)}")
+                continue
+            yield {field: row[field] for field in USER_FIELDS}, row.get("preferences") or None
+
+
+async def _prepare(user: dict, preferences: Optional[dict]) -> Tuple[dict, Optional[UserPreferences]]:
+    # bcrypt releases the GIL, so hashing in threads spreads it over the cores
+    user_doc = await asyncio.to_thread(build_user_doc, user)
+    if preferences:
+        preferences = UserPreferences(**{**preferences, "user_id": "", "name": user["name"]})
+    return user_doc, preferences
+
+
+async def provision_users(path: str, batch_size: int = 500) -> Dict:
+    """Create users from an onboarding file with one insert_many per collection per batch"""
+    await Database.connect_db()
+    await Database.init_indexes()
+    created: List[Dict] = []
+    rejected: List[Dict] = []
+
+    async def flush(batch):
+        entries = await asyncio.gather(*(_prepare(user, preferences) for user, preferences in batch))
+        result = await UserOperations.create_users(list(entries))
+        created.extend(result["created"])
+        rejected.extend(result["rejected"])
+        print(f"created={len(created)} rejected={len(rejected)}", flush=True)
+
+    batch = []
+    for registration in read_registrations(path):
+        batch.append(registration)
+        if len(batch) >= batch_size:
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+
+    return {"created": len(created), "rejected": rejected, "users": created}
@@ -0,0 +1,324 @@
+from typing import Dict, List, Optional
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+from jose import jwt
+from utils.hashring import HashRing
+
+logger = logging.getLogger(__name__)
+
+# Run from the backend directory: python supervisor.py --workers 4
+BASE_DIR = Path(__file__).resolve().parent
+
+# Paths that carry the user id, checked before the body and the bearer token
+USER_PATH = re.compile(r"^/api/(?:conversation-history|user-context|preferences)/([^/]+)")
+
+# Hop-by-hop headers are not forwarded, see RFC 9110 section 7.6.1
+HOP_HEADERS = {b"connection", b"keep-alive", b"transfer-encoding", b"upgrade", b"host", b"te", b"trailer"}
+
+
+def route_key(scope, body: bytes) -> Optional[str]:
+    """The user a request belongs to, None for requests with no user"""
+    match = USER_PATH.match(scope["path"])
+    if match:
+        return match.group(1)
+
+    headers = dict(scope.get("headers") or [])
+    if body and b"json" in headers.get(b"content-type", b""):
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            payload = None
+        if isinstance(payload, dict):
+            if payload.get("user_id"):
+                return str(payload["user_id"])
+            # Login sends the username at the top level, register inside "user",
+            # keeps a username's attempts on one worker
+            user = payload.get("user")
+            username = payload.get("username") or (user.get("username") if isinstance(user, dict) else None)
+            if username:
+                return f"username:{username}"
+
+    authorization = headers.get(b"authorization", b"").decode()
+    if authorization.lower().startswith("bearer "):
+        try:
+            # Only used for routing, the worker still verifies the signature
+            return jwt.get_unverified_claims(authorization[7:]).get("sub")
+        except Exception:
+            return None
+    return None
+
+
+class Worker:
+    __slots__ = ("name", "port", "process")
+
+    def __init__(self, name: str, port: int):
+        self.name = name
+        self.port = port
+        self.process: Optional[subprocess.Popen] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+
+class Supervisor:
+    """Runs worker processes behind a proxy that pins each user to one worker
+
+    Per-user state in a worker (service caches, locks, indexes) stays local
+    because every request for a user lands on the same process. Scaling out adds
+    the new worker to the ring once it is healthy, so only ~1/N of users move.
+    """
+
+    def __init__(self, workers: int = 2, base_port: int = 8100, app: str = "main:app",
+                 health_path: str = "/", drain_seconds: float = 5.0):
+        self.base_port = base_port
+        self.app = app
+        self.health_path = health_path
+        self.drain_seconds = drain_seconds
+        self.initial_workers = workers
+        self.ring = HashRing()
+        self.workers: Dict[str, Worker] = {}
+        self._next_index = 0
+        self._scale_lock = asyncio.Lock()
+        self._client = None
+        self._monitor_task: Optional[asyncio.Task] = None
+        # Requests with no user are spread round-robin
+        self._next_keyless = 0
+
+    def _spawn(self, worker: Worker):
+        worker.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", self.app,
+             "--host", "127.0.0.1", "--port", str(worker.port), "--no-access-log"],
+            cwd=BASE_DIR,
+            # The proxy is the worker's only client, trust the address it forwards. Auth rate
+            # limits are shared through Mongo, per-process counters would allow N times the limit
+            env={"TRUSTED_PROXIES": "127.0.0.1", **os.environ, "WORKER_NAME": worker.name,
+                 "RATE_LIMIT_STORE": "mongo"}
+        )
+
+    async def _wait_healthy(self, worker: Worker, timeout: float = 30.0):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while loop.time() < deadline:
+            if worker.process.poll() is not None:
+                raise RuntimeError(f"Worker {worker.name} exited with {worker.process.returncode}")
+            try:
+                response = await self._client.get(worker.url + self.health_path, timeout=1.0)
+                if response.status_code < 500:
+                    return
+            except Exception:
+                pass
+            await asyncio.sleep(0.2)
+        raise TimeoutError(f"Worker {worker.name} did not become healthy in {timeout}s")
+
+    async def _add_worker(self) -> Worker:
+        name = f"worker-{self._next_index}"
+        worker = Worker(name, self.base_port + self._next_index)
+        self._next_index += 1
+        self._spawn(worker)
+        try:
+            await self._wait_healthy(worker)
+        except Exception:
+            worker.process.terminate()
+            raise
+        # Only routed to once it can serve
+        self.workers[name] = worker
+        self.ring.add(name)
+        logger.info(f"Started {name} on port {worker.port}")
+        return worker
+
+    async def _remove_worker(self, name: str):
+        worker = self.workers[name]
+        self.ring.remove(name)
+        # Let requests already sent to it finish before stopping it
+        await asyncio.sleep(self.drain_seconds)
+        worker.process.terminate()
+        await asyncio.to_thread(worker.process.wait)
+        del self.workers[name]
+        logger.info(f"Stopped {name}")
+
+    async def scale(self, count: int) -> Dict:
+        """Grow or shrink to count workers, reports the share of users that moved"""
+        if count < 1:
+            raise ValueError("At least one worker is required")
+        async with self._scale_lock:
+            before = HashRing(self.ring.nodes, self.ring.replicas)
+            while len(self.workers) < count:
+                await self._add_worker()
+            while len(self.workers) > count:
+                # Newest first so the original workers keep their users
+                await self._remove_worker(self.ring.nodes[-1])
+            return {"workers": self.ring.nodes, "moved": self.moved_share(before)}
+
+    def moved_share(self, before: HashRing, samples: int = 10000) -> float:
+        if not before.nodes:
+            return 0.0
+        moved = sum(before.get(f"user-{i}") != self.ring.get(f"user-{i}") for i in range(samples))
+        return round(moved / samples, 4)
+
+    async def _monitor(self):
+        """Restart crashed workers on the same port so their users keep their place on the ring"""
+        while True:
+            await asyncio.sleep(1.0)
+            for worker in list(self.workers.values()):
+                if worker.process.poll() is None or worker.name not in self.ring.nodes:
+                    continue
+                logger.warning(f"{worker.name} exited with {worker.process.returncode}, restarting")
+                self._spawn(worker)
+                try:
+                    await self._wait_healthy(worker)
+                except Exception as e:
+                    logger.error(f"Failed to restart {worker.name}: {str(e)}")
+
+    async def start(self):
+        store = os.environ.get("RATE_LIMIT_STORE", "mongo")
+        if store != "mongo":
+            raise RuntimeError(f"RATE_LIMIT_STORE={store} gives each worker its own limits, use mongo")
+        import httpx
+        self._client = httpx.AsyncClient(timeout=None)
+        await self.scale(self.initial_workers)
+        self._monitor_task = asyncio.get_running_loop().create_task(self._monitor())
+
+    async def stop(self):
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+        for worker in self.workers.values():
+            worker.process.terminate()
+        for worker in self.workers.values():
+            await asyncio.to_thread(worker.process.wait)
+        self.workers.clear()
+        if self._client is not None:
+            await self._client.aclose()
+
+    def pick(self, key: Optional[str]) -> Worker:
+        if key is None:
+            # Nothing to keep local (health, metrics, anonymous requests), any worker will do
+            nodes = self.ring.nodes
+            self._next_keyless = (self._next_keyless + 1) % len(nodes)
+            return self.workers[nodes[self._next_keyless]]
+        return self.workers[self.ring.get(key)]
+
+    async def _control(self, scope, receive, send):
+        """Local-only endpoints to inspect and resize the pool"""
+        client_host = (scope.get("client") or ("",))[0]
+        if client_host not in ("127.0.0.1", "::1"):
+            await _send_json(send, 403, {"detail": "Supervisor control is local only"})
+            return
+        if scope["path"] == "/_supervisor/workers":
+            await _send_json(send, 200, {
+                "workers": [
+                    {"name": w.name, "port": w.port, "pid": w.process.pid, "alive": w.process.poll() is None}
+                    for w in self.workers.values()
+                ]
+            })
+        elif scope["path"] == "/_supervisor/scale" and scope["method"] == "POST":
+            query = dict(p.split("=", 1) for p in scope.get("query_string", b"").decode().split("&") if "=" in p)
+            try:
+                result = await self.scale(int(query.get("workers", "")))
+            except (ValueError, RuntimeError, TimeoutError) as e:
+                await _send_json(send, 400, {"detail": str(e)})
+                return
+            await _send_json(send, 200, result)
+        else:
+            await _send_json(send, 404, {"detail": "Not Found"})
+
+    async def __call__(self, scope, receive, send):
+        """The proxy, an ASGI app served on the public port"""
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    try:
+                        await self.start()
+                    except Exception as e:
+                        await send({"type": "lifespan.startup.failed", "message": str(e)})
+                        return
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await self.stop()
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            return
+        if scope["path"].startswith("/_supervisor/"):
+            await self._control(scope, receive, send)
+            return
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body", False):
+                break
+
+        worker = self.pick(route_key(scope, body))
+        headers = [(k, v) for k, v in scope.get("headers") or [] if k not in HOP_HEADERS]
+        client_host = (scope.get("client") or ("unknown",))[0]
+        forwarded = dict(headers).get(b"x-forwarded-for")
+        headers = [(k, v) for k, v in headers if k != b"x-forwarded-for"] + [(
+            b"x-forwarded-for",
+            (forwarded + b", " if forwarded else b"") + client_host.encode()
+        )]
+        url = worker.url + scope.get("raw_path", scope["path"].encode()).decode()
+        if scope.get("query_string"):
+            url += "?" + scope["query_string"].decode()
+
+        try:
+            request = self._client.build_request(scope["method"], url, headers=headers, content=body)
+            response = await self._client.send(request, stream=True)
+        except Exception as e:
+            logger.error(f"Proxy to {worker.name} failed: {str(e)}")
+            await _send_json(send, 502, {"detail": f"{worker.name} unavailable"})
+            return
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": [
+                    (k, v) for k, v in response.headers.raw if k.lower() not in HOP_HEADERS
+                ] + [(b"x-worker", worker.name.encode())],
+            })
+            # Streamed through so the NDJSON export is not buffered here
+            async for chunk in response.aiter_raw():
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            await response.aclose()
+
+
+async def _send_json(send, status: int, content: Dict):
+    body = json.dumps(content).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Serve the API from several workers with per-user affinity")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="Worker processes")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000, help="Public port of the proxy")
+    parser.add_argument("--base-port", type=int, default=8100, help="First local port for workers")
+    parser.add_argument("--app", default="main:app", help="ASGI app each worker runs")
+    parser.add_argument("--health-path", default="/", help="Path polled before a worker gets traffic")
+    parser.add_argument("--drain-seconds", type=float, default=5.0, help="Grace period when removing a worker")
+    args = parser.parse_args(argv)
+
+    import uvicorn
+    logging.basicConfig(level=logging.INFO)
+    supervisor = Supervisor(args.workers, args.base_port, args.app, args.health_path, args.drain_seconds)
+    uvicorn.run(supervisor, host=args.host, port=args.port, lifespan="on")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,45 @@
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 import json
 from datetime import datetime
-from openai import AsyncOpenAI
 import asyncio
 from pydantic import BaseModel
+from pymongo.errors import DuplicateKeyError
 import os
+import time
+import uuid
 from db.database import Database
+from utils.usage import UsageTracker, STAGE_MOOD, STAGE_REPLY
+from utils import metrics
+from utils.tracing import span
+from utils.encryption import FieldEncryptor
+from config import get_settings
+from models.context import ContextState
+from utils.extraction import enrich_context
+from utils.analytics import MoodAnalytics
+
+MOOD_PROMPT = {
+    "role": "system",
+    "content": """Analyze the following message and determine the primary emotion/mood of the speaker. 
+    Choose ONLY ONE of these emotions: happy, sad, anxious, angry, bored, stressed, lonely, overwhelmed.
+    Respond with just the emotion word in lowercase, nothing else."""
+}
+
+# Concurrent turns for one user each reload and re-append at most this many times
+CONVERSATION_SAVE_ATTEMPTS = 5
+
+MOOD_TO_GENRES = {
+    "happy": ("comedy", "musical", "adventure", "family"),  # Maintain the joy
+    "sad": ("feel-good", "comedy", "inspirational", "drama"),  # Uplift spirits
+    "anxious": ("animation", "comedy", "fantasy", "family"),  # Calming content
+    "angry": ("comedy", "romance", "feel-good"),  # Lighten the mood
+    "bored": ("action", "thriller", "sci-fi", "adventure"),  # Engaging content
+    "stressed": ("nature-documentary", "animation", "fantasy"),  # Escapism
+    "lonely": ("romance", "drama", "comedy", "feel-good"),  # Connection
+    "overwhelmed": ("meditation", "nature-documentary", "gentle-comedy")  # Calming
+}
 
 class UserContext(BaseModel):
+    """API shape of the user context, the service works on ContextState internally"""
     mood: Optional[str] = None
     recent_activities: Optional[List[str]] = None  
     favorite_genres: Optional[List[str]] = None
@@ -23,19 +55,39 @@ class EmotionalSupportService:
     _instance = None
 
     @classmethod
-    def get_instance(cls, api_key: str):
+    def get_instance(cls, api_key: Optional[str] = None):
         """Singleton pattern to reuse the same service instance"""
         if cls._instance is None:
             cls._instance = cls(api_key)
         return cls._instance
 
-    def __init__(self, api_key: str, model: str = "gpt-4o-mini"):
-        self.client = AsyncOpenAI(api_key=api_key)
-        self.model = model
+    def __init__(self, api_key: Optional[str] = None, model: Optional[str] = None):
+        self._api_key = api_key
+        self._client = None
+        self.model = model or get_settings().openai_model
+        self.usage = UsageTracker.get_instance()
+        self.encryptor = FieldEncryptor.get_instance()
+        self.analytics = MoodAnalytics.get_instance()
         self.context_file = "data/user_context.json"
         self.conversation_file = "data/conversations.json"
         self._init_storage()
 
+    @property
+    def client(self):
+        """OpenAI client, built on first use so a missing key only fails the calls that need it"""
+        if self._client is None:
+            api_key = self._api_key or get_settings().openai_api_key
+            if not api_key:
+                raise ValueError("OPENAI_API_KEY environment variable not set")
+            # Imported here, the openai package is slow to import and not needed until the first turn
+            from openai import AsyncOpenAI
+            self._client = AsyncOpenAI(api_key=api_key)
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
     def _init_storage(self):
         """Initialize storage files if they don't exist"""
         os.makedirs('data', exist_ok=True)
@@ -47,73 +99,198 @@ class EmotionalSupportService:
             with open(self.conversation_file, 'w') as f:
                 json.dump({}, f)
 
-    async def _load_context(self, user_id: str) -> UserContext:
+    async def _load_context(self, user_id: str) -> ContextState:
         """Load user context from MongoDB"""
         try:
             contexts_collection = Database.get_db().contexts
-            context = await contexts_collection.find_one({"user_id": user_id})
-            return UserContext(**(context or {}))
+            with span("db.load_context"):
+                context = await contexts_collection.find_one({"user_id": user_id})
         except Exception as e:
             print(f"Error loading context: {e}")
-            return UserContext()
+            return ContextState()
+        if context and "enc" in context:
+            # Decrypt and keyring errors abort the turn, an empty context here
+            # would be saved over the sealed one and lose it
+            data, stale = await self.encryptor.decrypt(user_id, context["enc"])
+            context = ContextState.from_dict(data)
+            if stale:
+                # Sealed with a rotated data key, re-encrypt with the current one
+                await self._save_context(user_id, context)
+            return context
+        return ContextState.from_dict(context)
 
-    async def _save_context(self, user_id: str, context: UserContext):
+    async def _load_contexts(self, user_ids: List[str]) -> Dict[str, ContextState]:
+        """Load many users' contexts with one query, users without one get an empty context"""
+        contexts = {user_id: ContextState() for user_id in user_ids}
+        cursor = Database.get_db().contexts.find({"user_id": {"$in": list(user_ids)}})
+        async for doc in cursor:
+            user_id = doc["user_id"]
+            try:
+                if "enc" in doc:
+                    data, _ = await self.encryptor.decrypt(user_id, doc["enc"])
+                    contexts[user_id] = ContextState.from_dict(data)
+                else:
+                    contexts[user_id] = ContextState.from_dict(doc)
+            except Exception as e:
+                print(f"Error loading context for {user_id}: {e}")
+        return contexts
+
+    async def _save_context(self, user_id: str, context: ContextState):
         """Save user context to MongoDB"""
         try:
             contexts_collection = Database.get_db().contexts
-            context_dict = context.model_dump()
+            if self.encryptor.enabled:
+                # Replace the whole document so plaintext fields from before encryption are dropped
+                token = await self.encryptor.encrypt(user_id, context.to_document())
+                with span("db.save_context"):
+                    await contexts_collection.replace_one(
+                        {"user_id": user_id},
+                        {"user_id": user_id, "enc": token},
+                        upsert=True
+                    )
+                return
+
+            context_dict = context.to_document()
             context_dict["user_id"] = user_id
             
-            await contexts_collection.update_one(
-                {"user_id": user_id},
-                {"$set": context_dict},
-                upsert=True
-            )
+            # Replaced rather than $set so fields that went back to None are dropped,
+            # as model_dump() used to do by writing explicit nulls
+            with span("db.save_context"):
+                await contexts_collection.replace_one(
+                    {"user_id": user_id},
+                    context_dict,
+                    upsert=True
+                )
         except Exception as e:
             print(f"Error saving context: {e}")
 
-    async def _load_conversation(self, user_id: str) -> List[Dict]:
-        """Load conversation history from MongoDB"""
+    async def _load_conversation(self, user_id: str) -> Tuple[List[Dict[str, str]], int]:
+        """Load conversation history from MongoDB, with the sequence id of its newest message
+
+        Messages stay the {role, content} dicts they are stored as, they go into
+        the prompt and back into the document without being converted.
+        """
         try:
             conversations_collection = Database.get_db().conversations
-            conversation = await conversations_collection.find_one({"user_id": user_id})
-            return conversation.get("messages", []) if conversation else []
+            with span("db.load_conversation"):
+                conversation = await conversations_collection.find_one({"user_id": user_id})
         except Exception as e:
             print(f"Error loading conversation: {e}")
-            return []
+            return [], 0
+        if not conversation:
+            return [], 0
+        if "messages_enc" in conversation:
+            # The whole message window is sealed as one blob, one decrypt per load. Errors
+            # are raised, returning no history would let the turn overwrite the sealed window
+            messages, stale = await self.encryptor.decrypt(user_id, conversation["messages_enc"])
+        else:
+            messages, stale = conversation.get("messages", []), False
+        # Saved before sequence ids, numbered from the start of the stored window
+        seq = conversation.get("seq", len(messages))
+        if stale:
+            # Skipped if a turn saved in between, it re-encrypted the window anyway
+            await self._save_conversation(user_id, messages, seq, seq)
+        return messages, seq
+
+    async def _conversation_head(self, user_id: str) -> Optional[int]:
+        """Newest sequence id without loading or decrypting the messages
+
+        None for conversations saved before sequence ids were kept on the document.
+        """
+        with span("db.conversation_head"):
+            conversation = await Database.get_db().conversations.find_one(
+                {"user_id": user_id}, {"seq": 1}
+            )
+        if conversation is None:
+            return 0
+        return conversation.get("seq")
 
-    async def _save_conversation(self, user_id: str, messages: List[Dict]):
-        """Save conversation history to MongoDB"""
+    async def _save_conversation(self, user_id: str, messages: List[Dict[str, str]], seq: int,
+                                 loaded_seq: int) -> bool:
+        """Save conversation history to MongoDB, seq is the sequence id of the last message
+
+        Only written if the stored history is still at loaded_seq, the seq it was
+        loaded at. Returns False when another turn saved first, other errors are logged.
+        """
         try:
             conversations_collection = Database.get_db().conversations
             
             # Keep last 50 messages for context
             messages = messages[-50:]
             
-            await conversations_collection.update_one(
-                {"user_id": user_id},
-                {
+            if self.encryptor.enabled:
+                update = {
+                    "$set": {
+                        "user_id": user_id,
+                        # Kept in the clear so history requests can answer 304 without decrypting
+                        "seq": seq,
+                        "messages_enc": await self.encryptor.encrypt(user_id, messages)
+                    },
+                    "$unset": {"messages": ""}
+                }
+            else:
+                update = {
                     "$set": {
                         "user_id": user_id,
+                        "seq": seq,
                         "messages": messages
                     }
-                },
-                upsert=True
-            )
+                }
+
+            # Conversations saved before sequence ids have no seq, matched by None
+            with span("db.save_conversation"):
+                result = await conversations_collection.update_one(
+                    {"user_id": user_id, "seq": {"$in": [loaded_seq, None]}},
+                    update,
+                    # Only a first save inserts, the unique index rejects a racing one
+                    upsert=loaded_seq == 0
+                )
+            return bool(result.matched_count or result.upserted_id)
+        except DuplicateKeyError:
+            return False
         except Exception as e:
             print(f"Error saving conversation: {e}")
+            return True
+
+    async def _complete(self, user_id: str, stage: str, turn_id: Optional[str], **kwargs):
+        """Run a chat completion and record its latency, token usage and outcome"""
+        started = time.perf_counter()
+        try:
+            with span("openai.chat", stage=stage, model=self.model):
+                response = await self.client.chat.completions.create(model=self.model, **kwargs)
+        except Exception:
+            metrics.llm_requests_total.labels(stage, "error").inc()
+            raise
+        elapsed = time.perf_counter() - started
+
+        metrics.llm_requests_total.labels(stage, "ok").inc()
+        metrics.llm_request_duration_seconds.labels(stage, self.model).observe(elapsed)
+        if response.usage is not None:
+            metrics.llm_tokens_total.labels(stage, "prompt").inc(response.usage.prompt_tokens or 0)
+            metrics.llm_tokens_total.labels(stage, "completion").inc(response.usage.completion_tokens or 0)
+        self.usage.record(user_id, stage, self.model, response.usage, elapsed * 1000, turn_id=turn_id)
+        return response
 
-    async def get_support_response(self, user_id: str, user_message: str) -> Dict:
+    async def get_support_response(self, user_id: str, user_message: str,
+                                   when: Optional[datetime] = None, strict: bool = False,
+                                   entry_key: Optional[str] = None) -> Dict:
         """
         Get an empathetic response with personalized recommendations
+
+        when is the time the message was written, for mood analytics of imported entries.
+        strict and entry_key are passed to _update_context for batch retries.
         """
+        turn_id = uuid.uuid4().hex
         try:
             # First update the context based on the current message
-            await self._update_context(user_id, user_message)
+            with span("turn.update_context", user_id=user_id):
+                context = await self._update_context(
+                    user_id, user_message, turn_id, strict=strict, when=when, entry_key=entry_key
+                )
             
-            # Then load the fresh context and conversation history
-            context = await self._load_context(user_id)
-            conversation = await self._load_conversation(user_id)
+            # Then load the conversation history, the context is already fresh
+            with span("turn.load_history"):
+                conversation, seq = await self._load_conversation(user_id)
             
             # Prepare the system message with the mentor persona
             system_message = {
@@ -126,7 +303,7 @@ class EmotionalSupportService:
                 5. Maintain a warm, supportive tone while being professional
                 
                 When recommending content:
-                - Consider these genres that match the user's preferences and current mood: {', '.join(context.recommended_genres)}
+                - Consider these genres that match the user's preferences and current mood: {', '.join(context.recommended_genres or ())}
                 - Suggest specific movies/shows with brief explanations of why they might help
                 - Consider the user's current emotional state: {context.mood}
                 - Include a mix of uplifting and thoughtful content
@@ -142,11 +319,12 @@ class EmotionalSupportService:
             # Prepare messages including context
             messages = [system_message]
             
-            # Add relevant context if available
-            if context.model_dump(exclude_none=True):
+            # Add relevant context if available, serialized once for the prompt and the response
+            context_dict = context.to_dict()
+            if context_dict:
                 context_message = {
                     "role": "system",
-                    "content": f"User Context: {json.dumps(context.model_dump(exclude_none=True))}"
+                    "content": f"User Context: {json.dumps(context_dict)}"
                 }
                 messages.append(context_message)
             
@@ -157,30 +335,39 @@ class EmotionalSupportService:
             messages.append({"role": "user", "content": user_message})
 
             # Get AI response with conversation continuation
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=0.7,
-                max_tokens=800,
-                presence_penalty=0.6,  # Encourage new topics
-                frequency_penalty=0.7,   # Discourage repetition
-                top_p=0.9,  # Add nucleus sampling
-                stream=False  # Ensure we get complete responses
-            )
+            with span("turn.reply"):
+                response = await self._complete(
+                    user_id, STAGE_REPLY, turn_id,
+                    messages=messages,
+                    temperature=0.7,
+                    max_tokens=800,
+                    presence_penalty=0.6,  # Encourage new topics
+                    frequency_penalty=0.7,   # Discourage repetition
+                    top_p=0.9,  # Add nucleus sampling
+                    stream=False  # Ensure we get complete responses
+                )
 
             assistant_reply = response.choices[0].message.content
 
             # Update conversation history
-            conversation.append({"role": "user", "content": user_message})
-            conversation.append({"role": "assistant", "content": assistant_reply})
-            await self._save_conversation(user_id, conversation)
-
-            # Update context based on the interaction
-            await self._update_context(user_id, user_message)
+            turn = [
+                {"role": "user", "content": user_message},
+                {"role": "assistant", "content": assistant_reply}
+            ]
+            with span("turn.save_conversation"):
+                for _ in range(CONVERSATION_SAVE_ATTEMPTS):
+                    if await self._save_conversation(user_id, conversation + turn, seq + 2, seq):
+                        break
+                    # A concurrent turn for this user saved first, append after its messages
+                    conversation, seq = await self._load_conversation(user_id)
+                else:
+                    raise RuntimeError("Conversation kept changing, turn not saved")
 
             return {
                 "response": assistant_reply,
-                "context": context.model_dump(exclude_none=True)
+                "context": context_dict,
+                # Sequence id of the reply, the user's message is the one before it
+                "seq": seq + 2
             }
 
         except Exception as e:
@@ -190,35 +377,31 @@ class EmotionalSupportService:
                 "details": str(e)
             }
 
-    async def _update_context(self, user_id: str, user_message: str):
-        """Update user context based on the conversation"""
+    async def flush(self):
+        """Write buffered usage and mood analytics, for entry points that run without the app's lifespan"""
+        await self.usage.flush()
+        await self.analytics.flush()
+
+    async def _update_context(self, user_id: str, user_message: str, turn_id: Optional[str] = None,
+                              strict: bool = False, when: Optional[datetime] = None,
+                              entry_key: Optional[str] = None) -> ContextState:
+        """Update user context based on the conversation
+
+        A failed mood detection is logged and the turn goes on with the old mood,
+        with strict it is raised instead and nothing is saved, so the caller can retry.
+        An entry_key already applied to the context is not applied again, a retry
+        neither decays the extracted signals twice nor counts the mood twice.
+        """
         context = await self._load_context(user_id)
-        
-        # Use ChatGPT to detect mood
-        mood_prompt = {
-            "role": "system",
-            "content": """Analyze the following message and determine the primary emotion/mood of the speaker. 
-            Choose ONLY ONE of these emotions: happy, sad, anxious, angry, bored, stressed, lonely, overwhelmed.
-            Respond with just the emotion word in lowercase, nothing else."""
-        }
-        
-        MOOD_TO_GENRES = {
-            "happy": ["comedy", "musical", "adventure", "family"],  # Maintain the joy
-            "sad": ["feel-good", "comedy", "inspirational", "drama"],  # Uplift spirits
-            "anxious": ["animation", "comedy", "fantasy", "family"],  # Calming content
-            "angry": ["comedy", "romance", "feel-good"],  # Lighten the mood
-            "bored": ["action", "thriller", "sci-fi", "adventure"],  # Engaging content
-            "stressed": ["nature-documentary", "animation", "fantasy"],  # Escapism
-            "lonely": ["romance", "drama", "comedy", "feel-good"],  # Connection
-            "overwhelmed": ["meditation", "nature-documentary", "gentle-comedy"]  # Calming
-        }
+        if entry_key is not None and context.has_applied(entry_key):
+            return context
 
         try:
             # Detect mood
-            response = await self.client.chat.completions.create(
-                model=self.model,
+            response = await self._complete(
+                user_id, STAGE_MOOD, turn_id,
                 messages=[
-                    mood_prompt,
+                    MOOD_PROMPT,
                     {"role": "user", "content": user_message}
                 ],
                 temperature=0.3,  # Lower temperature for more consistent responses
@@ -226,24 +409,37 @@ class EmotionalSupportService:
             )
             
             detected_mood = response.choices[0].message.content.strip().lower()
+            metrics.mood_detections_total.labels(
+                detected_mood if detected_mood in MOOD_TO_GENRES else "unknown"
+            ).inc()
             if detected_mood in MOOD_TO_GENRES:
-                context.mood = detected_mood
+                # Counted for the cohort summaries, contexts are encrypted so moods are only visible here
+                self.analytics.record(user_id, detected_mood, when)
                 
                 # Get recommended genres based on mood
                 mood_genres = MOOD_TO_GENRES[detected_mood]
-                user_genres = context.favorite_genres or []
+                user_genres = context.favorite_genres or ()
                 
                 # Find common genres between mood recommendations and user preferences
-                common_genres = list(set(mood_genres) & set(user_genres))
+                common_genres = [g for g in mood_genres if g in user_genres]
                 
                 # If no common genres, use mood genres
-                context.recommended_genres = common_genres if common_genres else mood_genres
+                context.set_mood(detected_mood, common_genres if common_genres else mood_genres)
 
         except Exception as e:
+            if strict:
+                raise
             print(f"Error updating context: {e}")
         
+        # Stress, activities, goals and watched titles come from local rules, no extra call
+        with span("turn.extract_context"):
+            enrich_context(context, user_message)
+        if entry_key is not None:
+            context.mark_applied(entry_key)
+        
         # Save updated context
         await self._save_context(user_id, context)
+        return context
 
 async def interactive_session():
     # Get API key from environment variable
@@ -255,16 +451,19 @@ async def interactive_session():
     service = EmotionalSupportService.get_instance(api_key)  # Use singleton pattern here
     user_id = "moit"  # This should also come from user authentication
     
-    while True:
-        user_message = input("\nYou: ")
-        if user_message.lower() in ['quit', 'exit', 'bye']:
-            break
-            
-        response = await service.get_support_response(user_id, user_message)
-        if "error" in response:
-            print(f"Error: {response['error']}")
-        else:
-            print(f"\nJoy 🌟: {response['response']}")
+    try:
+        while True:
+            user_message = input("\nYou: ")
+            if user_message.lower() in ['quit', 'exit', 'bye']:
+                break
+
+            response = await service.get_support_response(user_id, user_message)
+            if "error" in response:
+                print(f"Error: {response['error']}")
+            else:
+                print(f"\nJoy 🌟: {response['response']}")
+    finally:
+        await service.flush()
         
 if __name__ == "__main__":
     asyncio.run(interactive_session())
@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+# Run from the backend directory: python -m pytest tests
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
@@ -0,0 +1,103 @@
+import pytest
+from models.context import ContextState
+from utils.extraction import (
+    ACTIVITY_HALF_LIFE, MIN_SCORE, NEUTRAL_STRESS, _bump, enrich_context,
+    mentioned_goals, mentioned_movies, stress_signal,
+)
+
+DAY = 86400
+
+
+class TestStressSignal:
+    def test_neutral_text_says_nothing(self):
+        assert stress_signal("Went to the store and bought bread.") is None
+
+    def test_stress_terms_raise_the_level(self):
+        assert stress_signal("I am stressed about the deadline") > NEUTRAL_STRESS
+
+    def test_calm_terms_lower_the_level(self):
+        assert stress_signal("Feeling calm and relaxed") < NEUTRAL_STRESS
+
+    def test_negation_flips_the_term(self):
+        assert stress_signal("I am not stressed") < NEUTRAL_STRESS
+
+    def test_intensifier_strengthens_the_term(self):
+        assert stress_signal("I am very stressed") > stress_signal("I am stressed")
+
+    def test_exclamation_marks_add_intensity(self):
+        assert stress_signal("I am stressed!!!") > stress_signal("I am stressed")
+
+    def test_clamped_to_the_scale(self):
+        assert stress_signal("panic panic panic overwhelmed burnout anxious stressed") == 10.0
+        assert stress_signal("calm relaxed peaceful relieved calm relaxed") == 1.0
+
+
+class TestMentionedMovies:
+    def test_capitalised_title(self):
+        assert mentioned_movies("Last night I watched Lord of the Rings again") == ["Lord of the Rings"]
+
+    def test_quoted_title(self):
+        assert mentioned_movies('We watched "the grand budapest hotel" together') == ["the grand budapest hotel"]
+
+    def test_title_does_not_continue_with_i(self):
+        assert mentioned_movies("I watched The Matrix and I want to run more") == ["The Matrix"]
+        assert mentioned_movies("Finally watched Dune and I'm speechless") == ["Dune"]
+
+    def test_small_words_join_capitalised_words(self):
+        assert mentioned_movies("rewatched Pride and Prejudice") == ["Pride and Prejudice"]
+
+    def test_saw_a_single_name_is_a_person(self):
+        assert mentioned_movies("I saw Anna at the gym") == []
+        assert mentioned_movies("I saw Inside Out") == ["Inside Out"]
+
+    def test_repeated_titles_counted_once(self):
+        assert mentioned_movies("watched Up, then watched Up again") == ["Up"]
+
+
+class TestMentionedGoals:
+    def test_goal_phrase(self):
+        assert mentioned_goals("I want to run more.") == ["run more"]
+
+    def test_goals_split_on_and(self):
+        assert mentioned_goals("I need to sleep earlier and I plan to read daily") == ["sleep earlier", "read daily"]
+
+    def test_predictions_are_not_goals(self):
+        assert mentioned_goals("I will be fine") == []
+        assert mentioned_goals("I'll see how it goes") == []
+
+    def test_bare_verbs_are_not_goals(self):
+        assert mentioned_goals("I will try.") == []
+        assert mentioned_goals("I need to sleep now") == []
+
+
+class TestBump:
+    def test_mention_adds_one(self):
+        scores, ranked = _bump({}, ["running"], now=0, half_life=ACTIVITY_HALF_LIFE, limit=5)
+        assert scores == {"running": [1.0, 0]}
+        assert ranked == ["running"]
+
+    def test_score_halves_after_a_half_life(self):
+        scores, _ = _bump({"running": [2.0, 0]}, [], now=ACTIVITY_HALF_LIFE, half_life=ACTIVITY_HALF_LIFE, limit=5)
+        assert scores["running"][0] == pytest.approx(1.0)
+
+    def test_decayed_entries_are_forgotten(self):
+        elapsed = ACTIVITY_HALF_LIFE * 3
+        assert 0.5 ** 3 < MIN_SCORE
+        scores, ranked = _bump({"running": [1.0, 0]}, [], now=elapsed, half_life=ACTIVITY_HALF_LIFE, limit=5)
+        assert scores == {} and ranked == []
+
+    def test_keeps_the_top_limit(self):
+        existing = {"a": [3.0, 0], "b": [2.0, 0], "c": [1.0, 0]}
+        scores, ranked = _bump(existing, ["c", "c"], now=0, half_life=ACTIVITY_HALF_LIFE, limit=2)
+        assert ranked == ["a", "c"]
+        assert set(scores) == {"a", "c"}
+
+
+def test_enrich_context_decays_stress_toward_neutral():
+    context = ContextState()
+    enrich_context(context, "I am so stressed and overwhelmed", now=0)
+    stressed = context.signals["stress"][0]
+    assert stressed > NEUTRAL_STRESS
+    enrich_context(context, "Went to the store", now=30 * DAY)
+    assert abs(context.signals["stress"][0] - NEUTRAL_STRESS) < abs(stressed - NEUTRAL_STRESS) / 100
+    assert context.stress_level == round(context.signals["stress"][0])
@@ -0,0 +1,87 @@
+import asyncio
+import pytest
+from utils import ratelimit
+from utils.ratelimit import MemoryCounterStore, SlidingWindowLimiter
+
+WINDOW = 60.0
+# Start of a window, so offsets below are fractions of it
+WINDOW_START = WINDOW * 1000
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = {"t": WINDOW_START}
+    monkeypatch.setattr(ratelimit.time, "time", lambda: now["t"])
+    return now
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_memory_store_counts_and_expires(monkeypatch):
+    now = {"t": 100.0}
+    monkeypatch.setattr(ratelimit.time, "monotonic", lambda: now["t"])
+    store = MemoryCounterStore()
+    assert run(store.increment("a", ttl=10)) == 1
+    assert run(store.increment("a", ttl=10)) == 2
+    assert run(store.increment("a", ttl=10, amount=-1)) == 1
+    assert run(store.get_many(["a", "b"])) == {"a": 1}
+    now["t"] = 111.0
+    assert run(store.get_many(["a"])) == {}
+
+
+def test_allows_limit_then_rejects(clock):
+    limiter = SlidingWindowLimiter(MemoryCounterStore(), "test", limit=3, window=WINDOW)
+    results = [run(limiter.attempt("ip"))[1] for _ in range(4)]
+    assert results[:3] == [None, None, None]
+    assert results[3] == WINDOW
+
+
+def test_previous_window_counts_by_overlap(clock):
+    limiter = SlidingWindowLimiter(MemoryCounterStore(), "test", limit=10, window=WINDOW)
+    for _ in range(10):
+        run(limiter.attempt("ip"))
+    # Halfway through the next window the previous one still weighs 10 * 0.5
+    clock["t"] = WINDOW_START + WINDOW * 1.5
+    results = [run(limiter.attempt("ip"))[1] for _ in range(6)]
+    assert results[:5] == [None] * 5
+    assert results[5] == WINDOW / 2
+
+
+def test_previous_window_is_forgotten_after_two_windows(clock):
+    limiter = SlidingWindowLimiter(MemoryCounterStore(), "test", limit=2, window=WINDOW)
+    for _ in range(5):
+        run(limiter.attempt("ip"))
+    clock["t"] = WINDOW_START + WINDOW * 2
+    assert run(limiter.attempt("ip"))[1] is None
+
+
+def test_keys_are_independent(clock):
+    limiter = SlidingWindowLimiter(MemoryCounterStore(), "test", limit=1, window=WINDOW)
+    assert run(limiter.attempt("a"))[1] is None
+    assert run(limiter.attempt("b"))[1] is None
+    assert run(limiter.attempt("a"))[1] is not None
+
+
+def test_refund_goes_to_the_attempted_window(clock):
+    store = MemoryCounterStore()
+    limiter = SlidingWindowLimiter(store, "test", limit=5, window=WINDOW)
+    clock["t"] = WINDOW_START + WINDOW - 0.1
+    counter, _ = run(limiter.attempt("alice"))
+    # The window rolls over between the attempt and the refund
+    clock["t"] = WINDOW_START + WINDOW + 0.1
+    run(limiter.refund(counter))
+    current, previous, _ = limiter._keys("alice", clock["t"])
+    assert previous == counter
+    assert run(store.get_many([current, previous])) == {previous: 0}
+
+
+def test_concurrent_attempts_cannot_exceed_limit(clock):
+    limiter = SlidingWindowLimiter(MemoryCounterStore(), "test", limit=5, window=WINDOW)
+
+    async def burst():
+        return await asyncio.gather(*(limiter.attempt("ip") for _ in range(20)))
+
+    allowed = [retry_after for _, retry_after in run(burst()) if retry_after is None]
+    assert len(allowed) == 5
@@ -0,0 +1,237 @@
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import logging
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from config import get_settings
+from db.database import Database
+
+logger = logging.getLogger(__name__)
+
+# Cohort dimensions the summaries are kept for, "all" is the whole user base
+DIMENSION_ALL = "all"
+DIMENSION_ACTIVITY_LEVEL = "activity_level"
+DIMENSION_GENRE = "genre"
+DIMENSIONS = (DIMENSION_ALL, DIMENSION_ACTIVITY_LEVEL, DIMENSION_GENRE)
+
+UNKNOWN = "unknown"
+
+
+def _add_counts(target: Dict[Tuple[str, str, str], Dict[str, int]], key: Tuple[str, str, str],
+                counts: Dict[str, int]):
+    merged = target.setdefault(key, {})
+    for mood, n in counts.items():
+        merged[mood] = merged.get(mood, 0) + n
+
+
+def _summary_update(key: Tuple[str, str, str], counts: Dict[str, int]) -> UpdateOne:
+    dimension, value, day = key
+    return UpdateOne(
+        {"_id": f"{dimension}|{value}|{day}"},
+        {
+            "$setOnInsert": {"dimension": dimension, "value": value, "day": day},
+            "$inc": {"total": sum(counts.values()), **{f"moods.{mood}": n for mood, n in counts.items()}}
+        },
+        upsert=True
+    )
+
+
+class MoodAnalytics:
+    """Keeps mood distributions per day and cohort in the analytics collection
+
+    Contexts are encrypted, so instead of scanning them the mood stage reports
+    each detection here. Detections are counted in memory and flushed as $inc
+    upserts, one document per (dimension, value, day), so cohort queries read a
+    few hundred small documents instead of joining collections.
+    """
+    _instance = None
+
+    @classmethod
+    def get_instance(cls):
+        """Singleton pattern to share one aggregator across the app"""
+        if cls._instance is None:
+            settings = get_settings()
+            cls._instance = cls(
+                flush_interval=settings.analytics_flush_interval,
+                cohort_cache_size=settings.analytics_cohort_cache_size,
+                max_days=settings.analytics_max_days,
+                max_documents=settings.analytics_max_documents,
+                query_timeout_ms=settings.analytics_query_timeout_ms,
+                min_cohort_size=settings.analytics_min_cohort_size
+            )
+        return cls._instance
+
+    @classmethod
+    def preferences_changed(cls, user_id: str, preferences: Dict):
+        """Keep the cohort cache current, called whenever preferences are saved"""
+        if cls._instance is not None:
+            cls._instance._remember_cohort(user_id, preferences)
+
+    def __init__(self, flush_interval: float = 60.0, cohort_cache_size: int = 50000,
+                 max_days: int = 366, max_documents: int = 5000, query_timeout_ms: int = 2000,
+                 min_cohort_size: int = 5):
+        self.flush_interval = flush_interval
+        self.cohort_cache_size = cohort_cache_size
+        self.max_days = max_days
+        self.max_documents = max_documents
+        self.query_timeout_ms = query_timeout_ms
+        self.min_cohort_size = min_cohort_size
+        # (user_id, mood, day) detections not yet written
+        self._pending: List[Tuple[str, str, str]] = []
+        # Summary increments whose write failed, (dimension, value, day) -> mood -> count
+        self._retry: Dict[Tuple[str, str, str], Dict[str, int]] = {}
+        # user_id -> (activity_level, favorite genres), least recently used first
+        self._cohorts: "OrderedDict[str, Tuple[str, Tuple[str, ...]]]" = OrderedDict()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def record(self, user_id: str, mood: str, when: Optional[datetime] = None):
+        """Count one mood detection, no I/O on the turn path"""
+        self._pending.append((user_id, mood, (when or datetime.now()).date().isoformat()))
+
+    def _remember_cohort(self, user_id: str, preferences: Optional[Dict]):
+        preferences = preferences or {}
+        activity_level = preferences.get("activity_level") or UNKNOWN
+        # ActivityLevel is a str enum, store its plain value
+        activity_level = getattr(activity_level, "value", activity_level)
+        genres = tuple(sorted({g.lower() for g in preferences.get("favorite_genres") or []}))
+        self._cohorts[user_id] = (activity_level, genres)
+        self._cohorts.move_to_end(user_id)
+        while len(self._cohorts) > self.cohort_cache_size:
+            self._cohorts.popitem(last=False)
+
+    async def _load_cohorts(self, user_ids: List[str]):
+        """Fill the cache for users not in it, one query for the whole flush"""
+        missing = list({u for u in user_ids if u not in self._cohorts})
+        if not missing:
+            return
+        found = set()
+        cursor = Database.get_db().user_preferences.find(
+            {"user_id": {"$in": missing}},
+            {"user_id": 1, "activity_level": 1, "favorite_genres": 1}
+        )
+        async for preferences in cursor:
+            found.add(preferences["user_id"])
+            self._remember_cohort(preferences["user_id"], preferences)
+        for user_id in missing:
+            if user_id not in found:
+                self._remember_cohort(user_id, None)
+
+    async def flush(self):
+        """Write pending detections to the summaries as $inc upserts
+
+        $inc is not idempotent, so after a partial failure only the updates that
+        failed are retried. Updates that were applied are never sent again.
+        """
+        async with self._flush_lock:
+            if not self._pending and not self._retry:
+                return
+            batch, self._pending = self._pending, []
+            try:
+                await self._load_cohorts([user_id for user_id, _, _ in batch])
+            except Exception as e:
+                logger.error(f"Failed to flush {len(batch)} mood detections: {str(e)}")
+                # Nothing was written, put them back so they are retried on the next flush
+                self._pending = batch + self._pending
+                return
+
+            increments, self._retry = self._retry, {}
+            for user_id, mood, day in batch:
+                activity_level, genres = self._cohorts.get(user_id, (UNKNOWN, ()))
+                keys = [(DIMENSION_ALL, "*", day), (DIMENSION_ACTIVITY_LEVEL, activity_level, day)]
+                keys += [(DIMENSION_GENRE, genre, day) for genre in genres]
+                for key in keys:
+                    _add_counts(increments, key, {mood: 1})
+
+            keys = list(increments)
+            operations = [_summary_update(key, increments[key]) for key in keys]
+            try:
+                await Database.get_db().analytics.bulk_write(operations, ordered=False)
+            except BulkWriteError as e:
+                failed = [error["index"] for error in e.details.get("writeErrors", [])]
+                logger.error(f"{len(failed)} of {len(operations)} mood summary updates failed, retrying them next flush")
+                for index in failed:
+                    _add_counts(self._retry, keys[index], increments[keys[index]])
+            except Exception as e:
+                # No result came back, so which updates were applied is unknown. They are
+                # retried, and a server-side failure can then count them twice.
+                logger.error(f"Failed to write {len(operations)} mood summary updates: {str(e)}")
+                for key in keys:
+                    _add_counts(self._retry, key, increments[key])
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        """Start the background flush loop"""
+        if self._flush_task is None:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_periodically())
+
+    async def stop(self):
+        """Stop the background flush loop and flush what is left"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+    async def query(self, dimension: str, start: Optional[date] = None, end: Optional[date] = None,
+                    value: Optional[str] = None) -> Dict:
+        """Mood distribution per cohort value (or per day for "all") between start and end
+
+        Bounded by max_days of range, max_documents read and query_timeout_ms on
+        the server. Cohorts with fewer than min_cohort_size detections are hidden.
+        """
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"dimension must be one of {', '.join(DIMENSIONS)}")
+        end = end or date.today()
+        start = start or end - timedelta(days=29)
+        if start > end:
+            raise ValueError("start must not be after end")
+        days = (end - start).days + 1
+        if days > self.max_days:
+            raise ValueError(f"Range of {days} days exceeds the limit of {self.max_days}")
+
+        match = {"dimension": dimension, "day": {"$gte": start.isoformat(), "$lte": end.isoformat()}}
+        if value is not None:
+            match["value"] = value
+        documents = await Database.get_db().analytics.find(
+            match, {"_id": 0, "value": 1, "day": 1, "total": 1, "moods": 1}
+        # Sorted so a truncated result is the earliest days of the range, not an arbitrary subset
+        ).sort("day", 1).max_time_ms(self.query_timeout_ms).limit(self.max_documents + 1).to_list(length=self.max_documents + 1)
+        truncated = len(documents) > self.max_documents
+        documents = documents[:self.max_documents]
+
+        groups: Dict[str, Dict] = {}
+        for doc in documents:
+            # "all" is broken down by day, the cohort dimensions by their value
+            key = doc["day"] if dimension == DIMENSION_ALL else doc["value"]
+            group = groups.setdefault(key, {"total": 0, "moods": {}})
+            group["total"] += doc.get("total", 0)
+            for mood, n in (doc.get("moods") or {}).items():
+                group["moods"][mood] = group["moods"].get(mood, 0) + n
+
+        suppressed = [key for key, group in groups.items() if group["total"] < self.min_cohort_size]
+        for key in suppressed:
+            del groups[key]
+        for group in groups.values():
+            group["distribution"] = {
+                mood: round(n / group["total"], 4) for mood, n in sorted(group["moods"].items())
+            } if group["total"] else {}
+
+        return {
+            "dimension": dimension,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "cohorts": dict(sorted(groups.items())),
+            "suppressed": len(suppressed),
+            "cost": {
+                "documents_read": len(documents),
+                "max_documents": self.max_documents,
+                "max_time_ms": self.query_timeout_ms,
+                "truncated": truncated
+            }
+        }
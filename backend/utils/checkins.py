@@ -0,0 +1,364 @@
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
+import asyncio
+import json
+import logging
+import os
+from config import get_settings
+from db.database import Database
+from models.user_activity import UserActivity
+from utils.usage import STAGE_CHECKIN
+
+logger = logging.getLogger(__name__)
+
+MINUTES_PER_DAY = 24 * 60
+# How far each re-sync reaches back before the previous one, covers clock skew between processes
+RESYNC_OVERLAP = timedelta(seconds=30)
+PROFILE_FIELDS = {"user_id": 1, "name": 1, "preferred_notification_time": 1, "preferred_meditation_time": 1}
+
+
+def parse_minute(value: Optional[str]) -> Optional[int]:
+    """Minute of the day for an "HH:MM" preferred_notification_time"""
+    if not value:
+        return None
+    try:
+        hour, minute = map(int, value.split(":"))
+    except ValueError:
+        return None
+    if not (0 <= hour <= 23 and 0 <= minute <= 59):
+        return None
+    return hour * 60 + minute
+
+
+class MinuteWheel:
+    """Users bucketed by the minute of the day they want a check-in
+
+    Moving a user is O(1) and a tick only touches the users due that minute,
+    nothing scans the whole user base after the initial load.
+    """
+
+    def __init__(self):
+        self._buckets: List[Set[str]] = [set() for _ in range(MINUTES_PER_DAY)]
+        self._minute_of: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._minute_of)
+
+    def set(self, user_id: str, minute: Optional[int]):
+        previous = self._minute_of.pop(user_id, None)
+        if previous is not None:
+            self._buckets[previous].discard(user_id)
+        if minute is not None:
+            self._buckets[minute].add(user_id)
+            self._minute_of[user_id] = minute
+
+    def due(self, minute: int) -> List[str]:
+        return list(self._buckets[minute % MINUTES_PER_DAY])
+
+
+class LogChannel:
+    """Local stub channel, appends each check-in as a JSON line"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _write(self, lines: List[str]):
+        with open(self.path, "a") as f:
+            f.writelines(lines)
+
+    async def send(self, checkins: List[Dict]):
+        lines = [json.dumps(c, default=str) + "\n" for c in checkins]
+        await asyncio.to_thread(self._write, lines)
+
+
+class WebhookChannel:
+    """Posts batches of check-ins as JSON to a push or messaging gateway"""
+
+    def __init__(self, endpoint: str, timeout: float = 10.0):
+        import httpx
+        self.endpoint = endpoint
+        self._client = httpx.AsyncClient(timeout=timeout)
+
+    async def send(self, checkins: List[Dict]):
+        response = await self._client.post(
+            self.endpoint,
+            content=json.dumps({"checkins": checkins}, default=str),
+            headers={"content-type": "application/json"}
+        )
+        response.raise_for_status()
+
+
+def template_prompt(name: Optional[str], context, meditation_minutes: Optional[int]) -> str:
+    """A check-in built from the stored context, costs no LLM call"""
+    greeting = f"Hi {name}!" if name else "Hi!"
+    if context.stress_level is not None and context.stress_level >= 7:
+        opener = "Things sounded heavy last time. How are you holding up today?"
+    elif context.mood in ("sad", "lonely"):
+        opener = "I've been thinking about you. How are you feeling today?"
+    elif context.mood == "happy":
+        opener = "You sounded upbeat last time, is the good streak still going?"
+    else:
+        opener = "How has your day been so far?"
+    parts = [greeting, opener]
+    if context.goals:
+        parts.append(f"Any progress on your goal to {context.goals[0]}?")
+    elif context.recent_activities:
+        parts.append(f"Did you get some time for {context.recent_activities[0]} lately?")
+    if meditation_minutes:
+        parts.append(f"A {meditation_minutes} minute meditation might be a nice way to pause.")
+    return " ".join(parts)
+
+
+class CheckInScheduler:
+    """Sends each user a daily check-in at their preferred_notification_time
+
+    Users are indexed once into a minute wheel and kept current as preferences
+    are saved. Prompts for a minute are generated lead_minutes ahead, in batches
+    with bounded concurrency, then delivered on the minute through the channel.
+    """
+    _instance = None
+
+    @classmethod
+    def get_instance(cls):
+        """Singleton pattern to share one scheduler across the app"""
+        if cls._instance is None:
+            settings = get_settings()
+            channel = None
+            if settings.checkin_channel == "log":
+                channel = LogChannel(settings.checkin_file)
+            elif settings.checkin_channel == "webhook":
+                channel = WebhookChannel(settings.checkin_webhook_url)
+            cls._instance = cls(
+                channel=channel,
+                lead_minutes=settings.checkin_lead_minutes,
+                batch_size=settings.checkin_batch_size,
+                concurrency=settings.checkin_concurrency,
+                use_llm=settings.checkin_prompt_mode == "llm",
+                resync_interval=settings.checkin_resync_interval
+            )
+        return cls._instance
+
+    @staticmethod
+    def should_run(settings) -> bool:
+        """Every supervised worker gets the same settings, only the named one sends check-ins"""
+        if not settings.checkin_enabled:
+            return False
+        return settings.worker_name is None or settings.worker_name == settings.checkin_worker
+
+    @classmethod
+    def preferences_changed(cls, user_id: str, preferences: Dict):
+        """Keep the wheel current for saves in this process, others are picked up by resync"""
+        if cls._instance is not None:
+            cls._instance.index_user(user_id, preferences)
+
+    def __init__(self, channel=None, lead_minutes: int = 5, batch_size: int = 200,
+                 concurrency: int = 8, use_llm: bool = False, resync_interval: float = 60.0):
+        self.channel = channel
+        self.lead_minutes = lead_minutes
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.use_llm = use_llm
+        self.resync_interval = resync_interval
+        self.wheel = MinuteWheel()
+        # Preferences saved at or after this time have not been read yet
+        self._synced_at: Optional[datetime] = None
+        # Per user: name and meditation length, needed to write the prompt
+        self._profiles: Dict[str, Dict] = {}
+        # Absolute minute -> prompts generated ahead of it
+        self._prepared: Dict[datetime, Dict[str, str]] = {}
+        self._prepare_tasks: Dict[datetime, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._resync_task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.failed = 0
+
+    def index_user(self, user_id: str, preferences: Dict):
+        minute = parse_minute(preferences.get("preferred_notification_time"))
+        self.wheel.set(user_id, minute)
+        if minute is None:
+            self._profiles.pop(user_id, None)
+        else:
+            self._profiles[user_id] = {
+                "name": preferences.get("name"),
+                "meditation_minutes": preferences.get("preferred_meditation_time")
+            }
+
+    async def load_index(self):
+        """Build the wheel from user_preferences, the only full read, done once at start"""
+        self._synced_at = datetime.now()
+        cursor = Database.get_db().user_preferences.find(
+            {"preferred_notification_time": {"$nin": [None, ""]}},
+            PROFILE_FIELDS
+        ).batch_size(5000)
+        async for preferences in cursor:
+            self.index_user(str(preferences["user_id"]), preferences)
+        logger.info(f"Check-in index loaded with {len(self.wheel)} users")
+
+    async def resync(self):
+        """Re-index users whose preferences changed since the last read
+
+        Saves on other supervisor workers and by cli.py provision never reach this
+        process's preferences_changed hook. Re-reading a user is harmless, so the
+        window overlaps the previous one to cover clock skew between processes.
+        """
+        started = datetime.now()
+        since = (self._synced_at or started) - RESYNC_OVERLAP
+        cursor = Database.get_db().user_preferences.find(
+            {"last_updated": {"$gte": since}},
+            PROFILE_FIELDS
+        ).sort("last_updated", 1).batch_size(5000)
+        changed = 0
+        async for preferences in cursor:
+            # Without a notification time index_user removes the user from the wheel
+            self.index_user(str(preferences["user_id"]), preferences)
+            changed += 1
+        self._synced_at = started
+        if changed:
+            logger.info(f"Check-in index re-synced {changed} users")
+
+    async def _resync_periodically(self):
+        while True:
+            await asyncio.sleep(self.resync_interval)
+            try:
+                await self.resync()
+            except Exception as e:
+                logger.error(f"Check-in index re-sync failed: {str(e)}")
+
+    async def _generate(self, service, user_id: str, context) -> str:
+        profile = self._profiles.get(user_id, {})
+        if self.use_llm:
+            try:
+                response = await service._complete(
+                    user_id, STAGE_CHECKIN, None,
+                    messages=[
+                        {"role": "system", "content": "You are Joy 🌟, an empathetic mentor. Write a warm, "
+                                                      "two sentence daily check-in message for the user."},
+                        {"role": "system", "content": f"User Context: {context.to_json()}"}
+                    ],
+                    temperature=0.8,
+                    max_tokens=80
+                )
+                return response.choices[0].message.content.strip()
+            except Exception as e:
+                logger.error(f"Check-in generation failed for {user_id}, using template: {str(e)}")
+        return template_prompt(profile.get("name"), context, profile.get("meditation_minutes"))
+
+    async def prepare(self, slot: datetime) -> Dict[str, str]:
+        """Generate the prompts for every user due at slot"""
+        return await self._generate_many(self.wheel.due(slot.hour * 60 + slot.minute))
+
+    async def _generate_many(self, user_ids: List[str]) -> Dict[str, str]:
+        from test1 import EmotionalSupportService
+        service = EmotionalSupportService.get_instance()
+        prompts: Dict[str, str] = {}
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def generate(user_id: str, context):
+            if not self.use_llm:
+                prompts[user_id] = await self._generate(service, user_id, context)
+                return
+            async with semaphore:
+                prompts[user_id] = await self._generate(service, user_id, context)
+
+        async def run_batch(batch: List[str]):
+            async with semaphore:
+                # One query per batch instead of one per user
+                contexts = await service._load_contexts(batch)
+            await asyncio.gather(*(generate(user_id, contexts[user_id]) for user_id in batch))
+
+        await asyncio.gather(*(
+            run_batch(user_ids[i:i + self.batch_size]) for i in range(0, len(user_ids), self.batch_size)
+        ))
+        return prompts
+
+    async def _prepare_slot(self, slot: datetime):
+        try:
+            self._prepared[slot] = await self.prepare(slot)
+        except Exception as e:
+            logger.error(f"Failed to prepare check-ins for {slot:%H:%M}: {str(e)}")
+
+    async def deliver(self, slot: datetime):
+        """Send the check-ins prepared for slot, generating the ones that are missing now"""
+        task = self._prepare_tasks.pop(slot, None)
+        if task is not None:
+            await task
+        prompts = self._prepared.pop(slot, {})
+        # Users who removed or moved their time since the prompts were generated are skipped,
+        # users who moved to this slot since, or whose preparation failed, are generated now
+        due = set(self.wheel.due(slot.hour * 60 + slot.minute))
+        missing = [user_id for user_id in due if user_id not in prompts]
+        if missing:
+            prompts.update(await self._generate_many(missing))
+        checkins = [
+            {"user_id": user_id, "message": message, "scheduled_for": slot}
+            for user_id, message in prompts.items() if user_id in due
+        ]
+        if not checkins or self.channel is None:
+            return
+        for i in range(0, len(checkins), self.batch_size):
+            batch = checkins[i:i + self.batch_size]
+            try:
+                await self.channel.send(batch)
+                self.sent += len(batch)
+            except Exception as e:
+                self.failed += len(batch)
+                logger.error(f"Failed to deliver {len(batch)} check-ins: {str(e)}")
+                continue
+            await Database.get_db().user_activities.insert_many([
+                UserActivity(user_id=c["user_id"], activity_type="checkin_sent", timestamp=datetime.now()).dict()
+                for c in batch
+            ], ordered=False)
+
+    async def _run(self):
+        # The first slot delivered is the next minute, the current one may already
+        # have been delivered by this worker before a restart
+        slot = datetime.now().replace(second=0, microsecond=0)
+        while True:
+            # Start generating the minute that just entered the lead window
+            ahead = slot + timedelta(minutes=self.lead_minutes)
+            if ahead not in self._prepare_tasks and ahead not in self._prepared:
+                self._prepare_tasks[ahead] = asyncio.get_running_loop().create_task(self._prepare_slot(ahead))
+            slot += timedelta(minutes=1)
+            # Sleep until the next minute, a late wake-up still runs every missed slot
+            delay = (slot - datetime.now()).total_seconds()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                await self.deliver(slot)
+            except Exception as e:
+                logger.error(f"Check-in delivery for {slot:%H:%M} failed: {str(e)}")
+
+    async def start(self):
+        """Load the index, pre-generate the first lead window and start the minute loop"""
+        if self._task is not None:
+            return
+        await self.load_index()
+        now = datetime.now().replace(second=0, microsecond=0)
+        loop = asyncio.get_running_loop()
+        for offset in range(1, self.lead_minutes):
+            slot = now + timedelta(minutes=offset)
+            self._prepare_tasks[slot] = loop.create_task(self._prepare_slot(slot))
+        self._task = loop.create_task(self._run())
+        self._resync_task = loop.create_task(self._resync_periodically())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._resync_task is not None:
+            self._resync_task.cancel()
+            self._resync_task = None
+        for task in self._prepare_tasks.values():
+            task.cancel()
+        self._prepare_tasks.clear()
+
+    def get_stats(self) -> Dict:
+        return {
+            "indexed_users": len(self.wheel),
+            "prepared_slots": sorted(f"{slot:%H:%M}" for slot in self._prepared),
+            "sent": self.sent,
+            "failed": self.failed
+        }
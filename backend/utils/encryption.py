@@ -1,32 +1,233 @@
-from cryptography.fernet import Fernet
-import os
-from dotenv import load_dotenv
+from cryptography.fernet import Fernet, MultiFernet
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
 import base64
+import hashlib
+import json
+import logging
+import os
+import time
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from config import get_settings
+from db.database import Database
+from utils.metrics import encryption_duration_seconds
+
+logger = logging.getLogger(__name__)
 
-load_dotenv()
+TOKEN_PREFIX = "g1"
+NONCE_SIZE = 12
 
-def get_encryption_key():
-    key = os.getenv('ENCRYPTION_KEY')
-    if not key:
-        # Generate a new key if none exists
-        key = Fernet.generate_key().decode()
-    try:
-        # Validate the key format
+
+def get_master_keys() -> List[str]:
+    """Master keys from ENCRYPTION_KEYS (newest first, comma separated) or ENCRYPTION_KEY"""
+    keys = get_settings().encryption_keys
+    for key in keys:
+        # Validate the key format, a bad key must never be silently replaced
         Fernet(key.encode())
-        return key
-    except Exception:
-        # If the key is invalid, generate a new one
-        return Fernet.generate_key().decode()
+    return keys
+
 
-ENCRYPTION_KEY = get_encryption_key()
-fernet = Fernet(ENCRYPTION_KEY.encode())
+_fernet = None
+
+def _get_fernet() -> MultiFernet:
+    global _fernet
+    if _fernet is None:
+        keys = get_master_keys()
+        if not keys:
+            raise ValueError("ENCRYPTION_KEY environment variable not set")
+        _fernet = MultiFernet([Fernet(k.encode()) for k in keys])
+    return _fernet
 
 def encrypt_data(data: str) -> str:
     if not data:
         return None
-    return fernet.encrypt(data.encode()).decode()
+    return _get_fernet().encrypt(data.encode()).decode()
 
 def decrypt_data(encrypted_data: str) -> str:
     if not encrypted_data:
         return None
-    return fernet.decrypt(encrypted_data.encode()).decode() 
\ No newline at end of file
+    return _get_fernet().decrypt(encrypted_data.encode()).decode()
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+class _MasterKey:
+    __slots__ = ("key_id", "aead")
+
+    def __init__(self, key: str):
+        raw = base64.urlsafe_b64decode(key.encode())
+        self.key_id = hashlib.sha256(raw).hexdigest()[:8]
+        # Derive a separate key-wrapping key rather than reusing the Fernet key bytes directly
+        self.aead = AESGCM(hashlib.sha256(b"moodscribe-kek:" + raw).digest())
+
+
+class UserKeyring:
+    """A user's unwrapped data keys, the current one encrypts and all of them decrypt"""
+    __slots__ = ("current_id", "keys")
+
+    def __init__(self, current_id: str, keys: Dict[str, AESGCM]):
+        self.current_id = current_id
+        self.keys = keys
+
+
+class FieldEncryptor:
+    """Envelope encryption of user data: per-user AES-GCM data keys wrapped by the master key"""
+    _instance = None
+
+    @classmethod
+    def get_instance(cls):
+        """Singleton pattern to share the data key cache across the app"""
+        if cls._instance is None:
+            cls._instance = cls(
+                master_keys=get_master_keys(),
+                cache_size=get_settings().data_key_cache_size
+            )
+        return cls._instance
+
+    def __init__(self, master_keys: List[str], cache_size: int = 10000):
+        self.master_keys = [_MasterKey(k) for k in master_keys]
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, UserKeyring]" = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.master_keys)
+
+    def _collection(self):
+        return Database.get_db().data_keys
+
+    def _wrap(self, user_id: str, key_id: str, data_key: bytes) -> Dict:
+        if not self.master_keys:
+            raise ValueError("ENCRYPTION_KEY environment variable not set")
+        master = self.master_keys[0]
+        nonce = os.urandom(NONCE_SIZE)
+        wrapped = master.aead.encrypt(nonce, data_key, f"{user_id}:{key_id}".encode())
+        return {
+            "key_id": key_id,
+            "master_id": master.key_id,
+            "wrapped": _b64encode(nonce + wrapped),
+            "created_at": datetime.now()
+        }
+
+    def _unwrap(self, user_id: str, record: Dict) -> Tuple[bytes, bool]:
+        """Unwrap a data key, the flag is True when it was wrapped under an older master key"""
+        for index, master in enumerate(self.master_keys):
+            if master.key_id == record["master_id"]:
+                blob = _b64decode(record["wrapped"])
+                data_key = master.aead.decrypt(
+                    blob[:NONCE_SIZE], blob[NONCE_SIZE:], f"{user_id}:{record['key_id']}".encode()
+                )
+                return data_key, index > 0
+        raise ValueError(f"No master key {record['master_id']} configured to unwrap data key for {user_id}")
+
+    def _new_key_record(self, user_id: str) -> Dict:
+        key_id = _b64encode(os.urandom(6))
+        return self._wrap(user_id, key_id, AESGCM.generate_key(bit_length=256))
+
+    def _cache_put(self, user_id: str, keyring: UserKeyring):
+        self._cache[user_id] = keyring
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _get_keyring(self, user_id: str) -> UserKeyring:
+        keyring = self._cache.get(user_id)
+        if keyring is not None:
+            self._cache.move_to_end(user_id)
+            return keyring
+
+        record = self._new_key_record(user_id)
+        # Create the user's first data key, the unique index on data_keys.user_id makes
+        # concurrent first upserts collide instead of creating two key documents
+        try:
+            doc = await self._collection().find_one_and_update(
+                {"user_id": user_id},
+                {"$setOnInsert": {"user_id": user_id, "current": record["key_id"], "keys": [record]}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Another caller inserted it first, use theirs
+            doc = await self._collection().find_one({"user_id": user_id})
+        data_keys = {}
+        stale_wrapping = False
+        for key_record in doc["keys"]:
+            data_keys[key_record["key_id"]], stale = self._unwrap(user_id, key_record)
+            stale_wrapping = stale_wrapping or stale
+        if stale_wrapping:
+            # MultiFernet-style rotation, keys wrapped by a retired master key are re-wrapped on read
+            records = [
+                {**self._wrap(user_id, key_record["key_id"], data_keys[key_record["key_id"]]),
+                 "created_at": key_record.get("created_at")}
+                for key_record in doc["keys"]
+            ]
+            # Only replaces the keys it read, a concurrent rotate_user_key $push wins and the
+            # re-wrap is simply retried on a later read
+            result = await self._collection().update_one(
+                {"user_id": user_id, "keys": doc["keys"]}, {"$set": {"keys": records}}
+            )
+            if result.modified_count:
+                logger.info(f"Re-wrapped data keys for {user_id} under master key {self.master_keys[0].key_id}")
+
+        keyring = UserKeyring(doc["current"], {k: AESGCM(v) for k, v in data_keys.items()})
+        self._cache_put(user_id, keyring)
+        return keyring
+
+    async def has_data_keys(self) -> bool:
+        """Whether any user data was ever encrypted, data keys are only created on first use"""
+        return await self._collection().find_one({}, {"_id": 1}) is not None
+
+    async def rotate_user_key(self, user_id: str) -> str:
+        """Add a new current data key for a user, old data is re-encrypted lazily on read"""
+        record = self._new_key_record(user_id)
+        await self._collection().update_one(
+            {"user_id": user_id},
+            {"$push": {"keys": record}, "$set": {"current": record["key_id"]}},
+            upsert=True
+        )
+        self._cache.pop(user_id, None)
+        return record["key_id"]
+
+    async def encrypt(self, user_id: str, value: Any) -> str:
+        """Encrypt a JSON-serializable value, e.g. a whole message window, in one AEAD call"""
+        started = time.perf_counter()
+        keyring = await self._get_keyring(user_id)
+        nonce = os.urandom(NONCE_SIZE)
+        plaintext = json.dumps(value, separators=(",", ":"), default=str).encode()
+        ciphertext = keyring.keys[keyring.current_id].encrypt(nonce, plaintext, user_id.encode())
+        token = f"{TOKEN_PREFIX}.{keyring.current_id}.{_b64encode(nonce + ciphertext)}"
+        _observe("encrypt", time.perf_counter() - started)
+        return token
+
+    async def decrypt(self, user_id: str, token: str) -> Tuple[Any, bool]:
+        """Decrypt a token, the flag is True when it was sealed with an old key and should be re-saved"""
+        started = time.perf_counter()
+        prefix, key_id, payload = token.split(".", 2)
+        if prefix != TOKEN_PREFIX:
+            raise ValueError(f"Unknown encryption format {prefix}")
+        keyring = await self._get_keyring(user_id)
+        aead = keyring.keys.get(key_id)
+        if aead is None:
+            # The key may have been rotated by another worker since it was cached
+            self._cache.pop(user_id, None)
+            keyring = await self._get_keyring(user_id)
+            aead = keyring.keys.get(key_id)
+        if aead is None:
+            raise ValueError(f"Unknown data key {key_id} for {user_id}")
+        blob = _b64decode(payload)
+        value = json.loads(aead.decrypt(blob[:NONCE_SIZE], blob[NONCE_SIZE:], user_id.encode()))
+        _observe("decrypt", time.perf_counter() - started)
+        return value, key_id != keyring.current_id
+
+
+
+def _observe(operation: str, seconds: float):
+    encryption_duration_seconds.labels(operation).observe(seconds)
@@ -0,0 +1,204 @@
+from typing import Dict, List, Optional, Tuple
+import math
+import re
+import time
+
+# Half-lives in seconds, how long until a mention counts half as much
+STRESS_HALF_LIFE = 3 * 86400
+ACTIVITY_HALF_LIFE = 7 * 86400
+GOAL_HALF_LIFE = 30 * 86400
+MOVIE_HALF_LIFE = 60 * 86400
+
+# Entries whose decayed score falls below this are forgotten
+MIN_SCORE = 0.2
+MAX_ACTIVITIES = 5
+MAX_GOALS = 5
+MAX_MOVIES = 10
+
+NEUTRAL_STRESS = 5.0
+# How far one message moves the stress level toward what it expresses
+STRESS_WEIGHT = 0.4
+
+STRESS_TERMS = {
+    "stressed": 2.0, "stress": 1.5, "stressful": 1.5, "overwhelmed": 2.5, "anxious": 2.0,
+    "anxiety": 2.0, "panic": 3.0, "worried": 1.5, "worry": 1.5, "worrying": 1.5,
+    "exhausted": 1.5, "tired": 1.0, "burnout": 2.5, "burned": 1.0, "deadline": 1.0,
+    "deadlines": 1.0, "pressure": 1.5, "frustrated": 1.5, "angry": 1.5, "cry": 1.5,
+    "crying": 1.5, "nervous": 1.5, "tense": 1.5, "can't sleep": 2.0, "insomnia": 2.0,
+    "relaxed": -2.0, "relaxing": -1.5, "calm": -2.0, "peaceful": -2.0, "rested": -1.5,
+    "happy": -1.5, "great": -1.0, "good": -0.5, "content": -1.0, "grateful": -1.5,
+    "relieved": -2.0, "chill": -1.5, "fun": -1.0,
+}
+INTENSIFIERS = {"very", "so", "really", "extremely", "super", "incredibly", "totally"}
+NEGATIONS = {"not", "no", "never", "don't", "didn't", "isn't", "wasn't", "can't", "cannot", "hardly"}
+
+# Mood from the mood stage, used as a weak prior when the text itself says little
+MOOD_STRESS = {
+    "stressed": 8, "overwhelmed": 9, "anxious": 8, "angry": 7, "sad": 6,
+    "lonely": 6, "bored": 4, "happy": 3,
+}
+
+# Canonical activity -> word stems that mention it
+ACTIVITIES = {
+    "walking": ("walk", "walked", "walking", "hike", "hiked", "hiking"),
+    "running": ("run", "ran", "running", "jog", "jogged", "jogging"),
+    "gym": ("gym", "workout", "worked out", "lifting", "exercise", "exercised"),
+    "yoga": ("yoga", "stretching", "pilates"),
+    "meditation": ("meditate", "meditated", "meditating", "meditation", "breathing exercise"),
+    "reading": ("read", "reading", "book", "novel"),
+    "cooking": ("cook", "cooked", "cooking", "bake", "baked", "baking"),
+    "gaming": ("game", "games", "gaming", "played video"),
+    "music": ("music", "guitar", "piano", "sing", "singing", "concert"),
+    "movies": ("movie", "movies", "film", "cinema", "netflix", "tv", "series"),
+    "socializing": ("friends", "friend", "party", "dinner with", "hung out", "hang out"),
+    "family time": ("family", "mom", "dad", "parents", "kids", "sister", "brother"),
+    "work": ("work", "office", "meeting", "meetings", "project", "shift"),
+    "studying": ("study", "studied", "studying", "exam", "exams", "class", "homework"),
+    "journaling": ("journal", "journaling", "diary", "wrote", "writing"),
+    "drawing": ("draw", "drew", "drawing", "paint", "painted", "painting", "sketch"),
+    "cycling": ("bike", "biked", "cycling", "cycled"),
+    "swimming": ("swim", "swam", "swimming", "pool"),
+    "gardening": ("garden", "gardening", "plants"),
+    "sleeping": ("nap", "napped", "slept", "sleep in"),
+}
+_ACTIVITY_BY_STEM = {stem: name for name, stems in ACTIVITIES.items() for stem in stems}
+_ACTIVITY_RE = re.compile(
+    r"\b(" + "|".join(sorted(map(re.escape, _ACTIVITY_BY_STEM), key=len, reverse=True)) + r")\b"
+)
+
+_STRESS_RE = re.compile(
+    r"\b(" + "|".join(sorted(map(re.escape, STRESS_TERMS), key=len, reverse=True)) + r")\b"
+)
+_WORD_RE = re.compile(r"[a-z']+")
+
+_GOAL_RE = re.compile(
+    r"\b(?:i want to|i'd like to|i would like to|i need to|i have to|i plan to|i'm planning to|"
+    r"i am planning to|i'm going to|i am going to|i will|i'll|i hope to|i'm trying to|"
+    r"i am trying to|my goal is to|my goal is)\s+([a-z][a-z' ]{2,60}?)(?=[.,!?;]|\band\b|\bbut\b|$)"
+)
+# Anything a goal phrase can end up with that is not an actual goal
+_GOAL_STOPWORDS = {"go", "do", "get", "try", "sleep now"}
+# Phrases starting with these are predictions or references, not goals ("I will be fine", "I'll see")
+_GOAL_STOP_VERBS = {"be", "see", "it", "that", "this"}
+
+_TITLE_WORD = r"[A-Z0-9][\w'’:&-]*"
+_MOVIE_RE = re.compile(
+    r"\b(?P<verb>(?i:watched|watching|rewatched|saw|seen|finished|binged|binge-watched))\s+"
+    r"(?:the movie |the film |the show |the series )?"
+    r"(?:\"(?P<double>[^\"]{2,60})\"|“(?P<curly>[^”]{2,60})”|'(?P<single>[^']{2,60})'|"
+    # Capitalised words, small words only count when another capitalised word follows.
+    # "I" never continues a title, "watched Dune and I cried" is not a title with "I" in it
+    r"(?P<title>" + _TITLE_WORD + r"(?:\s+(?:(?:of|the|and|a|in|on|to)\s+)*(?!I\b)" + _TITLE_WORD + r")*))"
+)
+
+
+def _decay(score: float, elapsed: float, half_life: float) -> float:
+    return score * math.pow(0.5, max(elapsed, 0) / half_life)
+
+
+def stress_signal(text: str) -> Optional[float]:
+    """Stress expressed by one message on the 1-10 scale, None when it says nothing either way"""
+    lowered = text.lower()
+    words = _WORD_RE.findall(lowered)
+    total = 0.0
+    hits = 0
+    for match in _STRESS_RE.finditer(lowered):
+        weight = STRESS_TERMS[match.group(1)]
+        # Look at the few words right before the term for "not" and "very"
+        before = _WORD_RE.findall(lowered[max(0, match.start() - 30):match.start()])[-3:]
+        if any(w in NEGATIONS for w in before):
+            weight = -weight * 0.5
+        elif any(w in INTENSIFIERS for w in before):
+            weight *= 1.5
+        total += weight
+        hits += 1
+    if not hits:
+        return None
+    # Exclamation marks and shouting add a little intensity in either direction
+    intensity = 1.0 + min(text.count("!"), 3) * 0.1
+    if words and sum(1 for w in text.split() if len(w) > 2 and w.isupper()) >= 2:
+        intensity += 0.2
+    return max(1.0, min(10.0, NEUTRAL_STRESS + total * intensity))
+
+
+def mentioned_activities(text: str) -> List[str]:
+    return list(dict.fromkeys(_ACTIVITY_BY_STEM[m.group(1)] for m in _ACTIVITY_RE.finditer(text.lower())))
+
+
+def mentioned_goals(text: str) -> List[str]:
+    goals = []
+    for match in _GOAL_RE.finditer(text.lower()):
+        words = match.group(1).split()[:6]
+        if not words or words[0] in _GOAL_STOP_VERBS:
+            continue
+        goal = " ".join(words).strip(" '")
+        if goal and goal not in _GOAL_STOPWORDS:
+            goals.append(goal)
+    return list(dict.fromkeys(goals))
+
+
+def mentioned_movies(text: str) -> List[str]:
+    titles = []
+    for match in _MOVIE_RE.finditer(text):
+        quoted = match.group("double") or match.group("curly") or match.group("single")
+        title = (quoted or match.group("title")).strip(" .,!?'\"")
+        # "saw Anna" is usually a person, unquoted single words only count after "watched" and the like
+        if not quoted and len(title.split()) == 1 and match.group("verb").lower() in ("saw", "seen"):
+            continue
+        if title:
+            titles.append(title)
+    return list(dict.fromkeys(titles))
+
+
+def _bump(scores: Dict[str, List[float]], keys: List[str], now: float, half_life: float,
+          limit: int) -> Tuple[Dict[str, List[float]], List[str]]:
+    """Decay every [score, updated_at] pair, add one per mention, keep the top limit"""
+    decayed = {}
+    for key, (score, updated_at) in scores.items():
+        score = _decay(score, now - updated_at, half_life)
+        if score >= MIN_SCORE:
+            decayed[key] = [score, now]
+    for key in keys:
+        score = decayed.get(key, [0.0, now])[0]
+        decayed[key] = [score + 1.0, now]
+    ranked = sorted(decayed, key=lambda k: decayed[k][0], reverse=True)[:limit]
+    return {k: [round(decayed[k][0], 4), now] for k in ranked}, ranked
+
+
+def enrich_context(context, text: str, now: Optional[float] = None):
+    """Fold one diary message into the context, no network calls
+
+    Running scores live in context.signals so decay is computed from the time
+    of the last update, a user coming back after a week starts close to neutral.
+    """
+    now = now if now is not None else time.time()
+    signals = dict(context.signals or {})
+
+    # Stress decays toward neutral, then moves toward what this message expresses
+    observed = stress_signal(text)
+    if observed is None and context.mood in MOOD_STRESS:
+        observed = float(MOOD_STRESS[context.mood])
+    level, updated_at = signals.get("stress") or [context.stress_level or NEUTRAL_STRESS, now]
+    level = NEUTRAL_STRESS + _decay(level - NEUTRAL_STRESS, now - updated_at, STRESS_HALF_LIFE)
+    if observed is not None:
+        level += (observed - level) * STRESS_WEIGHT
+    signals["stress"] = [round(level, 3), now]
+
+    signals["activities"], activities = _bump(
+        signals.get("activities") or {}, mentioned_activities(text), now, ACTIVITY_HALF_LIFE, MAX_ACTIVITIES
+    )
+    signals["goals"], goals = _bump(
+        signals.get("goals") or {}, mentioned_goals(text), now, GOAL_HALF_LIFE, MAX_GOALS
+    )
+    signals["movies"], movies = _bump(
+        signals.get("movies") or {}, mentioned_movies(text), now, MOVIE_HALF_LIFE, MAX_MOVIES
+    )
+
+    context.set_signals(
+        signals,
+        stress_level=int(round(level)) if observed is not None or context.stress_level is not None else None,
+        recent_activities=activities or None,
+        goals=goals or None,
+        watched_movies=movies or None,
+    )
+    return context
@@ -0,0 +1,50 @@
+from bisect import bisect
+from typing import Dict, Iterable, List, Optional
+import hashlib
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hash ring mapping keys (user ids) to nodes (workers)
+
+    Each node is placed on the ring many times so load spreads evenly. Adding a
+    node only moves the keys that land on its new points, about 1/N of them,
+    everyone else keeps their worker.
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), replicas: int = 160):
+        self.replicas = replicas
+        self._points: List[int] = []
+        self._owners: Dict[int, str] = {}
+        self._nodes: List[str] = []
+        for node in nodes:
+            self.add(node)
+
+    @property
+    def nodes(self) -> List[str]:
+        return list(self._nodes)
+
+    def add(self, node: str):
+        if node in self._nodes:
+            return
+        self._nodes.append(node)
+        for i in range(self.replicas):
+            self._owners[_hash(f"{node}#{i}")] = node
+        self._points = sorted(self._owners)
+
+    def remove(self, node: str):
+        if node not in self._nodes:
+            return
+        self._nodes.remove(node)
+        self._owners = {point: owner for point, owner in self._owners.items() if owner != node}
+        self._points = sorted(self._owners)
+
+    def get(self, key: str) -> Optional[str]:
+        """The node owning key, the first point clockwise from its hash"""
+        if not self._points:
+            return None
+        index = bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[self._points[index]]
@@ -0,0 +1,330 @@
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence, Tuple
+import threading
+import time
+from pymongo import monitoring
+
+# Default latency buckets in seconds, from 5ms up to 30s
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    """Base for metrics with optional labels, children are keyed by label values"""
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *values: str):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            # setdefault is atomic, threads racing to create a child all get the same one
+            child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in list(self._children.items()):
+            lines.extend(child.render(self.name, self.labelnames, key))
+        return lines
+
+
+class _CounterValue:
+    # pymongo command and pool listeners run in Motor's executor threads, and += is a
+    # read-modify-write the GIL does not make atomic, so updates take a lock
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def render(self, name, labelnames, key):
+        return [f"{name}{_format_labels(labelnames, key)} {self.value}"]
+
+
+class _GaugeValue(_CounterValue):
+    __slots__ = ()
+
+    def dec(self, amount: float = 1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        with self._lock:
+            self.value = value
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # One slot per bucket plus +Inf, cumulated only when rendering
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def render(self, name, labelnames, key):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            le = 'le="%s"' % bound
+            lines.append(f"{name}_bucket{_format_labels(labelnames, key, le)} {cumulative}")
+        cumulative += self.counts[-1]
+        le = 'le="+Inf"'
+        lines.append(f"{name}_bucket{_format_labels(labelnames, key, le)} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labelnames, key)} {self.sum}")
+        lines.append(f"{name}_count{_format_labels(labelnames, key)} {self.count}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterValue()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeValue()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+
+class MetricsRegistry:
+    """Holds every metric of the process and renders them in the text exposition format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# HTTP
+http_requests_total = registry.counter(
+    "http_requests_total", "Total HTTP requests", ("method", "route", "status")
+)
+http_request_duration_seconds = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency", ("method", "route")
+)
+http_requests_in_progress = registry.gauge(
+    "http_requests_in_progress", "HTTP requests currently being served"
+)
+
+# MongoDB
+mongo_command_duration_seconds = registry.histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency", ("command", "status")
+)
+mongo_pool_checkouts_total = registry.counter(
+    "mongo_pool_checkouts_total", "MongoDB connection pool checkouts", ("status",)
+)
+mongo_pool_checked_out = registry.gauge(
+    "mongo_pool_checked_out", "MongoDB connections currently checked out"
+)
+mongo_pool_waiting = registry.gauge(
+    "mongo_pool_waiting", "Operations waiting for a MongoDB connection"
+)
+mongo_pools = registry.gauge(
+    "mongo_pools", "MongoDB connection pools, one per server"
+)
+
+# LLM
+llm_request_duration_seconds = registry.histogram(
+    "llm_request_duration_seconds", "OpenAI completion latency", ("stage", "model")
+)
+llm_requests_total = registry.counter(
+    "llm_requests_total", "OpenAI completion calls", ("stage", "status")
+)
+llm_tokens_total = registry.counter(
+    "llm_tokens_total", "OpenAI tokens used", ("stage", "kind")
+)
+mood_detections_total = registry.counter(
+    "mood_detections_total", "Mood detection results, unknown when the reply was not a known mood",
+    ("result",)
+)
+
+# Encryption
+encryption_duration_seconds = registry.histogram(
+    "encryption_duration_seconds", "Field encryption and decryption time", ("operation",),
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01)
+)
+
+
+def route_template(scope) -> Optional[str]:
+    """Template of the matched route including its router's prefix, e.g. /api/auth/login
+
+    Routes of an included router carry only their own path, so the prefix is
+    taken from the request path in front of as many segments as the template has.
+    """
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    if path is None:
+        return None
+    prefix = scope.get("path", "").rsplit("/", path.count("/"))[0]
+    return prefix + path
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request counts and latency per route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_requests_in_progress.labels().inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_progress.labels().dec()
+            # Use the matched route template so paths with ids don't blow up cardinality
+            route_path = route_template(scope) or "unmatched"
+            method = scope.get("method", "")
+            http_request_duration_seconds.labels(method, route_path).observe(
+                time.perf_counter() - started
+            )
+            http_requests_total.labels(method, route_path, status_code).inc()
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Records MongoDB command latency, registered on the Motor client"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        mongo_command_duration_seconds.labels(event.command_name, "ok").observe(
+            event.duration_micros / 1e6
+        )
+
+    def failed(self, event):
+        mongo_command_duration_seconds.labels(event.command_name, "failed").observe(
+            event.duration_micros / 1e6
+        )
+
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    """Records connection pool checkouts, registered on the Motor client"""
+
+    def pool_created(self, event):
+        mongo_pools.labels().inc()
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        mongo_pools.labels().dec()
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        mongo_pool_waiting.labels().inc()
+
+    def connection_check_out_failed(self, event):
+        mongo_pool_waiting.labels().dec()
+        mongo_pool_checkouts_total.labels("failed").inc()
+
+    def connection_checked_out(self, event):
+        mongo_pool_waiting.labels().dec()
+        mongo_pool_checkouts_total.labels("ok").inc()
+        mongo_pool_checked_out.labels().inc()
+
+    def connection_checked_in(self, event):
+        mongo_pool_checked_out.labels().dec()
+
+
+def render_metrics() -> str:
+    return registry.render()
@@ -0,0 +1,182 @@
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import logging
+import math
+import time
+from pymongo import ReturnDocument
+from config import get_settings
+from db.database import Database
+from models.user_activity import UserActivity
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryCounterStore:
+    """Counters in this process only, fine for a single worker or per-worker limits"""
+
+    def __init__(self):
+        self._counts: Dict[str, Tuple[int, float]] = {}
+        self._last_prune = time.monotonic()
+
+    def _prune(self, now: float):
+        # Expired windows are dropped at most once a minute so memory stays bounded
+        if now - self._last_prune < 60:
+            return
+        self._counts = {k: v for k, v in self._counts.items() if v[1] > now}
+        self._last_prune = now
+
+    async def increment(self, key: str, ttl: float, amount: int = 1) -> int:
+        now = time.monotonic()
+        self._prune(now)
+        count, expires = self._counts.get(key, (0, now + ttl))
+        self._counts[key] = (count + amount, expires)
+        return count + amount
+
+    async def get_many(self, keys: List[str]) -> Dict[str, int]:
+        now = time.monotonic()
+        return {k: v[0] for k in keys if (v := self._counts.get(k)) and v[1] > now}
+
+
+class MongoCounterStore:
+    """Counters in the rate_limits collection, shared by every worker and host
+
+    A TTL index on expires_at removes old windows, see Database.init_indexes.
+    """
+
+    async def increment(self, key: str, ttl: float, amount: int = 1) -> int:
+        # Atomic on the server, concurrent attempts each get their own count back
+        doc = await Database.get_db().rate_limits.find_one_and_update(
+            {"_id": key},
+            {"$inc": {"count": amount}, "$setOnInsert": {"expires_at": datetime.utcnow() + timedelta(seconds=ttl)}},
+            upsert=True,
+            projection={"count": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        return doc["count"]
+
+    async def get_many(self, keys: List[str]) -> Dict[str, int]:
+        cursor = Database.get_db().rate_limits.find({"_id": {"$in": keys}}, {"count": 1})
+        return {doc["_id"]: doc["count"] async for doc in cursor}
+
+
+class SlidingWindowLimiter:
+    """Sliding window counter: the previous window counts in proportion to its overlap
+
+    Two small counters per key instead of a timestamp per attempt, and the
+    estimate never undercounts by more than one window's boundary effects.
+    """
+
+    def __init__(self, store, name: str, limit: int, window: float):
+        self.store = store
+        self.name = name
+        self.limit = limit
+        self.window = window
+
+    def _keys(self, key: str, now: float) -> Tuple[str, str, float]:
+        index = int(now // self.window)
+        elapsed = (now - index * self.window) / self.window
+        return f"{self.name}:{key}:{index}", f"{self.name}:{key}:{index - 1}", elapsed
+
+    async def attempt(self, key: str) -> Tuple[str, Optional[int]]:
+        """Count one attempt, returns the counter it went to and the seconds until
+        key may try again when it is over the limit (None when it is allowed)
+
+        The attempt is recorded first and the decision uses the count the store
+        returns, so concurrent attempts cannot all pass a check made before any
+        of them was counted. Rejected attempts count too.
+        """
+        now = time.time()
+        current, previous, elapsed = self._keys(key, now)
+        # Kept for two windows so it still counts as the previous one
+        count = await self.store.increment(current, ttl=self.window * 2)
+        counts = await self.store.get_many([previous])
+        estimate = counts.get(previous, 0) * (1 - elapsed) + count
+        if estimate <= self.limit:
+            return current, None
+        # Time until the previous window's share has decayed enough, at most the rest of this one
+        return current, max(1, math.ceil((1 - elapsed) * self.window))
+
+    async def refund(self, counter: str):
+        """Take back an attempt that turned out fine, e.g. a successful login
+
+        counter is the one attempt returned, the window may have rolled over since.
+        """
+        await self.store.increment(counter, ttl=self.window * 2, amount=-1)
+
+
+class AuthRateLimiter:
+    """Throttles login and registration before any password hashing happens
+
+    Login is limited per IP on every attempt and per username on failed attempts
+    only (successful ones are refunded), which caps guessing against one account
+    across many IPs. Rejections cost two counter updates and no hashing. Hashing itself is bounded by a
+    semaphore and runs in threads so a burst cannot freeze the event loop.
+    """
+    _instance = None
+
+    @classmethod
+    def get_instance(cls):
+        """Singleton pattern to share one limiter across the app"""
+        if cls._instance is None:
+            settings = get_settings()
+            store = MongoCounterStore() if settings.rate_limit_store == "mongo" else MemoryCounterStore()
+            cls._instance = cls(
+                login_ip=SlidingWindowLimiter(store, "login_ip", settings.login_ip_limit, settings.login_ip_window),
+                login_username=SlidingWindowLimiter(
+                    store, "login_user", settings.login_username_limit, settings.login_username_window
+                ),
+                register_ip=SlidingWindowLimiter(
+                    store, "register_ip", settings.register_ip_limit, settings.register_ip_window
+                ),
+                hash_concurrency=settings.auth_hash_concurrency,
+                trusted_proxies=settings.trusted_proxies
+            )
+        return cls._instance
+
+    def __init__(self, login_ip: SlidingWindowLimiter, login_username: SlidingWindowLimiter,
+                 register_ip: SlidingWindowLimiter, hash_concurrency: int = 4,
+                 trusted_proxies: Optional[List[str]] = None):
+        self.login_ip = login_ip
+        self.login_username = login_username
+        self.register_ip = register_ip
+        self.trusted_proxies = set(trusted_proxies or [])
+        self._hash_slots = asyncio.Semaphore(hash_concurrency)
+        # (limiter name, key) already reported as suspicious in the current window
+        self._reported: Dict[Tuple[str, str], float] = {}
+
+    def client_ip(self, request) -> str:
+        host = request.client.host if request.client else "unknown"
+        if host in self.trusted_proxies:
+            # The proxy appends the address it saw, the last entry is the one it vouches for
+            forwarded = request.headers.get("x-forwarded-for")
+            if forwarded:
+                return forwarded.split(",")[-1].strip()
+        return host
+
+    async def hash_password(self, hasher, *args):
+        """Run a bcrypt hash or verify in a thread, a bounded number at a time"""
+        async with self._hash_slots:
+            return await asyncio.to_thread(hasher, *args)
+
+    async def record_suspicious(self, limiter: SlidingWindowLimiter, key: str, user_id: str,
+                                activity_type: str, request):
+        """Log a suspicious attempt once per key and window, not once per rejected request"""
+        now = time.time()
+        marker = (limiter.name, key)
+        if self._reported.get(marker, 0) > now:
+            return
+        self._reported[marker] = now + limiter.window
+        if len(self._reported) > 10000:
+            self._reported = {k: v for k, v in self._reported.items() if v > now}
+        try:
+            await Database.get_db().user_activities.insert_one(UserActivity(
+                user_id=user_id,
+                activity_type=activity_type,
+                timestamp=datetime.now(),
+                ip_address=self.client_ip(request),
+                device_info=request.headers.get("user-agent"),
+                is_suspicious=True
+            ).dict())
+        except Exception as e:
+            logger.error(f"Failed to record suspicious {activity_type}: {str(e)}")
@@ -0,0 +1,109 @@
+from datetime import date, datetime
+from typing import Any, Optional
+import gzip
+import json
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+
+# orjson is optional, it serializes datetimes natively and is several times faster than json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value: Any):
+    """Types MongoDB documents carry that JSON has no encoding for"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """Encode a response body, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response encoding ObjectId and datetime directly
+
+    Returning one from an endpoint skips FastAPI's jsonable_encoder walk over the
+    content, which is the expensive part for large Mongo documents.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class GZipMiddleware:
+    """ASGI middleware gzipping complete JSON bodies when the client accepts it
+
+    Streaming responses, like the NDJSON export which compresses itself, pass
+    through untouched.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, compresslevel: int = 6):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.compresslevel = compresslevel
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = dict(scope.get("headers") or []).get(b"accept-encoding", b"")
+        if b"gzip" not in accept_encoding:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[dict] = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, passthrough
+            if message["type"] == "http.response.start":
+                headers = dict(message.get("headers") or [])
+                content_type = headers.get(b"content-type", b"")
+                if b"json" in content_type and b"content-encoding" not in headers:
+                    # Held back until the body shows whether it is worth compressing
+                    start = message
+                    return
+                passthrough = True
+                await send(message)
+                return
+
+            if passthrough or start is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            if message.get("more_body", False) or len(body) < self.minimum_size:
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+
+            compressed = gzip.compress(body, compresslevel=self.compresslevel)
+            headers = [
+                (key, value) for key, value in start.get("headers", [])
+                if key.lower() != b"content-length"
+            ]
+            headers += [
+                (b"content-encoding", b"gzip"),
+                (b"vary", b"Accept-Encoding"),
+                (b"content-length", str(len(compressed)).encode()),
+            ]
+            passthrough = True
+            await send({**start, "headers": headers})
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
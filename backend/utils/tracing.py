@@ -0,0 +1,342 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import asyncio
+import hmac
+import html
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from pymongo import monitoring
+from config import get_settings
+from utils.metrics import route_template
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attributes",
+                 "start", "duration_ms", "status", "_started")
+
+    def __init__(self, trace_id: str, name: str, parent_id: Optional[str] = None,
+                 attributes: Optional[Dict] = None):
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes or {}
+        self.start = time.time()
+        self.duration_ms = None
+        self.status = "ok"
+        self._started = time.perf_counter()
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def end(self, duration_ms: Optional[float] = None):
+        if duration_ms is None:
+            duration_ms = (time.perf_counter() - self._started) * 1000
+        self.duration_ms = round(duration_ms, 3)
+
+    def to_dict(self) -> Dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "attributes": self.attributes
+        }
+
+
+class Trace:
+    __slots__ = ("trace_id", "spans")
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex
+        self.spans: List[Span] = []
+
+    def to_dict(self) -> Dict:
+        spans = sorted(self.spans, key=lambda s: s.start)
+        return {"trace_id": self.trace_id, "spans": [s.to_dict() for s in spans]}
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+class JsonLinesExporter:
+    """Appends each finished trace as one JSON line to a local file
+
+    Past max_bytes the file is moved to <path>.1, replacing the previous one,
+    so at most about twice max_bytes is kept on disk and scanned by get_trace.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 20_000_000):
+        self.path = path
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def paths(self) -> List[str]:
+        """Files holding traces, newest first"""
+        return [self.path, f"{self.path}.1"]
+
+    def _write(self, lines: List[str]):
+        try:
+            if os.path.getsize(self.path) >= self.max_bytes:
+                os.replace(self.path, f"{self.path}.1")
+        except FileNotFoundError:
+            pass
+        with open(self.path, "a") as f:
+            f.writelines(lines)
+
+    async def export(self, traces: List[Dict]):
+        lines = [json.dumps(t, default=str) + "\n" for t in traces]
+        await asyncio.to_thread(self._write, lines)
+
+
+class CollectorExporter:
+    """Posts batches of traces as JSON to an OTLP-style HTTP collector"""
+
+    def __init__(self, endpoint: str, timeout: float = 5.0):
+        import httpx
+        self.endpoint = endpoint
+        self._client = httpx.AsyncClient(timeout=timeout)
+
+    async def export(self, traces: List[Dict]):
+        response = await self._client.post(self.endpoint, json={"traces": traces})
+        response.raise_for_status()
+
+
+class Tracer:
+    """Samples requests, collects their spans and exports finished traces"""
+    _instance = None
+
+    @classmethod
+    def get_instance(cls):
+        """Singleton pattern to share one tracer across the app"""
+        if cls._instance is None:
+            settings = get_settings()
+            exporter = None
+            if settings.trace_exporter == "jsonl":
+                exporter = JsonLinesExporter(settings.trace_file, settings.trace_file_max_bytes)
+            elif settings.trace_exporter == "collector":
+                exporter = CollectorExporter(settings.trace_collector_url)
+            cls._instance = cls(
+                sample_rate=settings.trace_sample_rate,
+                exporter=exporter,
+                force_token=settings.trace_force_token
+            )
+        return cls._instance
+
+    def __init__(self, sample_rate: float = 0.0, exporter=None, keep_recent: int = 200,
+                 force_token: Optional[str] = None):
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+        self.keep_recent = keep_recent
+        self.force_token = force_token
+        # Recently finished traces, served by the debug view
+        self._recent: "OrderedDict[str, Dict]" = OrderedDict()
+
+    def should_sample(self, force: Optional[str] = None) -> bool:
+        """Sample at sample_rate, or always when force is the configured force token"""
+        if force and self.force_token and hmac.compare_digest(force.encode(), self.force_token.encode()):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    @contextmanager
+    def start_trace(self, name: str, **attributes):
+        """Open a root span and collect every span opened under it into one trace"""
+        trace = Trace()
+        root = Span(trace.trace_id, name, attributes=attributes)
+        trace_token = _current_trace.set(trace)
+        span_token = _current_span.set(root)
+        try:
+            yield root
+        except Exception as e:
+            root.status = "error"
+            root.set_attribute("error", str(e))
+            raise
+        finally:
+            root.end()
+            trace.spans.append(root)
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+            self._finish(trace)
+
+    def _finish(self, trace: Trace):
+        data = trace.to_dict()
+        self._recent[trace.trace_id] = data
+        while len(self._recent) > self.keep_recent:
+            self._recent.popitem(last=False)
+        if self.exporter is not None:
+            try:
+                asyncio.get_running_loop().create_task(self._export(data))
+            except RuntimeError:
+                pass
+
+    async def _export(self, data: Dict):
+        try:
+            await self.exporter.export([data])
+        except Exception as e:
+            logger.error(f"Failed to export trace {data['trace_id']}: {str(e)}")
+
+    def get_trace(self, trace_id: str) -> Optional[Dict]:
+        """Look a trace up in memory, falling back to the JSON-lines files
+
+        The file scan blocks, call it from a thread.
+        """
+        if trace_id in self._recent:
+            return self._recent[trace_id]
+        if not isinstance(self.exporter, JsonLinesExporter):
+            return None
+        for path in self.exporter.paths:
+            if not os.path.exists(path):
+                continue
+            with open(path) as f:
+                for line in f:
+                    if trace_id in line:
+                        data = json.loads(line)
+                        if data.get("trace_id") == trace_id:
+                            return data
+        return None
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a block as a child of the current span, a no-op when the request is not traced"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    parent = _current_span.get()
+    current = Span(trace.trace_id, name, parent.span_id if parent else None, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.status = "error"
+        current.set_attribute("error", str(e))
+        raise
+    finally:
+        current.end()
+        _current_span.reset(token)
+        trace.spans.append(current)
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.trace_id if trace else None
+
+
+class TracingMiddleware:
+    """ASGI middleware opening a sampled trace per request, `X-Trace: <force token>` forces sampling"""
+
+    def __init__(self, app, tracer: Optional[Tracer] = None):
+        self.app = app
+        self.tracer = tracer or Tracer.get_instance()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        force = headers.get(b"x-trace")
+        if not self.tracer.should_sample(force=force.decode("latin-1") if force else None):
+            await self.app(scope, receive, send)
+            return
+
+        with self.tracer.start_trace(f"{scope['method']} {scope['path']}") as root:
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    root.set_attribute("status", message["status"])
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [
+                        (b"x-trace-id", root.trace_id.encode())
+                    ]
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
+            route = route_template(scope)
+            if route is not None:
+                root.set_attribute("route", route)
+
+
+class TracingCommandListener(monitoring.CommandListener):
+    """Turns MongoDB commands into spans, Motor copies the caller's context into its executor"""
+
+    def __init__(self):
+        self._pending: Dict[tuple, tuple] = {}
+
+    def started(self, event):
+        trace = _current_trace.get()
+        if trace is None:
+            return
+        parent = _current_span.get()
+        current = Span(trace.trace_id, f"mongo.{event.command_name}",
+                       parent.span_id if parent else None,
+                       {"db": event.database_name,
+                        "collection": event.command.get(event.command_name)})
+        self._pending[(event.request_id, event.connection_id)] = (trace, current)
+
+    def _finish(self, event, status: str):
+        pending = self._pending.pop((event.request_id, event.connection_id), None)
+        if pending is None:
+            return
+        trace, current = pending
+        current.status = status
+        current.end(event.duration_micros / 1000)
+        trace.spans.append(current)
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "error")
+
+
+def render_waterfall(trace: Dict) -> str:
+    """Render a trace as a simple HTML waterfall"""
+    spans = trace["spans"]
+    if not spans:
+        return "<p>Empty trace</p>"
+    trace_start = min(s["start"] for s in spans)
+    total_ms = max((s["start"] - trace_start) * 1000 + (s["duration_ms"] or 0) for s in spans) or 1
+
+    depth = {}
+    by_id = {s["span_id"]: s for s in spans}
+
+    def get_depth(s):
+        if s["span_id"] not in depth:
+            parent = by_id.get(s["parent_id"])
+            depth[s["span_id"]] = get_depth(parent) + 1 if parent else 0
+        return depth[s["span_id"]]
+
+    rows = []
+    for s in spans:
+        offset = (s["start"] - trace_start) * 1000
+        left = offset / total_ms * 100
+        width = max((s["duration_ms"] or 0) / total_ms * 100, 0.2)
+        color = "#e57373" if s["status"] == "error" else "#7e57c2"
+        attrs = html.escape(", ".join(f"{k}={v}" for k, v in s["attributes"].items()), quote=True)
+        rows.append(
+            f"<tr><td style='padding-left:{get_depth(s) * 16}px' title='{attrs}'>{html.escape(s['name'])}</td>"
+            f"<td>{s['duration_ms']:.1f} ms</td>"
+            f"<td style='width:60%'><div style='margin-left:{left:.2f}%;width:{width:.2f}%;"
+            f"background:{color};height:12px'></div></td></tr>"
+        )
+    return (
+        f"<html><head><title>Trace {trace['trace_id']}</title></head><body style='font-family:sans-serif'>"
+        f"<h3>Trace {trace['trace_id']} ({total_ms:.1f} ms)</h3>"
+        f"<table style='width:100%;font-size:13px'>{''.join(rows)}</table></body></html>"
+    )
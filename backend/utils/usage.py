@@ -0,0 +1,194 @@
+from datetime import datetime, date
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import logging
+from config import get_settings
+from db.database import Database
+
+logger = logging.getLogger(__name__)
+
+# Stages of a diary turn that make an LLM call
+STAGE_MOOD = "mood"
+STAGE_REPLY = "reply"
+STAGE_CHECKIN = "checkin"
+
+
+def _read_usage(usage) -> Tuple[int, int, int]:
+    """Pull prompt, completion and cached token counts off an OpenAI usage object"""
+    if usage is None:
+        return 0, 0, 0
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = (getattr(details, "cached_tokens", 0) or 0) if details else 0
+    return prompt_tokens, completion_tokens, cached_tokens
+
+
+class UsageTracker:
+    """Collects token and latency usage of every LLM call and flushes it to MongoDB in batches"""
+    _instance = None
+
+    @classmethod
+    def get_instance(cls):
+        """Singleton pattern to share one tracker across the app"""
+        if cls._instance is None:
+            settings = get_settings()
+            cls._instance = cls(
+                batch_size=settings.usage_flush_batch_size,
+                flush_interval=settings.usage_flush_interval,
+                daily_token_quota=settings.daily_token_quota
+            )
+        return cls._instance
+
+    def __init__(self, batch_size: int = 100, flush_interval: float = 30.0,
+                 daily_token_quota: Optional[int] = None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.daily_token_quota = daily_token_quota
+        self._pending: List[Dict] = []
+        # user_id -> (day, tokens used that day), only holds users seen today
+        self._daily: Dict[str, Tuple[date, int]] = {}
+        self._daily_day: Optional[date] = None
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def record(self, user_id: str, stage: str, model: str, usage, latency_ms: float,
+               turn_id: Optional[str] = None):
+        """Record the usage of a single completion call"""
+        prompt_tokens, completion_tokens, cached_tokens = _read_usage(usage)
+        total_tokens = prompt_tokens + completion_tokens
+        now = datetime.now()
+
+        self._pending.append({
+            "user_id": user_id,
+            "turn_id": turn_id,
+            "stage": stage,
+            "model": model,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cached_tokens": cached_tokens,
+            "total_tokens": total_tokens,
+            "latency_ms": round(latency_ms, 2),
+            "timestamp": now
+        })
+
+        # Only bump counters already seeded today, check_quota seeds the rest from the database
+        day, used = self._daily.get(user_id, (None, 0))
+        if day == now.date():
+            self._daily[user_id] = (day, used + total_tokens)
+
+        if len(self._pending) >= self.batch_size:
+            try:
+                asyncio.get_running_loop().create_task(self.flush())
+            except RuntimeError:
+                # No running loop, the next flush will pick these up
+                pass
+
+    async def flush(self):
+        """Write all pending usage records to the usage collection"""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+            try:
+                await Database.get_db().usage.insert_many(batch, ordered=False)
+            except Exception as e:
+                logger.error(f"Failed to flush {len(batch)} usage records: {str(e)}")
+                # Put them back so they are retried on the next flush
+                self._pending = batch + self._pending
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        """Start the background flush loop"""
+        if self._flush_task is None:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_periodically())
+
+    async def stop(self):
+        """Stop the background flush loop and flush what is left"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+    async def _load_daily_tokens(self, user_id: str) -> int:
+        """Sum today's flushed tokens for a user from the usage collection"""
+        start_of_day = datetime.combine(date.today(), datetime.min.time())
+        pipeline = [
+            {"$match": {"user_id": user_id, "timestamp": {"$gte": start_of_day}}},
+            {"$group": {"_id": None, "tokens": {"$sum": "$total_tokens"}}}
+        ]
+        result = await Database.get_db().usage.aggregate(pipeline).to_list(length=1)
+        return result[0]["tokens"] if result else 0
+
+    async def check_quota(self, user_id: str) -> bool:
+        """Return False if the user has used up their daily token quota"""
+        if not self.daily_token_quota:
+            return True
+        today = date.today()
+        if self._daily_day != today:
+            # Counters from earlier days are never read again
+            self._daily = {}
+            self._daily_day = today
+        day, used = self._daily.get(user_id, (None, 0))
+        if day != today:
+            # First call for this user today in this process, seed from the database
+            try:
+                flushed = await self._load_daily_tokens(user_id)
+            except Exception as e:
+                logger.error(f"Failed to load daily usage for {user_id}: {str(e)}")
+                flushed = 0
+            pending = sum(
+                r["total_tokens"] for r in self._pending
+                if r["user_id"] == user_id and r["timestamp"].date() == today
+            )
+            used = flushed + pending
+            self._daily[user_id] = (today, used)
+        return used < self.daily_token_quota
+
+    async def get_report(self, user_id: Optional[str] = None, limit: int = 20) -> Dict:
+        """Aggregate usage by stage and model, plus the slowest and most expensive turns"""
+        await self.flush()
+        usage = Database.get_db().usage
+        match = {"user_id": user_id} if user_id else {}
+
+        totals = await usage.aggregate([
+            {"$match": match},
+            {"$group": {
+                "_id": {"stage": "$stage", "model": "$model"},
+                "calls": {"$sum": 1},
+                "prompt_tokens": {"$sum": "$prompt_tokens"},
+                "completion_tokens": {"$sum": "$completion_tokens"},
+                "cached_tokens": {"$sum": "$cached_tokens"},
+                "avg_latency_ms": {"$avg": "$latency_ms"},
+                "max_latency_ms": {"$max": "$latency_ms"}
+            }},
+            {"$sort": {"prompt_tokens": -1}}
+        ]).to_list(length=None)
+
+        turn_pipeline = [
+            {"$match": {**match, "turn_id": {"$ne": None}}},
+            {"$group": {
+                "_id": "$turn_id",
+                "user_id": {"$first": "$user_id"},
+                "timestamp": {"$min": "$timestamp"},
+                "calls": {"$sum": 1},
+                "total_tokens": {"$sum": "$total_tokens"},
+                "latency_ms": {"$sum": "$latency_ms"}
+            }}
+        ]
+        costliest = await usage.aggregate(
+            turn_pipeline + [{"$sort": {"total_tokens": -1}}, {"$limit": limit}]
+        ).to_list(length=limit)
+        slowest = await usage.aggregate(
+            turn_pipeline + [{"$sort": {"latency_ms": -1}}, {"$limit": limit}]
+        ).to_list(length=limit)
+
+        return {
+            "totals": [{**t.pop("_id"), **t} for t in totals],
+            "costliest_turns": [{"turn_id": t.pop("_id"), **t} for t in costliest],
+            "slowest_turns": [{"turn_id": t.pop("_id"), **t} for t in slowest]
+        }
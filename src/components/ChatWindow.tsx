@@ -42,7 +42,7 @@ const ChatWindow: React.FC<ChatWindowProps> = ({ messages, isLoading, messagesEn
   return (
     <div className="flex-1 overflow-y-auto animate-fade-in space-y-8">
       {messages.map((message, index) => (
-        <div key={index}>
+        <div key={message.seq ?? `pending-${index}`}>
           {message.role === 'user' ? (
             <div className="journal-page">
               <div className="date-header flex justify-between items-center">
@@ -1,6 +1,7 @@
 import React, { useEffect, useState } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { useAuth } from '../context/AuthContext';
+import { clearCachedHistory } from '../services/api';
 
 export default function NavBar() {
   const navigate = useNavigate();
@@ -30,6 +31,9 @@ export default function NavBar() {
   }, [user]);
 
   const handleLogout = () => {
+    if (user?.id) {
+      clearCachedHistory(user.id);
+    }
     localStorage.removeItem('token');
     localStorage.removeItem('user_id');
     setUser(null);
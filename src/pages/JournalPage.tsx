@@ -1,4 +1,4 @@
-import { useState, useRef, useEffect } from 'react';
+import { useState, useRef, useEffect, useCallback } from 'react';
 import Header from '../components/Header';
 import ChatWindow from '../components/ChatWindow';
 import ChatInput from '../components/ChatInput';
@@ -14,14 +14,35 @@ function JournalPage() {
   const messagesEndRef = useRef<HTMLDivElement>(null);
   const { user } = useAuth();
 
+  // Server messages replace local copies with the same seq, unsaved ones stay at the end
+  const mergeEntries = (prev: Message[], saved: Message[]) => {
+    const known = new Set(saved.map(m => m.seq));
+    return [...saved, ...prev.filter(m => m.seq === undefined || !known.has(m.seq))];
+  };
+
+  const syncHistory = useCallback(() => {
+    if (!user?.id) return;
+    // Only messages newer than the cached history are transferred
+    getConversationHistory(user.id)
+      .then(history => setEntries(prev => mergeEntries(prev, history)))
+      .catch(error => console.error('Error loading history:', error));
+  }, [user]);
+
   useEffect(() => {
     // Load user's conversation history when component mounts
-    if (user?.id) {
-      getConversationHistory(user.id)
-        .then(history => setEntries(history))
-        .catch(error => console.error('Error loading history:', error));
-    }
-  }, [user]);
+    syncHistory();
+
+    // Catch up after the connection drops or the tab was in the background
+    const onVisible = () => {
+      if (document.visibilityState === 'visible') syncHistory();
+    };
+    window.addEventListener('online', syncHistory);
+    document.addEventListener('visibilitychange', onVisible);
+    return () => {
+      window.removeEventListener('online', syncHistory);
+      document.removeEventListener('visibilitychange', onVisible);
+    };
+  }, [syncHistory]);
 
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
@@ -37,16 +58,29 @@ function JournalPage() {
     setHasFirstEntry(true);
     const timestamp = new Date().toISOString();
     
+    const userEntry: Message = { 
+      role: 'user', 
+      content: entry,
+      timestamp 
+    };
+
     try {
-      setEntries(prev => [...prev, { 
-        role: 'user', 
-        content: entry,
-        timestamp 
-      }]);
+      setEntries(prev => [...prev, userEntry]);
       setIsLoading(true);
 
       const response = await sendMessage(entry, timestamp, user.id); // Pass user ID
-      setEntries(prev => [...prev, response]);
+      const { seq } = response;
+      if (seq === undefined) {
+        setEntries(prev => [...prev, response]);
+      } else {
+        // The entry is saved just before the reply, give it its seq so a later sync does not repeat it
+        setEntries(prev => [
+          ...prev
+            .filter(m => m.seq !== seq && m.seq !== seq - 1)
+            .map(m => (m === userEntry ? { ...m, seq: seq - 1 } : m)),
+          response
+        ]);
+      }
     } catch (error) {
       console.error('Error:', error);
       setEntries(prev => [...prev, { 
@@ -1,4 +1,4 @@
-import { DiaryEntry, ChatResponse } from '../types';
+import { DiaryEntry, ChatResponse, Message } from '../types';
 import axios from 'axios';
 
 const API_BASE_URL = 'http://localhost:8000/api';
@@ -30,7 +30,7 @@ export async function sendMessage(
   content: string, 
   timestamp: string,
   userId: string
-): Promise<{ role: 'assistant', content: string, timestamp: string }> {
+): Promise<{ role: 'assistant', content: string, timestamp: string, seq?: number }> {
   const entry: DiaryEntry = {
     user_id: userId,
     content: content,
@@ -42,7 +42,8 @@ export async function sendMessage(
     return {
       role: 'assistant',
       content: response.data.response,
-      timestamp: new Date().toISOString()
+      timestamp: new Date().toISOString(),
+      seq: response.data.seq
     };
   } catch (error) {
     console.error('Error sending message:', error);
@@ -60,10 +61,55 @@ export async function getUserContext(userId: string) {
   }
 }
 
-export async function getConversationHistory(userId: string) {
+interface CachedHistory {
+  etag: string;
+  messages: Message[];
+}
+
+// Session storage survives reloads but not closing the tab
+const historyKey = (userId: string) => `history:${userId}`;
+
+function readCachedHistory(userId: string): CachedHistory | null {
   try {
-    const response = await api.get(`/conversation-history/${userId}`);
-    return response.data;
+    const cached = sessionStorage.getItem(historyKey(userId));
+    return cached ? JSON.parse(cached) : null;
+  } catch {
+    return null;
+  }
+}
+
+export function clearCachedHistory(userId: string) {
+  sessionStorage.removeItem(historyKey(userId));
+}
+
+// Only fetches messages newer than the cached ones, a 304 when nothing changed
+export async function getConversationHistory(userId: string): Promise<Message[]> {
+  const cached = readCachedHistory(userId);
+  const since = cached?.messages.length ? cached.messages[cached.messages.length - 1].seq : undefined;
+
+  try {
+    const response = await api.get(`/conversation-history/${userId}`, {
+      params: cached && since !== undefined ? { since } : undefined,
+      headers: cached ? { 'If-None-Match': cached.etag } : undefined,
+      validateStatus: (status) => (status >= 200 && status < 300) || status === 304,
+    });
+    if (response.status === 304 && cached) {
+      return cached.messages;
+    }
+
+    const delta: Message[] = response.data;
+    const head = Number(String(response.headers.etag || '').replace(/\D/g, ''));
+    // The server is only behind the cache when the history was deleted, start over
+    const isDelta = cached && since !== undefined && !(head < since);
+    const messages = isDelta ? [...cached.messages, ...delta] : delta;
+    if (response.headers.etag) {
+      try {
+        sessionStorage.setItem(historyKey(userId), JSON.stringify({ etag: response.headers.etag, messages }));
+      } catch {
+        clearCachedHistory(userId);
+      }
+    }
+    return messages;
   } catch (error) {
     console.error('Error fetching conversation history:', error);
     throw error;
@@ -2,6 +2,7 @@ export interface Message {
   role: 'user' | 'assistant';
   content: string;
   timestamp?: string;  // ISO string format
+  seq?: number;  // Server sequence id, missing until the message is saved
 }
 
 export interface DiaryEntry {
@@ -12,6 +13,7 @@ export interface DiaryEntry {
 
 export interface ChatResponse {
   response: string;
+  seq?: number;
   context: {
     mood?: string;
     recent_activities?: string[];